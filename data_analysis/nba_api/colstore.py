@@ -0,0 +1,174 @@
+#
+# On disk columnar store of pandas DataFrames.
+#
+# A frame is saved as a directory with one .npy file per column (plus a
+# .mask.npy file with the missing values of the columns having some) and
+# a frame.json file with the column names, kinds, number of rows and any
+# extra metadata of the caller. Numeric columns are memory mapped when
+# read back, strings are stored as fixed width unicode arrays, other
+# Python objects (mixed types...) are pickled as they are, and only the
+# requested columns are read.
+#
+# The column files of every write go to a new version subdirectory, and
+# frame.json (which names the version) is replaced last, atomically: a
+# reader sees either the old or the new frame, never a missing or half
+# written one. The previous version is kept for the readers that read
+# frame.json just before the replacement, older ones are removed.
+#
+
+import os
+import json
+import time
+import uuid
+import shutil
+
+import numpy as np
+import pandas as pd
+
+META_FILE = 'frame.json'
+VERSION_PREFIX = 'v-'
+# unreferenced versions older than that are leftovers of interrupted
+# writes (younger ones may be written by a concurrent writer)
+STALE_VERSION_S = 3600
+
+# -------------------------------------------------------------
+def _column_arrays(series):
+    """ (kind, values, missing mask or None) of a column """
+    missing = series.isna().to_numpy()
+    has_missing = bool(missing.any())
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind == 'M':
+        values = series.to_numpy().view(np.int64)
+        return 'datetime', values, missing if has_missing else None
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype) \
+            or pd.api.types.is_float_dtype(dtype):
+        if isinstance(dtype, np.dtype):
+            return 'numeric', series.to_numpy(), None
+        # nullable pandas arrays: the values under the mask are not used
+        fill = False if pd.api.types.is_bool_dtype(dtype) else 0
+        numpy_dtype = np.bool_ if pd.api.types.is_bool_dtype(dtype) else dtype.numpy_dtype
+        values = series.to_numpy(dtype=numpy_dtype, na_value=fill)
+        return 'nullable', values, missing if has_missing else None
+    objects = series.tolist()
+    if not all(isinstance(v, str) for v, m in zip(objects, missing) if not m):
+        # not only strings: kept as Python objects, missing values included
+        return 'object', np.array(objects + [None], dtype=object)[:-1], None
+    values = np.array(['' if m else v for v, m in zip(objects, missing)], dtype=str)
+    if values.dtype.itemsize == 0:
+        values = values.astype('<U1')
+    return 'string', values, missing if has_missing else None
+
+# -------------------------------------------------------------
+def _remove_versions(path, keep, stale):
+    """
+    removes the version subdirectories not in keep: at once the stale
+    ones, the unknown ones only when old (a concurrent write may be in
+    progress)
+    """
+    now = time.time()
+    for entry in os.scandir(path):
+        version = entry.name[len(VERSION_PREFIX):]
+        if not entry.name.startswith(VERSION_PREFIX) or version in keep:
+            continue
+        try:
+            if version in stale or now - entry.stat().st_mtime > STALE_VERSION_S:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+# -------------------------------------------------------------
+def write_frame(df, path, meta=None):
+    """
+    Saves df in the directory path (replaced if existing); meta is
+    stored with the frame and returned by read_meta()
+    """
+    os.makedirs(path, exist_ok=True)
+    previous = read_meta(path)
+    version = uuid.uuid4().hex[:16]
+    version_dir = os.path.join(path, VERSION_PREFIX + version)
+    os.makedirs(version_dir)
+    try:
+        columns = []
+        for k, name in enumerate(df.columns):
+            kind, values, missing = _column_arrays(df[name])
+            fname = f"c{k:03d}"
+            np.save(os.path.join(version_dir, fname + '.npy'), values, allow_pickle=(kind == 'object'))
+            if missing is not None:
+                np.save(os.path.join(version_dir, fname + '.mask.npy'), missing)
+            columns.append({'name': str(name), 'file': fname, 'kind': kind,
+                            'dtype': str(df[name].dtype), 'mask': missing is not None})
+        tmp = os.path.join(path, f".{META_FILE}.{version}")
+        with open(tmp, 'w') as fmeta:
+            json.dump({'n_rows': len(df), 'columns': columns, 'meta': meta or {},
+                       'version': version,
+                       'previous': previous.get('version') if previous else None}, fmeta, indent=1)
+        os.replace(tmp, os.path.join(path, META_FILE))
+    except BaseException:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    keep = {version}
+    stale = set()
+    if previous is not None:
+        keep.add(previous.get('version'))
+        stale.add(previous.get('previous'))
+    _remove_versions(path, keep, stale)
+
+# -------------------------------------------------------------
+def read_meta(path):
+    """ the frame.json content of a saved frame, None if missing """
+    try:
+        with open(os.path.join(path, META_FILE)) as fmeta:
+            return json.load(fmeta)
+    except FileNotFoundError:
+        return None
+
+# -------------------------------------------------------------
+def _read_columns(path, info, names, mmap):
+    by_name = {column['name']: column for column in info['columns']}
+    version_dir = os.path.join(path, VERSION_PREFIX + info['version'])
+    data = {}
+    for name in names:
+        column = by_name[name]
+        fname = os.path.join(version_dir, column['file'])
+        kind = column['kind']
+        if kind == 'object':
+            data[name] = pd.Series(np.load(fname + '.npy', allow_pickle=True), dtype=object)
+            continue
+        values = np.load(fname + '.npy', mmap_mode='r' if mmap else None)
+        missing = np.load(fname + '.mask.npy') if column['mask'] else None
+        if kind == 'numeric':
+            data[name] = values
+        elif kind == 'datetime':
+            series = pd.Series(np.asarray(values).view(column['dtype']))
+            data[name] = series.mask(missing) if missing is not None else series
+        elif kind == 'nullable':
+            values = np.array(values)
+            data[name] = pd.array(values, dtype=column['dtype']) if missing is None else \
+                pd.arrays.BooleanArray(values, missing) if values.dtype == np.bool_ else \
+                pd.arrays.IntegerArray(values, missing) if values.dtype.kind in 'iu' else \
+                pd.arrays.FloatingArray(values, missing)
+        else:
+            values = np.asarray(values).astype(object)
+            if missing is not None:
+                values[missing] = None
+            data[name] = pd.Series(values, dtype=object if column['dtype'] == 'object' else None)
+    return data
+
+def read_frame(path, columns=None, mmap=True):
+    """
+    Loads a saved frame, only the given columns (all by default);
+    numeric columns without missing values are memory mapped
+    """
+    for attempt in range(3):
+        info = read_meta(path)
+        if info is None:
+            raise FileNotFoundError(f"no frame saved in {path}")
+        names = [column['name'] for column in info['columns']] if columns is None else list(columns)
+        try:
+            data = _read_columns(path, info, names, mmap)
+            break
+        except FileNotFoundError:
+            # the version just read was removed by two writes meanwhile
+            if attempt == 2:
+                raise
+    return pd.DataFrame(data, columns=names, copy=False)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#
+# Incremental local store of the LeagueGameFinder game logs.
+#
+# Games are partitioned by season and team, root/<SEASON_ID>/<TEAM_ID>/,
+# and every partition is a list of append-only segments (colstore
+# frames: one binary .npy file per column). An update asks nba_api only
+# for the games from the latest stored GAME_DATE of the team on, drops
+# the ones already stored (same GAME_ID) and writes the new games as one
+# new segment per touched partition: existing data is never rewritten
+# (compact() merges the segments of a partition when they get many). The
+# manifest lists the segments of every partition and is written last, so
+# the segments of an interrupted update are never read. A load reads
+# only the partitions of the requested seasons/teams and only the
+# requested columns (plus the sort keys).
+#
+# The store directory is $NBA_STORE_DIR, or ~/.cache/nba_api/games by
+# default. Offline (see nbacache) the games come from the local stand-in.
+#
+# Example:
+#   ./gamestore.py --update 1610612744
+#   ./gamestore.py --load --seasons 22018 22019 --columns GAME_DATE MATCHUP PTS
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+
+import pandas as pd
+
+from colstore import write_frame, read_frame
+from nbacache import offline_mode, warn_standin, fetch_games, standin_games
+
+MANIFEST_FILE = 'manifest.json'
+SORT_KEYS = ['GAME_DATE', 'GAME_ID']
+
+# -------------------------------------------------------------
+def default_store_dir():
+    return os.environ.get('NBA_STORE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'nba_api', 'games'))
+
+# -------------------------------------------------------------
+def fetch_new_games(team_id, date_from=None):
+    """
+    Games of the team from date_from ('YYYY-MM-DD', included) on; from
+    the local stand-in when offline
+    """
+    if offline_mode():
+        warn_standin(f"games of team {team_id}")
+        games = standin_games(team_id)
+        if date_from is not None:
+            games = games[games['GAME_DATE'].astype(str) >= date_from]
+        return games
+    params = {'team_id_nullable': team_id}
+    if date_from is not None:
+        params['date_from_nullable'] = pd.Timestamp(date_from).strftime('%m/%d/%Y')
+    return fetch_games(**params)
+
+# -------------------------------------------------------------
+class GameStore:
+    """
+    Partitioned, append-only store of game logs, see the module header
+    """
+    def __init__(self, root=None):
+        self.root = root or default_store_dir()
+        os.makedirs(self.root, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST_FILE)) as fin:
+                return json.load(fin)
+        except FileNotFoundError:
+            return {'teams': {}, 'partitions': {}}
+
+    def _write_manifest(self):
+        fname = os.path.join(self.root, MANIFEST_FILE)
+        with open(fname + '.tmp', 'w') as fout:
+            json.dump(self.manifest, fout, indent=1)
+        os.replace(fname + '.tmp', fname)
+
+    def _partition_dir(self, season_id, team_id):
+        return os.path.join(self.root, str(season_id), str(team_id))
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def append(self, games):
+        """
+        Appends games not stored yet (by team: newer than its latest
+        stored GAME_DATE, or same date and GAME_ID not stored); returns
+        the number of appended games
+        """
+        games = games.assign(GAME_DATE=games['GAME_DATE'].astype(str),
+                             GAME_ID=games['GAME_ID'].astype(str))
+        n_new = 0
+        for team_id, team_games in games.groupby('TEAM_ID', sort=False):
+            mark = self.manifest['teams'].get(str(team_id))
+            if mark is not None:
+                newer = (team_games['GAME_DATE'] > mark['last_date']) | \
+                        ((team_games['GAME_DATE'] == mark['last_date']) &
+                         ~team_games['GAME_ID'].isin(mark['last_ids']))
+                team_games = team_games[newer]
+            team_games = team_games.drop_duplicates('GAME_ID')
+            if len(team_games) == 0:
+                continue
+            for season_id, season_games in team_games.groupby('SEASON_ID', sort=False):
+                key = f"{season_id}/{team_id}"
+                part = self.manifest['partitions'].setdefault(
+                    key, {'segments': [], 'next': 0, 'rows': 0})
+                segment = f"seg-{part['next']:05d}"
+                write_frame(season_games.reset_index(drop=True),
+                            os.path.join(self._partition_dir(season_id, team_id), segment))
+                part['segments'].append(segment)
+                part['next'] += 1
+                part['rows'] += len(season_games)
+            last_date = team_games['GAME_DATE'].max()
+            last_ids = team_games.loc[team_games['GAME_DATE'] == last_date, 'GAME_ID'].tolist()
+            if mark is not None and mark['last_date'] == last_date:
+                last_ids = sorted(set(last_ids) | set(mark['last_ids']))
+            self.manifest['teams'][str(team_id)] = {
+                'last_date': last_date, 'last_ids': last_ids,
+                'rows': (mark['rows'] if mark is not None else 0) + len(team_games)}
+            n_new += len(team_games)
+            # the manifest is written after the segments: an interrupted
+            # update is just redone by the next one
+            self._write_manifest()
+        return n_new
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def update(self, team_id, fetch=fetch_new_games):
+        """
+        Fetches and appends the games of the team newer than the stored
+        ones; returns the number of new games
+        """
+        mark = self.manifest['teams'].get(str(team_id))
+        games = fetch(team_id, mark['last_date'] if mark is not None else None)
+        return self.append(games) if len(games) else 0
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _partitions(self, seasons=None, teams=None):
+        seasons = None if seasons is None else {str(s) for s in seasons}
+        teams = None if teams is None else {str(t) for t in teams}
+        for key in sorted(self.manifest['partitions']):
+            season_id, team_id = key.split('/')
+            if (seasons is None or season_id in seasons) and (teams is None or team_id in teams):
+                yield season_id, team_id
+
+    def load(self, columns=None, seasons=None, teams=None):
+        """
+        Games of the given seasons and teams (all by default), only the
+        given columns, most recent first
+        """
+        read = None if columns is None else list(dict.fromkeys(list(columns) + SORT_KEYS))
+        frames = []
+        for season_id, team_id in self._partitions(seasons, teams):
+            part_dir = self._partition_dir(season_id, team_id)
+            for segment in self.manifest['partitions'][f"{season_id}/{team_id}"]['segments']:
+                frames.append(read_frame(os.path.join(part_dir, segment), read))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        games = pd.concat(frames, ignore_index=True)
+        games = games.sort_values(SORT_KEYS, ascending=False, ignore_index=True)
+        return games if columns is None else games[list(columns)]
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def compact(self, min_segments=8):
+        """ merges the segments of the partitions having at least min_segments """
+        for season_id, team_id in list(self._partitions()):
+            part = self.manifest['partitions'][f"{season_id}/{team_id}"]
+            if len(part['segments']) < min_segments:
+                continue
+            games = self.load(seasons=[season_id], teams=[team_id])
+            part_dir = self._partition_dir(season_id, team_id)
+            merged = f"seg-{part['next']:05d}"
+            write_frame(games, os.path.join(part_dir, merged))
+            old, part['segments'] = part['segments'], [merged]
+            part['next'] += 1
+            self._write_manifest()
+            # removed once the manifest no longer lists them
+            for segment in old:
+                shutil.rmtree(os.path.join(part_dir, segment), ignore_errors=True)
+
+# -------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Incremental local store of the NBA game logs')
+    parser.add_argument('--store-dir', default=None)
+    parser.add_argument('--update', type=int, nargs='+', metavar='TEAM_ID',
+                        help='fetch and append the new games of these teams')
+    parser.add_argument('--load', action='store_true', help='load and print the stored games')
+    parser.add_argument('--seasons', nargs='+', help='SEASON_ID of the games to load')
+    parser.add_argument('--teams', nargs='+', help='TEAM_ID of the games to load')
+    parser.add_argument('--columns', nargs='+', help='columns to load')
+    parser.add_argument('--compact', action='store_true', help='merge the segments of the partitions')
+    args = parser.parse_args(argv)
+
+    store = GameStore(args.store_dir)
+    for team_id in args.update or []:
+        t0 = time.perf_counter()
+        n_new = store.update(team_id)
+        print(f"team {team_id}: {n_new} new games in {time.perf_counter() - t0:.2f} s")
+    if args.compact:
+        store.compact(min_segments=2)
+    if args.load:
+        t0 = time.perf_counter()
+        games = store.load(args.columns, args.seasons, args.teams)
+        print(f"{len(games)} games loaded in {(time.perf_counter() - t0) * 1000:.1f} ms")
+        print(games)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
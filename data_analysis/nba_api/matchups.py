@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# Precomputed matchup index of a LeagueGameFinder games frame.
+#
+# The MATCHUP strings ("GSW vs. TOR" at home, "GSW @ TOR" away) are
+# parsed once, vectorized, into categorical TEAM, OPPONENT and HOME
+# columns; the games are then sorted by (team, opponent, home) and the
+# start/end row of every group is stored in a dense 3-D table of codes,
+# so a head-to-head lookup is an O(1) slice of the sorted frame instead
+# of a full string comparison of the MATCHUP column. A report over all
+# the matchups is one groupby on the category codes.
+#
+# Example:
+#   ./matchups.py GSW TOR
+#
+
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# -------------------------------------------------------------
+def parse_matchups(matchup):
+    """
+    (team, opponent, home) Series from a MATCHUP column: team and
+    opponent categorical, home boolean
+    """
+    parts = matchup.astype(str).str.extract(r'^(\w+)\s+(vs\.|@)\s+(\w+)$')
+    categories = sorted(pd.concat([parts[0], parts[2]]).dropna().unique())
+    team = pd.Categorical(parts[0], categories=categories)
+    opponent = pd.Categorical(parts[2], categories=categories)
+    return (pd.Series(team, index=matchup.index, name='TEAM'),
+            pd.Series(opponent, index=matchup.index, name='OPPONENT'),
+            pd.Series((parts[1] == 'vs.').to_numpy(), index=matchup.index, name='HOME'))
+
+# -------------------------------------------------------------
+class MatchupIndex:
+    """
+    Games frame sorted by (team, opponent, home) with the row range of
+    every group: see the module header
+    """
+    def __init__(self, games):
+        team, opponent, home = parse_matchups(games['MATCHUP'])
+        games = games.assign(TEAM=team, OPPONENT=opponent, HOME=home)
+        self.teams = list(team.cat.categories)
+        self._code = {abbr: k for k, abbr in enumerate(self.teams)}
+        n_teams = len(self.teams)
+
+        valid = (team.cat.codes >= 0) & (opponent.cat.codes >= 0)
+        games = games[valid.to_numpy()]
+        t = games['TEAM'].cat.codes.to_numpy(np.int64)
+        o = games['OPPONENT'].cat.codes.to_numpy(np.int64)
+        h = games['HOME'].to_numpy(np.int64)
+        group = (t * n_teams + o) * 2 + h
+        # stable: each group keeps the original (date) order of the games
+        order = np.argsort(group, kind='stable')
+        self.games = games.iloc[order].reset_index(drop=True)
+        counts = np.bincount(group, minlength=n_teams * n_teams * 2)
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        self._start = bounds[:-1].reshape(n_teams, n_teams, 2)
+        self._stop = bounds[1:].reshape(n_teams, n_teams, 2)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _range(self, team, opponent, home):
+        t, o, h = self._code.get(team), self._code.get(opponent), int(bool(home))
+        if t is None or o is None:
+            return 0, 0
+        return self._start[t, o, h], self._stop[t, o, h]
+
+    def games_of(self, team, opponent, home=None):
+        """
+        Games of team against opponent: at home, away, or both
+        (home=None, home games first)
+        """
+        if home is not None:
+            start, stop = self._range(team, opponent, home)
+            return self.games.iloc[start:stop]
+        # away and home groups are adjacent in the sort order
+        start, _ = self._range(team, opponent, False)
+        _, stop = self._range(team, opponent, True)
+        both = self.games.iloc[start:stop]
+        return pd.concat([both[both['HOME']], both[~both['HOME']]]) if len(both) else both
+
+    def home_games(self, team, opponent):
+        return self.games_of(team, opponent, True)
+
+    def away_games(self, team, opponent):
+        return self.games_of(team, opponent, False)
+
+    def count(self, team, opponent, home):
+        start, stop = self._range(team, opponent, home)
+        return int(stop - start)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def report(self, season_id=None):
+        """
+        Every (team, opponent, home) matchup of a season (all the seasons
+        by default) with games, wins, mean points and mean plus/minus, in
+        one groupby
+        """
+        games = self.games
+        if season_id is not None:
+            games = games[games['SEASON_ID'].astype(str) == str(season_id)]
+        games = games.assign(WIN=(games['WL'] == 'W'))
+        return (games.groupby(['TEAM', 'OPPONENT', 'HOME'], observed=True, sort=True)
+                .agg(GAMES=('GAME_ID', 'size'), WINS=('WIN', 'sum'), PTS=('PTS', 'mean'),
+                     PLUS_MINUS=('PLUS_MINUS', 'mean'))
+                .reset_index())
+
+# -------------------------------------------------------------
+def main(argv=None):
+    import time
+    from nbacache import find_games
+
+    parser = argparse.ArgumentParser(description='Head-to-head games from the matchup index')
+    parser.add_argument('team', nargs='?', default='GSW')
+    parser.add_argument('opponent', nargs='?', default='TOR')
+    args = parser.parse_args(argv)
+
+    games = find_games()
+    t0 = time.perf_counter()
+    index = MatchupIndex(games)
+    t_index = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for team in index.teams:
+        for opponent in index.teams:
+            index.home_games(team, opponent)
+            index.away_games(team, opponent)
+    t_lookup = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for team in index.teams:
+        for opponent in index.teams:
+            games[games['MATCHUP'] == f"{team} vs. {opponent}"]
+            games[games['MATCHUP'] == f"{team} @ {opponent}"]
+    t_scan = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    report = index.report()
+    t_report = time.perf_counter() - t0
+
+    n_pairs = len(index.teams) ** 2
+    print(f"{len(games)} games, index built in {t_index * 1000:.1f} ms; {n_pairs} pairs: "
+          f"index lookups {t_lookup * 1000:.1f} ms, string filters {t_scan * 1000:.1f} ms; "
+          f"all matchups report {t_report * 1000:.1f} ms")
+    print(index.home_games(args.team, args.opponent)[['GAME_DATE', 'MATCHUP', 'WL', 'PTS', 'PLUS_MINUS']])
+    print(report[(report['TEAM'] == args.team) & (report['OPPONENT'] == args.opponent)])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
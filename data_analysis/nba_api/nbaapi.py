@@ -3,83 +3,26 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-from nba_api.stats.static import teams
-from nba_api.stats.endpoints import leaguegamefinder
 
-# -------------------------------------------------------------
-def one_dict(list_dict):
-    """
-    converts a list of dictionaries on a dictionary of lists.
-    Example:
-       [
-         {'a_key': 'a_value_1', 'b_key': 'b_value_1'},
-         {'a_key': 'a_value_2', 'b_key': 'b_value_2'}
-       ]
-    becomes:
-       {
-         'a_key': ['a_value_1', 'a_value_2'],
-         'b_key': ['b_value_1', 'b_value_2'],
-       }
-    This is useful to process data with Pandas. The output of this
-    function ca be used to build a Panda DataSet using the DataFrame
-    constructor
-    """
-
-    # This extract the keys
-    keys = list_dict[0].keys()
-    # keys = ['a_key', 'b_key']
-
-    # initialize dictionary
-    out_dict = {key: [] for key in keys}
-    # out_dict = {'a_key': [], 'b_key': []}
-
-    for dict_ in list_dict:
-        # for every element (dictionary) in input list, e.g.:
-        #   {'a_key': 'a_value_1', 'b_key': 'b_value_1'}
-        for key, value in dict_.items():
-            # extract the key,value pairs, e.g.:
-            #   'a_key', 'a_value_1'
-            # and insert the value in the correct list of the
-            # output dictionary, e.g.:
-            #   out_dict['a_key'].append('a_value_1')
-            out_dict[key].append(value)
-            # after first iteration, for example out_dict will be:
-            #   out_dict = {'a_key': ['a_value_1'], 'b_key': []}
-        # after first complete execution of the internal loop:
-        #   out_dict = {'a_key': ['a_value_1'], 'b_key': ['b_value_1']}
-
-    # after completation of all iterations:
-    #   out_dict = {
-    #     'a_key': ['a_value_1', 'a_value_2'],
-    #     'b_key': ['b_value_1', 'b_value_2'],
-    #   }
-    return out_dict
+from nbacache import get_teams, find_games
+from matchups import MatchupIndex
 
 # -------------------------------------------------------------
 # ********************************************************************************
 # MAIN
 # ********************************************************************************
 def main():
-
     #dict_ = { 'a': [11, 21, 31], 'b': [12, 22, 32]}
     #df = pd.DataFrame(dict_)
     #print(type(df))
     #print(df)
     #print(df.mean())
 
-    # gets the teams using nba-api.
-    nba_teams = teams.get_teams()
-    #print(type(nba_teams))
-    #print(nba_teams)
-    #print(nba_teams[0].keys())
-
-    # get_teams() returns a list, we convert it to a dictionary
-    dict_nba_teams = one_dict(nba_teams)
-    #print(type(dict_nba_teams))
-    #print(dict_nba_teams)
-
-    # converts the dictionary to a Pandas data frame
-    df_teams = pd.DataFrame(dict_nba_teams)
+    # gets the teams using nba-api: teams.get_teams() returns a list of
+    # dictionaries, converted to a Pandas data frame (columnar.py: typed
+    # columns built chunk by chunk) and kept in the local response cache
+    # (nbacache.py), so later runs do not call nba-api
+    df_teams = get_teams()
     #print(df_teams.head(10))
     #            id              full_name abbreviation   nickname          city          state  year_founded
     # 0  1610612737          Atlanta Hawks          ATL      Hawks       Atlanta        Atlanta          1949
@@ -109,11 +52,9 @@ def main():
     # <class 'pandas.core.series.Series'>
 
     # 3. find the games of the Warriors
-    gfinder = leaguegamefinder.LeagueGameFinder(team_id_nullable = id_warriors)
-    #print(gfinder)
-    full_df = gfinder.get_data_frames()
-    #print(full_df)
-    games = full_df[0]
+    # (through the response cache: historical games are not downloaded
+    # again at every run; with NBA_OFFLINE=1, a synthetic stand-in answers)
+    games = find_games(team_id_nullable = int(id_warriors.iloc[0]))
     #print(games.head())
     #   SEASON_ID     TEAM_ID TEAM_ABBREVIATION              TEAM_NAME     GAME_ID   GAME_DATE      MATCHUP WL  MIN  PTS  FGM  FGA  FG_PCT  FG3M  FG3A  FG3_PCT  FTM  FTA  FT_PCT  OREB  DREB   REB  AST  STL  BLK  TOV  PF  PLUS_MINUS
     # 0     22019  1610612744               GSW  Golden State Warriors  0021900967  2020-03-10  GSW vs. LAC  L  239  107   37   79   0.468    11  38.0    0.289   22   27   0.815   4.0  31.0  35.0   25    3    0    9  17       -24.0
@@ -127,8 +68,11 @@ def main():
     # GSW
     opposite_team_abbr = 'TOR'
 
-    games_home = games[games['MATCHUP'] == f"{team_abbr} vs. {opposite_team_abbr}"]
-    games_away = games[games['MATCHUP'] == f"{team_abbr} @ {opposite_team_abbr}"]
+    # MATCHUP ("GSW vs. TOR" home, "GSW @ TOR" away) is parsed once into
+    # team/opponent/home columns: every head-to-head is then a slice
+    matchups = MatchupIndex(games)
+    games_home = matchups.home_games(team_abbr, opposite_team_abbr)
+    games_away = matchups.away_games(team_abbr, opposite_team_abbr)
     #print(games_home)
     #      SEASON_ID     TEAM_ID TEAM_ABBREVIATION              TEAM_NAME     GAME_ID   GAME_DATE      MATCHUP WL  MIN  PTS  FGM  FGA  FG_PCT  FG3M  FG3A  FG3_PCT  FTM  FTA  FT_PCT  OREB  DREB   REB  AST  STL  BLK  TOV  PF  PLUS_MINUS
     # 2        22019  1610612744               GSW  Golden State Warriors  0021900929  2020-03-05  GSW vs. TOR  L  240  113   40   98   0.408    14  52.0    0.269   19   25   0.760  14.0  38.0  52.0   34    4    5   15  23        -8.0
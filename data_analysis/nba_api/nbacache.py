@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+#
+# Persistent response cache of the nba_api calls used by nbaapi.py.
+#
+# Responses (as DataFrames) are stored on disk with colstore, one entry
+# per endpoint and parameters. An entry younger than its TTL is returned
+# as is; an older one, within the stale-while-revalidate window, is
+# returned at once while a background thread fetches a fresh copy;
+# beyond that window the call waits for the fresh copy (and falls back
+# to the stale one when the fetch fails, e.g. without network).
+#
+# Offline mode ($NBA_OFFLINE=1) never touches the network: cached entries
+# are used regardless of their age, and on a miss a local stand-in
+# (synthetic teams and game logs, with a warning) answers. Without
+# nba_api installed, only offline mode can run.
+#
+# The cache directory is $NBA_CACHE_DIR, or ~/.cache/nba_api by default.
+#
+# Example:
+#   ./nbacache.py --info
+#   ./nbacache.py --clear
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+from colstore import write_frame, read_frame, read_meta
+from columnar import records_to_frame
+
+HOUR_S = 3600
+DAY_S = 24 * HOUR_S
+
+# (ttl, stale-while-revalidate window) of the endpoints, in seconds
+ENDPOINT_TTL = {
+    'teams': (30 * DAY_S, 365 * DAY_S),
+    'leaguegamefinder': (12 * HOUR_S, 7 * DAY_S),
+}
+
+# -------------------------------------------------------------
+def default_cache_dir():
+    return os.environ.get('NBA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'nba_api'))
+
+# -------------------------------------------------------------
+def offline_mode():
+    return os.environ.get('NBA_OFFLINE', '0') not in ('', '0')
+
+# -------------------------------------------------------------
+def warn_standin(what):
+    print(f"nbacache: offline, {what} from the synthetic stand-in (not real NBA data)",
+          file=sys.stderr)
+
+# -------------------------------------------------------------
+# stand-in of the nba_api calls, for the offline runs
+STANDIN_TEAMS = [
+    (1610612737, 'Atlanta Hawks', 'ATL', 'Hawks', 'Atlanta', 'Atlanta', 1949),
+    (1610612738, 'Boston Celtics', 'BOS', 'Celtics', 'Boston', 'Massachusetts', 1946),
+    (1610612739, 'Cleveland Cavaliers', 'CLE', 'Cavaliers', 'Cleveland', 'Ohio', 1970),
+    (1610612740, 'New Orleans Pelicans', 'NOP', 'Pelicans', 'New Orleans', 'Louisiana', 2002),
+    (1610612741, 'Chicago Bulls', 'CHI', 'Bulls', 'Chicago', 'Illinois', 1966),
+    (1610612742, 'Dallas Mavericks', 'DAL', 'Mavericks', 'Dallas', 'Texas', 1980),
+    (1610612743, 'Denver Nuggets', 'DEN', 'Nuggets', 'Denver', 'Colorado', 1976),
+    (1610612744, 'Golden State Warriors', 'GSW', 'Warriors', 'Golden State', 'California', 1946),
+    (1610612745, 'Houston Rockets', 'HOU', 'Rockets', 'Houston', 'Texas', 1967),
+    (1610612746, 'Los Angeles Clippers', 'LAC', 'Clippers', 'Los Angeles', 'California', 1970),
+    (1610612761, 'Toronto Raptors', 'TOR', 'Raptors', 'Toronto', 'Ontario', 1995),
+]
+TEAM_FIELDS = ['id', 'full_name', 'abbreviation', 'nickname', 'city', 'state', 'year_founded']
+GAME_FIELDS = ['SEASON_ID', 'TEAM_ID', 'TEAM_ABBREVIATION', 'TEAM_NAME', 'GAME_ID', 'GAME_DATE',
+               'MATCHUP', 'WL', 'MIN', 'PTS', 'FGM', 'FGA', 'FG_PCT', 'FG3M', 'FG3A', 'FG3_PCT',
+               'FTM', 'FTA', 'FT_PCT', 'OREB', 'DREB', 'REB', 'AST', 'STL', 'BLK', 'TOV', 'PF',
+               'PLUS_MINUS']
+
+def standin_teams():
+    return [dict(zip(TEAM_FIELDS, team)) for team in STANDIN_TEAMS]
+
+def standin_games(team_id_nullable=None, seasons=range(2015, 2020), games_per_season=82):
+    """
+    Synthetic LeagueGameFinder rows: every team of STANDIN_TEAMS (or the
+    given one) plays games_per_season games per season against the
+    others, home or away
+    """
+    rng = np.random.default_rng(0)
+    records = []
+    game_id = 0
+    for season in seasons:
+        for _ in range(games_per_season * len(STANDIN_TEAMS) // 2):
+            home, away = rng.choice(len(STANDIN_TEAMS), 2, replace=False)
+            date = pd.Timestamp(f"{season}-10-20") + pd.Timedelta(days=int(game_id % 170))
+            pts = rng.integers(85, 135, 2)
+            for side, (team, opp) in enumerate(((home, away), (away, home))):
+                team_id, name, abbr = STANDIN_TEAMS[team][:3]
+                if team_id_nullable is not None and team_id != int(team_id_nullable):
+                    continue
+                sign = ' vs. ' if side == 0 else ' @ '
+                made = int(pts[side] * 0.37)
+                records.append(dict(zip(GAME_FIELDS, (
+                    f"2{season}", team_id, abbr, name, f"002{season % 100:02d}{game_id:05d}",
+                    date.strftime('%Y-%m-%d'), abbr + sign + STANDIN_TEAMS[opp][2],
+                    'W' if pts[side] > pts[1 - side] else 'L', 240, int(pts[side]), made, 85,
+                    round(made / 85, 3), 12, 35.0, 0.343, 18, 23, 0.783, 10.0, 34.0, 44.0,
+                    24, 8, 5, 14, 20, float(pts[side] - pts[1 - side])))))
+            game_id += 1
+    records.sort(key=lambda r: (r['GAME_DATE'], r['GAME_ID']), reverse=True)
+    return records_to_frame(records)
+
+# -------------------------------------------------------------
+def _import_error(exc):
+    return ImportError(f"{exc}: install nba_api, or set NBA_OFFLINE=1 to use the synthetic stand-in")
+
+def fetch_teams():
+    try:
+        from nba_api.stats.static import teams
+    except ImportError as exc:
+        raise _import_error(exc) from exc
+    return records_to_frame(teams.get_teams())
+
+def fetch_games(**params):
+    try:
+        from nba_api.stats.endpoints import leaguegamefinder
+    except ImportError as exc:
+        raise _import_error(exc) from exc
+    return leaguegamefinder.LeagueGameFinder(**params).get_data_frames()[0]
+
+# -------------------------------------------------------------
+class ResponseCache:
+    """
+    Cache of endpoint responses (DataFrames), see the module header
+    """
+    def __init__(self, cache_dir=None, offline=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.offline = offline_mode() if offline is None else offline
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def key(endpoint, params):
+        text = json.dumps([endpoint, params], sort_keys=True, default=str)
+        return endpoint + '-' + hashlib.sha256(text.encode()).hexdigest()[:20]
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _store(self, key, endpoint, params, df):
+        write_frame(df, self._path(key), {'endpoint': endpoint, 'params': params,
+                                          'fetched_at': time.time()})
+
+    def _refresh(self, key, endpoint, params, fetch):
+        try:
+            self._store(key, endpoint, params, fetch(**params))
+        except Exception as exc:
+            print(f"nbacache: refresh of {endpoint} {params} failed: {exc}", file=sys.stderr)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh_in_background(self, key, endpoint, params, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return None
+            self._refreshing.add(key)
+        thread = threading.Thread(target=self._refresh, args=(key, endpoint, params, fetch),
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get(self, endpoint, params, fetch, standin=None, ttl=None, swr=None):
+        """
+        Response of endpoint with params (a JSON serializable dict):
+        fetch(**params) calls the endpoint, standin(**params) answers
+        offline when the entry is not cached
+        """
+        default_ttl, default_swr = ENDPOINT_TTL.get(endpoint, (DAY_S, DAY_S))
+        ttl = default_ttl if ttl is None else ttl
+        swr = default_swr if swr is None else swr
+        key = self.key(endpoint, params)
+        info = read_meta(self._path(key))
+        if info is not None:
+            age = time.time() - info['meta']['fetched_at']
+            if self.offline or age <= ttl:
+                return read_frame(self._path(key))
+            if age <= ttl + swr:
+                self._refresh_in_background(key, endpoint, params, fetch)
+                return read_frame(self._path(key))
+        if self.offline:
+            if standin is None:
+                raise LookupError(f"{endpoint} {params} not cached and no stand-in (offline)")
+            warn_standin(f"{endpoint} {params}")
+            return standin(**params)
+        try:
+            df = fetch(**params)
+        except Exception:
+            if info is None:
+                raise
+            print(f"nbacache: {endpoint} unreachable, using the stale cached copy", file=sys.stderr)
+            return read_frame(self._path(key))
+        self._store(key, endpoint, params, df)
+        return df
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def entries(self):
+        """ [(key, frame info)] of the cached responses """
+        entries = []
+        for key in sorted(os.listdir(self.cache_dir)):
+            info = read_meta(self._path(key))
+            if info is not None:
+                entries.append((key, info))
+        return entries
+
+    def invalidate(self, endpoint=None):
+        for key, info in self.entries():
+            if endpoint is None or info['meta']['endpoint'] == endpoint:
+                shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def clear(self):
+        self.invalidate()
+
+# -------------------------------------------------------------
+_default_cache = None
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
+
+# -------------------------------------------------------------
+def get_teams(cache=None):
+    """ teams.get_teams(), as a DataFrame, through the cache """
+    cache = cache or default_cache()
+    return cache.get('teams', {}, fetch_teams,
+                     standin=lambda: records_to_frame(standin_teams()))
+
+# -------------------------------------------------------------
+def find_games(cache=None, **params):
+    """ LeagueGameFinder(**params).get_data_frames()[0], through the cache """
+    cache = cache or default_cache()
+    params = {name: (int(value) if isinstance(value, (np.integer, int)) else value)
+              for name, value in params.items()}
+    return cache.get('leaguegamefinder', params, fetch_games, standin=standin_games)
+
+# -------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Persistent cache of the nba_api responses')
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--info', action='store_true', help='list the cached responses')
+    parser.add_argument('--clear', action='store_true', help='remove all the cached responses')
+    args = parser.parse_args(argv)
+
+    cache = ResponseCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+    for key, info in cache.entries():
+        age_h = (time.time() - info['meta']['fetched_at']) / HOUR_S
+        print(f"{key}: {info['meta']['endpoint']} {info['meta']['params']}, "
+              f"{info['n_rows']} rows, {age_h:.1f} h old")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#
+# California housing dataset, cached locally as a binary .npy file.
+#
+# The first time, the cal_housing.tgz archive is downloaded (or a local
+# copy is used) and its data file is parsed, streaming, straight from the
+# archive into a .npy file; later runs only memory map the .npy file, so
+# they start in milliseconds and do not need the network.
+#
+# The cache directory is $PWP_DATA_DIR, or ~/.cache/pwp by default.
+#
+
+import os
+import shutil
+import tarfile
+import tempfile
+from urllib.request import urlopen
+
+import numpy as np
+
+HOUSING_URL = 'http://www.dcc.fc.up.pt/~ltorgo/Regression/cal_housing.tgz'
+HOUSING_MEMBER = 'CaliforniaHousing/cal_housing.data'
+HOUSING_NPY = 'cal_housing.npy'
+HOUSING_TGZ = 'cal_housing.tgz'
+HOUSING_COLUMNS = ['longitude', 'latitude', 'housing_median_age', 'total_rooms', 'total_bedrooms',
+                   'population', 'households', 'median_income', 'median_house_value']
+
+CHUNK_ROWS = 1 << 16
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def data_dir():
+    return os.environ.get('PWP_DATA_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'pwp'))
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def _atomic_path(fname):
+    # temporary file in the same directory, renamed over fname when complete
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname) or '.', suffix='.tmp')
+    os.close(fd)
+    return tmp
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def fetch_tarball(fname, url=HOUSING_URL):
+    """
+    Downloads the archive to fname, streaming (no full copy in memory)
+    """
+    tmp = _atomic_path(fname)
+    try:
+        with urlopen(url) as response, open(tmp, 'wb') as fout:
+            shutil.copyfileobj(response, fout)
+        os.replace(tmp, fname)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return fname
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def convert_tarball(tar_fname, npy_fname, member=HOUSING_MEMBER, chunk_rows=CHUNK_ROWS):
+    """
+    Parses the comma separated data file of the archive into a float64
+    .npy file. The file is read from the archive in chunks of rows (C
+    parser of pandas), appended as raw data, then the .npy header is
+    written in front of it. Returns the shape of the array.
+    """
+    import pandas as pd
+
+    raw = _atomic_path(npy_fname)
+    tmp = _atomic_path(npy_fname)
+    n_rows = n_cols = 0
+    try:
+        with tarfile.open(tar_fname, mode='r:*') as archive, open(raw, 'wb') as fraw:
+            for chunk in pd.read_csv(archive.extractfile(member), header=None, dtype=np.float64,
+                                     chunksize=chunk_rows):
+                values = np.ascontiguousarray(chunk.to_numpy())
+                n_rows += values.shape[0]
+                n_cols = values.shape[1]
+                fraw.write(values.tobytes())
+        with open(tmp, 'wb') as fout, open(raw, 'rb') as fraw:
+            np.lib.format.write_array_header_1_0(
+                fout, {'descr': np.lib.format.dtype_to_descr(np.dtype(np.float64)),
+                       'fortran_order': False, 'shape': (n_rows, n_cols)})
+            shutil.copyfileobj(fraw, fout)
+        os.replace(tmp, npy_fname)
+    finally:
+        for fname in (raw, tmp):
+            if os.path.exists(fname):
+                os.remove(fname)
+    return n_rows, n_cols
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def load_housing(tarball=None, directory=None, url=HOUSING_URL):
+    """
+    The housing data as a read only memory mapped (rows, 9) float64
+    array (columns as in HOUSING_COLUMNS). It is converted from the
+    local tarball, or from the archive downloaded from url, only when
+    the .npy copy does not exist yet.
+    """
+    directory = directory or data_dir()
+    npy_fname = os.path.join(directory, HOUSING_NPY)
+    if not os.path.exists(npy_fname):
+        os.makedirs(directory, exist_ok=True)
+        if tarball is None:
+            tarball = os.path.join(directory, HOUSING_TGZ)
+            if not os.path.exists(tarball):
+                fetch_tarball(tarball, url)
+        convert_tarball(tarball, npy_fname)
+    return np.load(npy_fname, mmap_mode='r')
@@ -1,19 +1,76 @@
-import matplotlib.pyplot as plt
+#
+# Annotation helpers for matplotlib axes (shared by playwithplots and
+# tramrun: tramrun.py imports this file from data_analysis/playwithplots).
+#
+# The axes aspect (y data length equivalent to an x data length) is
+# cached per axes and recomputed only after a change of the axes limits
+# or of the axes size in pixels. The mplu_real*s/mplu_arrows/mplu_lines
+# functions add thousands of annotations as one collection, drawn in a
+# single pass; circles, squares and arrows are rebuilt at draw time when
+# the aspect has changed, so they stay round/square after a zoom or a
+# resize (arrows are sized in points, as mplu_arrow).
+#
+
+import weakref
+
+import numpy as np
 from matplotlib.patches import Ellipse, Rectangle
 from matplotlib.patches import FancyArrowPatch, ArrowStyle, ConnectionPatch
 from matplotlib.patheffects import withStroke
+from matplotlib.collections import PolyCollection, LineCollection
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+class AxesAspect:
+    """
+    y data length equivalent to one x data length in an axes, cached
+    """
+    _cache = weakref.WeakKeyDictionary()
+
+    def __init__(self, ax):
+        self._ax = weakref.ref(ax)
+        self._ratio = None
+        self._x_per_point = None
+        self._size = None
+        # the callbacks only mark the ratio as stale: reading the limits
+        # from a limit change callback can trigger a pending autoscale
+        ax.callbacks.connect('xlim_changed', self._invalidate)
+        ax.callbacks.connect('ylim_changed', self._invalidate)
+
+    @classmethod
+    def of(cls, ax):
+        aspect = cls._cache.get(ax)
+        if aspect is None:
+            aspect = cls._cache[ax] = cls(ax)
+        return aspect
+
+    def _invalidate(self, ax=None):
+        self._ratio = None
+
+    def _update(self):
+        ax = self._ax()
+        # covers figure resize, dpi and layout changes
+        size = (ax.bbox.width, ax.bbox.height)
+        if self._ratio is None or size != self._size:
+            xlim0, xlim1 = ax.get_xlim()
+            ylim0, ylim1 = ax.get_ylim()
+            self._ratio = ((ylim1 - ylim0) * size[0]) / ((xlim1 - xlim0) * size[1])
+            self._x_per_point = (xlim1 - xlim0) / size[0] * ax.figure.dpi / 72
+            self._size = size
+
+    @property
+    def ratio(self):
+        self._update()
+        return self._ratio
+
+    @property
+    def x_per_point(self):
+        """ x data length of one point (1/72 inch) """
+        self._update()
+        return self._x_per_point
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - -
 def convert_x_len_in_equivalent_y_len(ax, x):
-    x0, y0 = ax.transAxes.transform((0,0)) # lower left in pixels
-    x1, y1 = ax.transAxes.transform((1,1)) # upper right in pixes
-    dx = x1 - x0
-    dy = y1 - y0
-    xlim0, xlim1 = ax.get_xlim()
-    ylim0, ylim1 = ax.get_ylim()
-    dx_data = xlim1 - xlim0
-    dy_data = ylim1 - ylim0
-    return x * (dy_data * dx) / (dx_data * dy)
+    return x * AxesAspect.of(ax).ratio
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - -
 def mplu_realcircle(ax, x, y, x_radius):
@@ -59,3 +116,263 @@ def mplu_line(ax, x0, y0, x1, y1, **kwargs):
     line.set_linewidth(_lwidth)
     ax.add_artist(line)
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+class AspectPolyCollection(PolyCollection):
+    """
+    Collection of polygons whose shape depends on the axes aspect:
+    build(ratio) returns their vertices, shaped (n, k, 2), in data
+    coordinates; it is called again at draw time only when the aspect
+    has changed. With in_points=True, build(ratio, x_per_point) also
+    gets the x data length of one point, and is called again when it
+    changes too.
+    """
+    def __init__(self, ax, build, in_points=False, **kwargs):
+        super().__init__([], closed=True, **kwargs)
+        self._build = build
+        self._in_points = in_points
+        self._state = None
+        self.set_transform(ax.transData)
+
+    def _update_verts(self):
+        aspect = AxesAspect.of(self.axes)
+        state = (aspect.ratio, aspect.x_per_point) if self._in_points else (aspect.ratio,)
+        if state != self._state:
+            self.set_verts(self._build(*state), closed=True)
+            self._state = state
+
+    def draw(self, renderer):
+        self._update_verts()
+        super().draw(renderer)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def _add_aspect_collection(ax, build, kwargs, in_points=False):
+    collection = AspectPolyCollection(ax, build, in_points, **kwargs)
+    ax.add_collection(collection, autolim=False)
+    return collection
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def mplu_realcircles(ax, x, y, x_radius, n_vertices=64, **kwargs):
+    """
+    Circles (round in pixels) of radius x_radius (x data units) centered
+    in (x, y), as one collection; x, y and x_radius can be arrays
+    """
+    x, y, x_radius = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (x, y, x_radius)))
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    unit = np.stack((np.cos(angles), np.sin(angles)), axis=1)
+
+    def build(ratio):
+        verts = unit[None, :, :] * x_radius.ravel()[:, None, None] * [1.0, ratio]
+        return verts + np.stack((x.ravel(), y.ravel()), axis=1)[:, None, :]
+
+    style = dict(clip_on=False, zorder=10, linewidth=1, edgecolor='black', facecolor=(0, 0, 0, .0125),
+                 path_effects=[withStroke(linewidth=5, foreground='w')])
+    style.update(kwargs)
+    return _add_aspect_collection(ax, build, style)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def mplu_realsquares(ax, x, y, x_side, **kwargs):
+    """
+    Squares (square in pixels) with the lower left corner in (x, y) and
+    side x_side (x data units), as one collection
+    """
+    x, y, x_side = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (x, y, x_side)))
+    unit = np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]])
+
+    def build(ratio):
+        verts = unit[None, :, :] * x_side.ravel()[:, None, None] * [1.0, ratio]
+        return verts + np.stack((x.ravel(), y.ravel()), axis=1)[:, None, :]
+
+    style = dict(color='black')
+    style.update(kwargs)
+    return _add_aspect_collection(ax, build, style)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def mplu_arrows(ax, x0, y0, x1, y1, scale=25, width=None, head_width=None, head_length=None,
+                shrink=2, **kwargs):
+    """
+    Arrows from (x0, y0) to (x1, y1), as one collection, drawn as
+    mplu_arrow: the sizes are in points, by default head width and
+    length scale, shaft width scale/5, and both ends shrunk by shrink
+    """
+    x0, y0, x1, y1 = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64).ravel()
+                                           for v in (x0, y0, x1, y1)))
+    width = 0.2 * scale if width is None else width
+    head_width = scale if head_width is None else head_width
+    head_length = scale if head_length is None else head_length
+
+    def build(ratio, x_per_point):
+        # the arrows are built where x and y units have the same length in pixels
+        start = np.stack((x0, y0 / ratio), axis=1)
+        end = np.stack((x1, y1 / ratio), axis=1)
+        length = np.hypot(*(end - start).T)
+        along = (end - start) / np.where(length > 0, length, 1.0)[:, None]
+        normal = np.stack((-along[:, 1], along[:, 0]), axis=1)
+        cut = np.minimum(shrink * x_per_point, length / 2)[:, None]
+        start, end = start + along * cut, end - along * cut
+        half_w = width / 2 * x_per_point
+        half_hw = head_width / 2 * x_per_point
+        head_l = np.minimum(head_length * x_per_point, length - 2 * cut[:, 0])[:, None]
+        neck = end - along * head_l
+        verts = np.stack((start + normal * half_w, neck + normal * half_w,
+                          neck + normal * half_hw, end,
+                          neck - normal * half_hw, neck - normal * half_w,
+                          start - normal * half_w), axis=1)
+        return verts * [1.0, ratio]
+
+    style = dict(color='black')
+    style.update(kwargs)
+    return _add_aspect_collection(ax, build, style, in_points=True)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def mplu_lines(ax, x0, y0, x1, y1, **kwargs):
+    """
+    Segments from (x0, y0) to (x1, y1), as one LineCollection ('width'
+    is the line width, as in mplu_line)
+    """
+    x0, y0, x1, y1 = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64).ravel()
+                                           for v in (x0, y0, x1, y1)))
+    segments = np.stack((np.stack((x0, y0), axis=1), np.stack((x1, y1), axis=1)), axis=1)
+    style = dict(color='black', linewidth=kwargs.pop('width', 4))
+    style.update(kwargs)
+    lines = LineCollection(segments, **style)
+    ax.add_collection(lines, autolim=False)
+    return lines
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+class BinnedGrid:
+    """
+    Count and sum of values of the points falling in every cell of a 2-D
+    grid, built scanning the data once, in chunks (the data can be memory
+    mapped). xscale/yscale 'log' make the cells equal on a log axis.
+    """
+    def __init__(self, x_edges, y_edges, counts, sums=None):
+        self.x_edges = x_edges
+        self.y_edges = y_edges
+        self.counts = counts
+        self.sums = sums
+
+    @staticmethod
+    def edges(data, n_bins, scale='linear', lim=None):
+        if lim is not None:
+            lo, hi = lim
+        elif scale == 'log':
+            # points <= 0 do not fit a log axis and fall outside the grid
+            positive = np.asarray(data)[np.asarray(data) > 0]
+            lo, hi = np.min(positive), np.max(positive)
+        else:
+            lo, hi = np.nanmin(data), np.nanmax(data)
+        if scale == 'log':
+            return np.geomspace(lo, hi, n_bins + 1)
+        return np.linspace(lo, hi, n_bins + 1)
+
+    @staticmethod
+    def _index(data, edges, scale):
+        if scale == 'log':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                data = np.log(np.where(data > 0, data, np.nan))
+            edges = np.log(edges)
+        idx = np.floor((data - edges[0]) * ((len(edges) - 1) / (edges[-1] - edges[0])))
+        idx = np.where(np.isnan(idx), -1, idx).astype(np.int64)
+        # the upper edge belongs to the last cell, as in np.histogram
+        idx[data == edges[-1]] = len(edges) - 2
+        return idx
+
+    @classmethod
+    def scan(cls, x, y, values=None, bins=(200, 200), xscale='linear', yscale='linear',
+             xlim=None, ylim=None, chunk_rows=1 << 20):
+        nx, ny = bins
+        x_edges = cls.edges(x, nx, xscale, xlim)
+        y_edges = cls.edges(y, ny, yscale, ylim)
+        counts = np.zeros(nx * ny, dtype=np.int64)
+        sums = np.zeros(nx * ny) if values is not None else None
+        for k in range(0, len(x), chunk_rows):
+            ix = cls._index(np.asarray(x[k:k + chunk_rows], dtype=np.float64), x_edges, xscale)
+            iy = cls._index(np.asarray(y[k:k + chunk_rows], dtype=np.float64), y_edges, yscale)
+            inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+            cell = ix[inside] * ny + iy[inside]
+            counts += np.bincount(cell, minlength=nx * ny)
+            if sums is not None:
+                chunk_values = np.asarray(values[k:k + chunk_rows], dtype=np.float64)[inside]
+                sums += np.bincount(cell, weights=chunk_values, minlength=nx * ny)
+        return cls(x_edges, y_edges, counts.reshape(nx, ny),
+                   sums.reshape(nx, ny) if sums is not None else None)
+
+    def grid(self, reduce='mean'):
+        """ (nx, ny) grid of counts or of mean values, NaN in empty cells """
+        if reduce == 'count':
+            return np.where(self.counts > 0, self.counts, np.nan)
+        if reduce != 'mean' or self.sums is None:
+            raise ValueError("reduce shall be 'count', or 'mean' when values are given")
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums / self.counts
+
+# binned grids of the last scans, so that redraws do not rescan the data:
+# {key: (grid, arrays)}, the arrays are held so that their buffers (part
+# of the key) cannot be freed and reused by other arrays
+_binned_cache = {}
+_BINNED_CACHE_LEN = 8
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def _array_key(a):
+    # identity of the data buffer: arrays are assumed not to change in place
+    if a is None:
+        return None
+    a = np.asarray(a)
+    return a.__array_interface__['data'][0], a.shape, a.strides, a.dtype.str
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def binned_grid(x, y, values=None, bins=(200, 200), xscale='linear', yscale='linear',
+                xlim=None, ylim=None):
+    """ BinnedGrid.scan(), cached """
+    key = (_array_key(x), _array_key(y), _array_key(values), tuple(bins), xscale, yscale,
+           None if xlim is None else tuple(xlim), None if ylim is None else tuple(ylim))
+    entry = _binned_cache.pop(key, None)
+    if entry is None:
+        entry = (BinnedGrid.scan(x, y, values, bins, xscale, yscale, xlim, ylim), (x, y, values))
+        if len(_binned_cache) >= _BINNED_CACHE_LEN:
+            _binned_cache.pop(next(iter(_binned_cache)))
+    _binned_cache[key] = entry
+    return entry[0]
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def mplu_density(ax, x, y, values=None, bins=(200, 200), reduce=None, log=False,
+                 xscale='linear', yscale='linear', **kwargs):
+    """
+    Density plot of the points as one image: the count (or the mean of
+    values, when given) of every cell of a bins grid; log=True uses a
+    logarithmic color scale. Returns the image (or mesh, for log axes).
+    """
+    from matplotlib.colors import LogNorm
+
+    grid = binned_grid(x, y, values, bins, xscale, yscale)
+    reduce = reduce or ('mean' if values is not None else 'count')
+    z = grid.grid(reduce).T
+    if log:
+        kwargs.setdefault('norm', LogNorm())
+    ax.set_xscale(xscale)
+    ax.set_yscale(yscale)
+    if xscale == 'linear' and yscale == 'linear':
+        extent = (grid.x_edges[0], grid.x_edges[-1], grid.y_edges[0], grid.y_edges[-1])
+        return ax.imshow(z, origin='lower', extent=extent, aspect='auto', interpolation='nearest', **kwargs)
+    # equal cells on a log axis are not equal in data units: one mesh
+    return ax.pcolormesh(grid.x_edges, grid.y_edges, z, **kwargs)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - -
+def mplu_hist(ax, data, bins='auto', log=False, chunk_rows=1 << 20, **kwargs):
+    """
+    Histogram drawn as one step artist (ax.stairs), counted in chunks;
+    'auto' bins are taken from a sample of at most 1e6 points
+    """
+    data = np.asarray(data)
+    if isinstance(bins, str):
+        step = max(1, len(data) // 1000000)
+        bins = np.histogram_bin_edges(np.asarray(data[::step], dtype=np.float64), bins,
+                                      range=(np.nanmin(data), np.nanmax(data)))
+    counts = np.zeros(len(bins) - 1, dtype=np.int64)
+    for k in range(0, len(data), chunk_rows):
+        counts += np.histogram(data[k:k + chunk_rows], bins)[0]
+    kwargs.setdefault('fill', True)
+    artist = ax.stairs(counts, bins, **kwargs)
+    if log:
+        ax.set_yscale('log')
+    return artist
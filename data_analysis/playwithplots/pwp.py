@@ -6,15 +6,14 @@
 
 import os
 import sys
-from io import BytesIO
-import tarfile
-from urllib.request import urlopen
 
 import numpy as np
 
 import matplotlib.pyplot as plt
 import seaborn as sns
 from plotutils import mplu_realcircle, mplu_text, mplu_realsquare, mplu_arrow, mplu_line
+from plotutils import mplu_density, mplu_hist
+from housing import load_housing
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - -
 def linspace_1_to_10():
@@ -94,15 +93,13 @@ def two_subplots():
     ax2.yaxis.tick_right()
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - -
-def three_subplots_advanced():
-    # prepare data
-    url = 'http://www.dcc.fc.up.pt/~ltorgo/Regression/cal_housing.tgz'
-    b = BytesIO(urlopen(url).read())
-    fpath = 'CaliforniaHousing/cal_housing.data'
-    with tarfile.open(mode='r', fileobj=b) as archive:
-        housing = np.loadtxt(archive.extractfile(fpath), delimiter=',')
+def three_subplots_advanced(tarball=None, aggregate=False):
+    # prepare data (downloaded and converted only the first time, then
+    # memory mapped from the local .npy copy, see housing.py)
+    housing = load_housing(tarball)
     y = housing[:, -1]
-    pop, age = housing[:, [4, 7]].T
+    # column views of the memory map, not copies
+    pop, age = housing[:, 4], housing[:, 7]
 
     # prepare the plot
     gridsize = (3, 2)
@@ -113,11 +110,19 @@ def three_subplots_advanced():
 
     ax1.set_title('Home value as a function of home age & area population',
                   fontsize=14)
-    sctr = ax1.scatter(x=age, y=pop, c=y, cmap="RdYlGn")
-    plt.colorbar(sctr, ax=ax1, format='$%d')
-    ax1.set_yscale('log')
-    ax2.hist(age, bins='auto')
-    ax3.hist(pop, bins='auto', log=True)
+    if aggregate:
+        # for millions of records: mean home value per cell, one image
+        # per plot, and histograms counted in chunks
+        sctr = mplu_density(ax1, age, pop, y, bins=(100, 100), yscale='log', cmap="RdYlGn")
+        plt.colorbar(sctr, ax=ax1, format='$%d')
+        mplu_hist(ax2, age)
+        mplu_hist(ax3, pop, log=True)
+    else:
+        sctr = ax1.scatter(x=age, y=pop, c=y, cmap="RdYlGn")
+        plt.colorbar(sctr, ax=ax1, format='$%d')
+        ax1.set_yscale('log')
+        ax2.hist(age, bins='auto')
+        ax3.hist(pop, bins='auto', log=True)
 
     add_titlebox(ax2, 'Histogram: home age')
     add_titlebox(ax3, 'Histogram: area population (log scl.)')
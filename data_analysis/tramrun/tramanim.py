@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+#
+# Real time animation of a tram run: the AVL estimate chasing the real
+# position, the error band and the tag readings.
+#
+# The trace (a scenario, or a replay written by tramreplay) is played at
+# wall clock speed (times --speed): at every frame the samples elapsed
+# since the previous frame are reduced to one point (positions) and to
+# their min/max (error band), so the 4 ms stream is decimated to the
+# display frame rate. Only the animated artists are redrawn, over a
+# cached background (blitting); the whole figure is redrawn only when
+# the time window scrolls. Frames whose deadline has already passed are
+# dropped, and the achieved FPS and the dropped frames are reported.
+#
+# Example:
+#   ./tramanim.py --scenario constant_speed_then_soft_stop_odo_delay_with_tag --speed 0.5
+#   ./tramanim.py --replay replay_out --speed 60 --window 120
+#   ./tramanim.py --headless --speed 20        (no display, just the FPS report)
+#
+
+import sys
+import time
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from trammodel import SCENARIOS
+
+AnimStats = namedtuple('AnimStats', ['frames', 'dropped', 'redraws', 'elapsed_s', 'fps'])
+
+# ---------------------------------------------------
+def tag_read_steps(trace, tolerance=1e-3):
+    """
+    Steps where the AVL estimate was reset by a tag: the estimate does
+    not move by the odometer delta
+    """
+    jump = np.diff(trace.avl_pos) - trace.odo[1:]
+    return np.nonzero(np.abs(jump) > tolerance)[0] + 1
+
+# ---------------------------------------------------
+def _padded(lo, hi, pad=0.05):
+    span = (hi - lo) or 1.0
+    return lo - pad * span, hi + pad * span
+
+# ---------------------------------------------------
+class TramAnimator:
+    """
+    Blitted animation of a TramTrace; window_s is the width of the time
+    axis (the whole run when None)
+    """
+    def __init__(self, trace, title='', fps=30, speed=1.0, window_s=None, err_ylim=None):
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import PolyCollection
+
+        self.trace = trace
+        self.fps = fps
+        self.speed = speed
+        self.t = np.asarray(trace.t)
+        self.window_s = window_s if window_s is not None else float(self.t[-1] - self.t[0]) or 1.0
+        n_frames = int(np.ceil((self.t[-1] - self.t[0]) / speed * fps)) + 2
+        # decimated history: one entry per drawn frame
+        self._hist = np.empty((n_frames, 5))   # t, real, avl, err min, err max
+        self._n = 0
+        self._page_first = 0
+        self._tag_steps = tag_read_steps(trace)
+
+        self.fig, self.ax_err = plt.subplots()
+        self.ax_err.set_xlabel('time (s)')
+        self.ax_err.set_ylabel('Error (m)', color='blue')
+        self.ax_err.set_ylim(err_ylim if err_ylim is not None else
+                             _padded(min(0.0, float(np.min(trace.error))), float(np.max(trace.error))))
+        self.ax = self.ax_err.twinx()
+        self.ax.set_ylabel('Tram position (m)')
+        self.ax.set_title(title)
+
+        self.band = PolyCollection([np.zeros((0, 2))], color='lightblue', animated=True)
+        self.ax_err.add_collection(self.band, autolim=False)
+        self.real_line, = self.ax.plot([], [], color='tab:green', animated=True)
+        self.avl_line, = self.ax.plot([], [], color='firebrick', animated=True)
+        self.tag_marks, = self.ax.plot([], [], linestyle='none', marker='v', markersize=9,
+                                       color='black', animated=True)
+        self.ax.legend([self.real_line, self.avl_line, self.tag_marks],
+                       ['real pos', 'estimated pos', 'tag reading'], loc=(0.05, 0.78))
+        self._background = None
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _set_page(self, t_now):
+        """ moves the time window to the one including t_now: full redraw """
+        t0 = float(self.t[0])
+        page = int((t_now - t0) // self.window_s)
+        x0 = t0 + page * self.window_s
+        x1 = x0 + self.window_s
+        self.ax_err.set_xlim(x0, x1)
+        i0, i1 = np.searchsorted(self.t, [x0, x1])
+        i1 = max(i1, i0 + 1)
+        self.ax.set_ylim(_padded(float(min(self.trace.real_pos[i0:i1].min(), self.trace.avl_pos[i0:i1].min())),
+                                 float(max(self.trace.real_pos[i0:i1].max(), self.trace.avl_pos[i0:i1].max()))))
+        self._page_first = max(self._n - 1, 0)
+        self._page_end = x1
+        self.fig.canvas.draw()
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _push(self, i_prev, i):
+        """ reduces the samples (i_prev, i] to one history entry """
+        err = self.trace.error[i_prev + 1:i + 1]
+        self._hist[self._n] = (self.t[i], self.trace.real_pos[i], self.trace.avl_pos[i],
+                               err.min(), err.max())
+        self._n += 1
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _draw_frame(self, i):
+        canvas = self.fig.canvas
+        canvas.restore_region(self._background)
+        hist = self._hist[self._page_first:self._n]
+        self.real_line.set_data(hist[:, 0], hist[:, 1])
+        self.avl_line.set_data(hist[:, 0], hist[:, 2])
+        band = np.concatenate((np.stack((hist[:, 0], np.maximum(hist[:, 4], 0.0)), axis=1),
+                               np.stack((hist[::-1, 0], np.minimum(hist[::-1, 3], 0.0)), axis=1)))
+        self.band.set_verts([band])
+        tags = self._tag_steps[self._tag_steps <= i]
+        self.tag_marks.set_data(self.t[tags], self.trace.avl_pos[tags])
+        self.ax_err.draw_artist(self.band)
+        for artist in (self.real_line, self.avl_line, self.tag_marks):
+            self.ax.draw_artist(artist)
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def run(self, realtime=True):
+        """
+        Plays the whole trace; with realtime=False the frames are drawn
+        as fast as possible (every frame is drawn, none is dropped).
+        Returns an AnimStats
+        """
+        n = len(self.t)
+        t_first = float(self.t[0])
+        frame_s = 1.0 / self.fps
+        frames = dropped = redraws = 0
+        i_prev = -1
+        self._set_page(t_first)
+        start = time.perf_counter()
+        k = 0
+        while i_prev < n - 1:
+            if realtime:
+                now = time.perf_counter() - start
+                late = int(now // frame_s) - k
+                if late > 0:
+                    # deadlines already missed: skip to the current frame
+                    dropped += late
+                    k += late
+                elif late < 0:
+                    time.sleep(k * frame_s - now)
+            t_sim = t_first + k * frame_s * self.speed
+            i = min(int(np.searchsorted(self.t, t_sim, side='right')) - 1, n - 1)
+            k += 1
+            if i <= i_prev:
+                continue
+            self._push(i_prev, i)
+            if self.t[i] > self._page_end:
+                self._set_page(float(self.t[i]))
+                redraws += 1
+            self._draw_frame(i)
+            frames += 1
+            i_prev = i
+        elapsed = time.perf_counter() - start
+        return AnimStats(frames, dropped, redraws, elapsed, frames / elapsed if elapsed > 0 else 0.0)
+
+# ---------------------------------------------------
+def load_trace(scenario_name=None, replay_dir=None):
+    """ (trace, title) of a scenario or of a tramreplay output directory """
+    if replay_dir is not None:
+        from tramtrace import TraceStore
+        return TraceStore.open(replay_dir).as_trace(), f"replay of {replay_dir}"
+    from tramcache import simulate_scenario_cached
+    scenario = next(s for s in SCENARIOS if s.name == scenario_name)
+    return simulate_scenario_cached(scenario), scenario.name
+
+# ---------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Real time animation of a tram run')
+    parser.add_argument('--scenario', default=SCENARIOS[-1].name, choices=[s.name for s in SCENARIOS])
+    parser.add_argument('--replay', metavar='DIR', help='animate a tramreplay output directory')
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--speed', type=float, default=1.0, help='playback speed (x real time)')
+    parser.add_argument('--window', type=float, help='time window width (s), default the whole run')
+    parser.add_argument('--headless', action='store_true', help='no display (Agg backend)')
+    parser.add_argument('--max-fps', action='store_true',
+                        help='draw frames as fast as possible instead of in real time')
+    args = parser.parse_args(argv)
+
+    if args.headless:
+        import matplotlib
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    sns.set_style('darkgrid')
+    trace, title = load_trace(args.scenario, args.replay)
+    animator = TramAnimator(trace, title, args.fps, args.speed, args.window)
+    if not args.headless:
+        plt.show(block=False)
+        plt.pause(0.1)
+    stats = animator.run(realtime=not args.max_fps)
+    print(f"{stats.frames} frames in {stats.elapsed_s:.2f} s: {stats.fps:.1f} FPS "
+          f"(target {args.fps:g}), {stats.dropped} dropped, {stats.redraws} full redraws")
+    if not args.headless:
+        plt.show()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
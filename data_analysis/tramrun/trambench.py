@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#
+# Benchmark suite of the tramrun simulation engines.
+#
+# Every engine (the reference step loop and the faster ones) is timed on
+# a grid of run lengths, sampling periods, number of tags and odometer
+# delays. Throughput (samples/s, of the best and of the median of the
+# repeated runs) and peak memory of every case are written to a JSON
+# file; a previous file can be given to spot regressions. The 'vec'
+# cases where the speed callback has no vectorized twin (sampling
+# periods other than the default) are marked as 'callback' speed: they
+# time the per step fallback, not the vectorized engine.
+#
+# Example:
+#   ./trambench.py --out bench_new.json --compare bench_old.json
+#
+
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+from trammodel import POS_SAMPLING_PERIOD_MS, START_POS
+from trammodel import update_speed_constant_until2_then_soft_bracking, simulate_loop
+from tramtags import TagLayout
+from tramvec import simulate, has_speed_twin
+from tramstream import stream_chunks
+from tramevent import simulate_events
+
+V0 = 19.4
+
+# ---------------------------------------------------
+def run_loop(t_end_ms, tags, odo_delay_ms, pos_period_ms):
+    # plain tag list: linear scan, as in the tram_run_* functions
+    simulate_loop(t_end_ms, V0, update_speed_constant_until2_then_soft_bracking,
+                  tags.tolist(), odo_delay_ms, pos_period_ms=pos_period_ms)
+
+def run_loop_sorted_tags(t_end_ms, tags, odo_delay_ms, pos_period_ms):
+    simulate_loop(t_end_ms, V0, update_speed_constant_until2_then_soft_bracking,
+                  TagLayout(tags), odo_delay_ms, pos_period_ms=pos_period_ms)
+
+def run_vec(t_end_ms, tags, odo_delay_ms, pos_period_ms):
+    simulate(t_end_ms, V0, update_speed_constant_until2_then_soft_bracking, tags,
+             odo_delay_ms, pos_period_ms=pos_period_ms)
+
+def run_stream(t_end_ms, tags, odo_delay_ms, pos_period_ms):
+    for _ in stream_chunks(t_end_ms, V0, update_speed_constant_until2_then_soft_bracking,
+                           tags, odo_delay_ms):
+        pass
+
+def run_event(t_end_ms, tags, odo_delay_ms, pos_period_ms):
+    simulate_events(t_end_ms, V0, update_speed_constant_until2_then_soft_bracking,
+                    tags, odo_delay_ms)
+
+# engine: (function, supports sampling periods other than the default)
+ENGINES = {
+    'loop': (run_loop, True),
+    'loop_sorted_tags': (run_loop_sorted_tags, True),
+    'vec': (run_vec, True),
+    'stream': (run_stream, False),
+    'event': (run_event, False),
+}
+
+# ---------------------------------------------------
+def bench_tags(n_tags, t_end_ms):
+    """ n_tags evenly spread over the distance travelled by the tram """
+    distance = max(V0 * min(t_end_ms, 2000) / 1000, 1.0)
+    return START_POS + np.linspace(0, distance, n_tags + 2)[1:-1]
+
+# ---------------------------------------------------
+def bench_case(engine, length_s, pos_period_ms, n_tags, odo_delay_ms, repeat):
+    func, _ = ENGINES[engine]
+    t_end_ms = int(length_s * 1000)
+    tags = bench_tags(n_tags, t_end_ms)
+    args = (t_end_ms, tags, odo_delay_ms, pos_period_ms)
+
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - t0)
+    best = min(times)
+    median = float(np.median(times))
+
+    # memory is measured in a separate run: tracemalloc slows down the loop
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n_samples = t_end_ms // pos_period_ms + 1
+    vectorized = engine != 'vec' or has_speed_twin(update_speed_constant_until2_then_soft_bracking,
+                                                   pos_period_ms)
+    return {'engine': engine, 'length_s': length_s, 'pos_period_ms': pos_period_ms,
+            'n_tags': n_tags, 'odo_delay_ms': odo_delay_ms, 'n_samples': n_samples,
+            'speed': 'vectorized' if vectorized else 'callback', 'repeat': repeat,
+            'time_s': best, 'median_time_s': median,
+            'samples_per_s': n_samples / best, 'median_samples_per_s': n_samples / median,
+            'peak_mem_bytes': peak}
+
+# ---------------------------------------------------
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+# ---------------------------------------------------
+def case_key(result):
+    return (result['engine'], result['length_s'], result['pos_period_ms'],
+            result['n_tags'], result['odo_delay_ms'], result.get('speed', 'vectorized'))
+
+# ---------------------------------------------------
+def compare(results, baseline, threshold):
+    """
+    Cases whose throughput dropped more than threshold (fraction)
+    with respect to the baseline results, both on the best and on the
+    median run (a single slow run is noise); returns (result, best
+    throughput ratio)
+    """
+    old = {case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = old.get(case_key(result))
+        if previous is None:
+            continue
+        ratio = result['samples_per_s'] / previous['samples_per_s']
+        median_ratio = result['median_samples_per_s'] / previous.get(
+            'median_samples_per_s', previous['samples_per_s'])
+        if max(ratio, median_ratio) < 1 - threshold:
+            regressions.append((result, ratio))
+    return regressions
+
+# ---------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the tramrun simulation engines')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--lengths-s', nargs='+', type=float, default=[2, 60, 600],
+                        help='run lengths (s)')
+    parser.add_argument('--periods-ms', nargs='+', type=int, default=[POS_SAMPLING_PERIOD_MS, 8],
+                        help='position sampling periods (ms)')
+    parser.add_argument('--tags', nargs='+', type=int, default=[1, 100, 1000],
+                        help='number of tags')
+    parser.add_argument('--delays-ms', nargs='+', type=int, default=[0, 256],
+                        help='odometer delays (ms)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs per case (best and median are kept)')
+    parser.add_argument('--max-loop-samples', type=int, default=200000,
+                        help='skip the step loop on longer runs')
+    parser.add_argument('--out', default='trambench.json', help='output JSON file')
+    parser.add_argument('--compare', help='previous JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.4,
+                        help='throughput drop reported as regression (fraction)')
+    args = parser.parse_args(argv)
+
+    results = []
+    for engine, length_s, pos_period_ms, n_tags, odo_delay_ms in itertools.product(
+            args.engines, args.lengths_s, args.periods_ms, args.tags, args.delays_ms):
+        if pos_period_ms != POS_SAMPLING_PERIOD_MS and not ENGINES[engine][1]:
+            continue
+        if engine.startswith('loop') and length_s * 1000 / pos_period_ms > args.max_loop_samples:
+            continue
+        result = bench_case(engine, length_s, pos_period_ms, n_tags, odo_delay_ms, args.repeat)
+        results.append(result)
+        print(f"{engine:16s} {length_s:7g} s {pos_period_ms:3d} ms {n_tags:5d} tags "
+              f"{odo_delay_ms:4d} ms delay: {result['samples_per_s'] / 1e6:9.3f} M samples/s "
+              f"{result['peak_mem_bytes'] / 2**20:8.1f} MiB"
+              f"{'  (speed callback fallback)' if result['speed'] == 'callback' else ''}")
+
+    with open(args.out, 'w') as fout:
+        json.dump({'environment': environment(), 'results': results}, fout, indent=1)
+
+    if args.compare:
+        with open(args.compare) as fin:
+            baseline = json.load(fin)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for result, ratio in regressions:
+            print(f"REGRESSION {case_key(result)}: {ratio:.2f}x of the baseline throughput")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+#
+# Persistent cache of simulation results.
+#
+# Traces are stored as compressed .npz files named after a hash of the
+# simulation parameters (speed profile, tags, odometer delay, sampling
+# periods, start position, run length) and of the source code of the
+# simulation modules, so any change to the model invalidates the old
+# results by itself. The cache is bounded in size: the least recently
+# used entries are removed first. Runs with a speed callback that cannot
+# be named (lambda, closure, functools.partial) are not cached. A
+# scenario whose update_speed is a tramprofile.SpeedProfile is simulated
+# with simulate_profile() and cached under the profile description.
+#
+# The cache directory is $TRAMRUN_CACHE_DIR (default ~/.cache/tramrun);
+# TRAMRUN_CACHE=0 disables it.
+#
+# Example:
+#   ./tramcache.py --info
+#   ./tramcache.py --clear
+#
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+
+import numpy as np
+
+import trammodel
+import tramtags
+import tramvec
+import tramprofile
+from trammodel import POS_SAMPLING_PERIOD_MS, ODO_SAMPLING_PERIOD_MS, START_POS, SCENARIOS
+from trammodel import Scenario
+from tramvec import TramTrace, simulate_scenario
+from tramprofile import SpeedProfile, simulate_profile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'tramrun')
+DEFAULT_MAX_BYTES = 1 << 30
+
+# ---------------------------------------------------
+def code_version(modules=(trammodel, tramtags, tramvec, tramprofile)):
+    """ hash of the source files of the simulation modules """
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as fin:
+            digest.update(fin.read())
+    return digest.hexdigest()[:16]
+
+CODE_VERSION = code_version()
+
+# ---------------------------------------------------
+def _speed_id(speed):
+    """
+    stable description of a speed callback or of a SpeedProfile; None
+    when the callback cannot be named (lambda, closure, partial...):
+    its results are then not cached
+    """
+    if hasattr(speed, 'to_dict'):
+        return speed.to_dict()
+    qualname = getattr(speed, '__qualname__', None)
+    if qualname is None or '<' in qualname or getattr(speed, '__closure__', None):
+        return None
+    return f"{speed.__module__}.{qualname}"
+
+# ---------------------------------------------------
+def simulate_any(scenario, start_pos=START_POS):
+    """ trace of a scenario whose update_speed is a callback or a SpeedProfile """
+    if isinstance(scenario.update_speed, SpeedProfile):
+        return simulate_profile(scenario.update_speed, scenario.t_end_ms, scenario.tags,
+                                scenario.odo_delay_ms, start_pos)
+    return simulate_scenario(scenario)
+
+# ---------------------------------------------------
+def scenario_params(scenario, start_pos=START_POS):
+    """ everything the trace of a scenario depends on """
+    return {
+        'speed': _speed_id(scenario.update_speed),
+        'v0': scenario.v0,
+        'tags': [float(tag) for tag in scenario.tags],
+        'odo_delay_ms': scenario.odo_delay_ms,
+        't_end_ms': scenario.t_end_ms,
+        'start_pos': start_pos,
+        'pos_period_ms': POS_SAMPLING_PERIOD_MS,
+        'odo_period_ms': ODO_SAMPLING_PERIOD_MS,
+    }
+
+# ---------------------------------------------------
+class ResultCache:
+    """
+    Size bounded, least recently used, on disk cache of TramTrace results
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, code=CODE_VERSION):
+        self.cache_dir = cache_dir or os.environ.get('TRAMRUN_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.code = code
+        # size of the directory as seen by this process: scanned again
+        # only when above max_bytes (other processes may add entries)
+        self._total = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def key(self, params):
+        text = json.dumps({'code': self.code, 'params': params}, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def get(self, key):
+        """ cached trace, or None """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                trace = TramTrace(*(data[name] for name in TramTrace._fields))
+        except (OSError, KeyError, ValueError):
+            return None
+        # the modification time is the "last used" time of the LRU
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted meanwhile by another process
+            pass
+        return trace
+
+    def put(self, key, trace):
+        # written aside and renamed: a reader never sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fout:
+            np.savez_compressed(fout, **trace._asdict())
+        if self._total is None:
+            self._total = self.size()
+        self._total += os.path.getsize(tmp_path)
+        os.replace(tmp_path, self._path(key))
+        if self._total > self.max_bytes:
+            self.evict()
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def entries(self):
+        """ (mtime, size, path) of the cached results, oldest first """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, low_water=0.9):
+        """
+        removes the least recently used results above max_bytes, down to
+        low_water * max_bytes so that the next puts do not evict again
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            self._total = total
+            return
+        for _, size, path in entries:
+            if total <= low_water * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total = total
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+        self._total = 0
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def cached(self, params, compute):
+        """ trace for params, computed with compute() on a miss """
+        key = self.key(params)
+        trace = self.get(key)
+        if trace is None:
+            trace = compute()
+            self.put(key, trace)
+        return trace
+
+    def simulate_scenario(self, scenario):
+        if _speed_id(scenario.update_speed) is None:
+            return simulate_any(scenario)
+        return self.cached(scenario_params(scenario), lambda: simulate_any(scenario))
+
+# ---------------------------------------------------
+def default_cache():
+    """ the cache selected by the environment, None when disabled """
+    if os.environ.get('TRAMRUN_CACHE', '1') == '0':
+        return None
+    return ResultCache()
+
+# ---------------------------------------------------
+def simulate_scenario_cached(scenario, cache=None):
+    cache = cache or default_cache()
+    if cache is None:
+        return simulate_any(scenario)
+    return cache.simulate_scenario(scenario)
+
+# ---------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='tramrun result cache')
+    parser.add_argument('--cache-dir', help='cache directory')
+    parser.add_argument('--info', action='store_true', help='show entries and size')
+    parser.add_argument('--clear', action='store_true', help='remove all the cached results')
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+    if args.info:
+        print(f"{cache.cache_dir}: {len(cache.entries())} results, {cache.size() / 2**20:.1f} MiB, "
+              f"code version {cache.code}")
+    if args.clear or args.info:
+        return 0
+
+    # a SpeedProfile scenario, cached then reloaded
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        profile_cache = ResultCache(tmp_dir)
+        soft = Scenario('soft_stop_profile', 3000, 19.4, SpeedProfile(19.4).constant(2.0).stop(1.0),
+                        (1019,), 256)
+        computed = profile_cache.simulate_scenario(soft)
+        reloaded = profile_cache.get(profile_cache.key(scenario_params(soft)))
+        ok = reloaded is not None and all(np.array_equal(a, b) for a, b in zip(computed, reloaded))
+        print(f"{soft.name}: cached and reloaded {'OK' if ok else 'MISMATCH'}")
+    if not ok:
+        return 1
+
+    # timing of a cold and a warm run of the five scenarios
+    for run in ('cold', 'warm'):
+        t0 = time.perf_counter()
+        for scenario in SCENARIOS:
+            cache.simulate_scenario(scenario._replace(t_end_ms=scenario.t_end_ms * 1000))
+        print(f"{run}: {time.perf_counter() - t0:.3f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+#
+# Downsampling of long traces before plotting.
+#
+# A multi hour trace at 4 ms has millions of points, but an axes is a
+# couple of thousands pixels wide. The helpers here reduce a curve to a
+# few points per pixel column before drawing:
+#   - min/max per bucket (default): keeps every peak of the error
+#   - LTTB (largest triangle three buckets): keeps the visual shape
+# and the decimated artists redo it on the visible range at every draw
+# (zoom, pan, resize), so interactive inspection of long runs stays smooth.
+#
+
+import sys
+import time
+
+import numpy as np
+from matplotlib.lines import Line2D
+from matplotlib.collections import PolyCollection
+
+# ---------------------------------------------------
+def _bucket_size(n, n_buckets):
+    """ size of at most n_buckets equal buckets covering n samples """
+    return -(-n // max(n_buckets, 1))
+
+# ---------------------------------------------------
+def minmax_indices(y, n_buckets):
+    """
+    Indices of the minimum and maximum of every bucket (in original
+    order), plus the first and last sample
+    """
+    n = len(y)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+    size = _bucket_size(n, n_buckets)
+    n_full = n // size
+    # full buckets are reduced in one shot, as a 2-D array
+    block = y[:n_full * size].reshape(n_full, size)
+    offsets = np.arange(n_full) * size
+    i_min = offsets + block.argmin(axis=1)
+    i_max = offsets + block.argmax(axis=1)
+    if n_full * size < n:
+        tail = y[n_full * size:]
+        i_min = np.append(i_min, n_full * size + tail.argmin())
+        i_max = np.append(i_max, n_full * size + tail.argmax())
+    idx = np.sort(np.stack((i_min, i_max), axis=1), axis=1).ravel()
+    return np.unique(np.concatenate(([0], idx, [n - 1])))
+
+# ---------------------------------------------------
+def lttb_indices(x, y, n_out):
+    """
+    Largest triangle three buckets: n_out indices, first and last
+    sample always kept
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    prev = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        # average point of the next bucket (the last sample for the last bucket)
+        next_lo, next_hi = hi, edges[b + 2] if b + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[prev] - avg_x) * (y[lo:hi] - y[prev]) -
+                      (x[prev] - x[lo:hi]) * (avg_y - y[prev]))
+        prev = lo + int(area.argmax())
+        idx[b + 1] = prev
+    return idx
+
+# ---------------------------------------------------
+def decimate(x, y, n_pixels, method='minmax'):
+    """ decimated copy of the curve (x, y), for an axes n_pixels wide """
+    if method == 'minmax':
+        idx = minmax_indices(y, max(int(n_pixels), 1))
+    elif method == 'lttb':
+        idx = lttb_indices(x, y, 2 * max(int(n_pixels), 2))
+    else:
+        raise ValueError(f"unknown decimation method {method!r}")
+    return x[idx], y[idx]
+
+# ---------------------------------------------------
+def minmax_envelope(x, y, n_buckets, baseline=0.0):
+    """
+    (x, low, high) of every bucket, low/high including the baseline:
+    the envelope of fill_between(x, y) from baseline, peaks included
+    """
+    n = len(y)
+    if n <= 2 * n_buckets:
+        return x, np.minimum(y, baseline), np.maximum(y, baseline)
+    starts = np.arange(0, n, _bucket_size(n, n_buckets))
+    low = np.minimum(np.minimum.reduceat(y, starts), baseline)
+    high = np.maximum(np.maximum.reduceat(y, starts), baseline)
+    return x[starts], low, high
+
+# ---------------------------------------------------
+def _visible(x, view_x0, view_x1):
+    """ slice of the samples in [view_x0, view_x1], one sample beyond each side """
+    i0 = max(int(np.searchsorted(x, view_x0)) - 1, 0)
+    i1 = min(int(np.searchsorted(x, view_x1, side='right')) + 1, len(x))
+    return slice(i0, i1)
+
+# ---------------------------------------------------
+class DecimatedLine(Line2D):
+    """
+    Line2D of a long curve (x sorted): at every draw only the visible
+    samples are decimated to the pixel width of the axes, so zoom, pan
+    and resize redraw a few thousands points at most
+    """
+
+    def __init__(self, x, y, method='minmax', **kwargs):
+        self.x_full = np.asarray(x)
+        self.y_full = np.asarray(y)
+        self.method = method
+        self._view = None
+        super().__init__(*decimate(self.x_full, self.y_full, 2048, method), **kwargs)
+
+    def _update_view(self):
+        x0, x1 = sorted(self.axes.viewLim.intervalx)
+        view = (x0, x1, int(self.axes.bbox.width))
+        if view != self._view:
+            self._view = view
+            visible = _visible(self.x_full, x0, x1)
+            self.set_data(*decimate(self.x_full[visible], self.y_full[visible],
+                                    view[2], self.method))
+
+    def draw(self, renderer):
+        if self.axes is not None:
+            self._update_view()
+        super().draw(renderer)
+
+# ---------------------------------------------------
+class DecimatedFill(PolyCollection):
+    """
+    fill_between(x, y) of a long curve, drawn as the min/max envelope of
+    the visible samples at the pixel width of the axes
+    """
+
+    def __init__(self, x, y, baseline=0.0, **kwargs):
+        self.x_full = np.asarray(x)
+        self.y_full = np.asarray(y)
+        self.baseline = baseline
+        self._view = None
+        super().__init__([self._polygon(slice(None), 2048)], **kwargs)
+
+    def _polygon(self, visible, n_buckets):
+        xb, low, high = minmax_envelope(self.x_full[visible], self.y_full[visible],
+                                        n_buckets, self.baseline)
+        return np.concatenate((np.column_stack((xb, high)),
+                               np.column_stack((xb[::-1], low[::-1]))))
+
+    def draw(self, renderer):
+        if self.axes is not None:
+            x0, x1 = sorted(self.axes.viewLim.intervalx)
+            view = (x0, x1, int(self.axes.bbox.width))
+            if view != self._view:
+                self._view = view
+                self.set_verts([self._polygon(_visible(self.x_full, x0, x1), view[2])])
+        super().draw(renderer)
+
+# ---------------------------------------------------
+def plot_decimated(ax, x, y, method='minmax', **kwargs):
+    """ ax.plot(x, y) of a long curve, decimated at every draw """
+    line = DecimatedLine(x, y, method, **kwargs)
+    ax.add_line(line)
+    # the data limits of the whole curve (LTTB may drop the extremes)
+    ax.update_datalim([(line.x_full[0], line.y_full.min()), (line.x_full[-1], line.y_full.max())])
+    ax.autoscale_view()
+    return line
+
+# ---------------------------------------------------
+def fill_decimated(ax, x, y, **kwargs):
+    """ ax.fill_between(x, y) of a long curve, decimated at every draw """
+    fill = DecimatedFill(x, y, **kwargs)
+    ax.add_collection(fill, autolim=True)
+    ax.autoscale_view()
+    return fill
+
+# ---------------------------------------------------
+def main():
+    # min/max decimation of a 4 hours trace keeps every peak
+    rng = np.random.default_rng(0)
+    n = 4 * 3600 * 250
+    x = np.arange(n) * 0.004
+    y = np.cumsum(rng.normal(size=n)) * 0.01
+    y[rng.integers(n, size=10)] += 50
+    t0 = time.perf_counter()
+    xd, yd = decimate(x, y, 1920)
+    elapsed_minmax = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    decimate(x, y, 1920, 'lttb')
+    elapsed_lttb = time.perf_counter() - t0
+    print(f"{n} points -> {len(xd)} (min/max {elapsed_minmax * 1000:.1f} ms, "
+          f"LTTB {elapsed_lttb * 1000:.1f} ms), peaks kept: {yd.max() == y.max()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
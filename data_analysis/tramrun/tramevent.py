@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+#
+# Event driven core of the tram simulation.
+#
+# Between two events the state changes in a predictable way: the speed
+# is piecewise linear in the step index, so the position is known in
+# closed form, and the AVL estimate does not change at all. The core
+# processes only the events, from a priority queue:
+#   - speed profile breakpoints
+#   - tag crossings
+#   - odometer samples (the position measured at t - odometer delay)
+#   - delayed odometer deliveries (the delta added to the AVL estimate)
+# and fills in the dense trace only when asked.
+#
+# Results match the step loop up to floating point rounding (positions
+# are computed in closed form instead of being accumulated step by step,
+# so a tag lying exactly on a sampled position can be read one step
+# earlier or later).
+#
+
+import sys
+import math
+import time
+import heapq
+from bisect import bisect_right
+
+import numpy as np
+
+from trammodel import POS_SAMPLING_PERIOD_MS, ODO_SAMPLING_PERIOD_MS, START_POS
+from trammodel import update_speed_constant, update_speed_constant_until2_then_stop
+from trammodel import update_speed_constant_until2_then_soft_bracking
+from trammodel import SCENARIOS
+from tramtags import TagLayout
+from tramvec import TramTrace, time_vector_ms, speed_trace, simulate_scenario
+
+# event kinds, in the order they are applied inside the same step
+# (same order of the step loop: speed, position, tag, odometer)
+EV_SPEED = 0
+EV_TAG = 1
+EV_ODO_SAMPLE = 2
+EV_ODO_DELIVERY = 3
+EVENT_NAMES = ('speed', 'tag', 'odo_sample', 'odo_delivery')
+
+BRAKING_STEP = 2000 // POS_SAMPLING_PERIOD_MS  # first step with t >= 2000 ms
+
+# ---------------------------------------------------
+def _segments_soft_bracking(v0):
+    # length of the ramp, stepping exactly as the callback does
+    v = v0
+    n_ramp = 0
+    while v >= 1:
+        v -= 0.05
+        n_ramp += 1
+    segments = [(0, v0, 0.0)]
+    if n_ramp:
+        segments.append((BRAKING_STEP, v0 - 0.05, -0.05))
+    segments.append((BRAKING_STEP + n_ramp, 0.0, 0.0))
+    return segments
+
+SPEED_SEGMENTS = {
+    update_speed_constant: lambda v0: [(0, v0, 0.0)],
+    update_speed_constant_until2_then_stop: lambda v0: [(0, v0, 0.0), (BRAKING_STEP, 0.0, 0.0)],
+    update_speed_constant_until2_then_soft_bracking: _segments_soft_bracking,
+}
+
+# ---------------------------------------------------
+def segments_from_speed_trace(speed, tol=1e-9):
+    """
+    Compresses a per-step speed trace into linear segments
+    (start_step, speed_at_start, speed_change_per_step)
+    """
+    accel = np.diff(speed)
+    breaks = np.nonzero(np.abs(np.diff(accel)) > tol)[0] + 2
+    segments = []
+    for start in np.concatenate(([0], breaks)).tolist():
+        if segments and start <= segments[-1][0] + 1:
+            # a single step between two breaks: no slope of its own
+            segments[-1] = (segments[-1][0], segments[-1][1], 0.0)
+        dv = float(accel[start]) if start < len(accel) else 0.0
+        segments.append((start, float(speed[start]), dv))
+    return segments
+
+# ---------------------------------------------------
+def speed_segments(update_speed, v0, t_end_ms):
+    """
+    Linear speed segments of a speed callback; the known callbacks are
+    translated in closed form, the others are sampled once and compressed
+    """
+    if update_speed in SPEED_SEGMENTS:
+        return SPEED_SEGMENTS[update_speed](v0)
+    return segments_from_speed_trace(speed_trace(update_speed, v0, time_vector_ms(t_end_ms)))
+
+# ---------------------------------------------------
+class ClosedFormPosition:
+    """
+    Position at the end of any step of a piecewise linear speed profile
+    """
+
+    def __init__(self, segments, start_pos=START_POS, delta_t_ms=POS_SAMPLING_PERIOD_MS):
+        self.start_step = np.array([seg[0] for seg in segments], dtype=np.int64)
+        self.v_start = np.array([seg[1] for seg in segments], dtype=np.float64)
+        self.dv = np.array([seg[2] for seg in segments], dtype=np.float64)
+        self.dt = delta_t_ms / 1000
+        # position at the end of the step before every segment
+        pos0 = [float(start_pos)]
+        for i in range(1, len(segments)):
+            n = self.start_step[i] - self.start_step[i - 1]
+            pos0.append(pos0[-1] + self._advance(i - 1, n))
+        self.pos0 = np.array(pos0)
+        self._starts = self.start_step.tolist()
+
+    def _advance(self, seg, n):
+        return self.dt * (n * self.v_start[seg] + self.dv[seg] * n * (n - 1) / 2)
+
+    def min_speed(self, n_steps):
+        """ lowest speed reached in the first n_steps steps """
+        ends = np.append(self.start_step[1:], n_steps) - 1
+        v_end = self.v_start + self.dv * (ends - self.start_step)
+        inside = self.start_step < n_steps
+        return min(self.v_start[inside].min(), v_end[inside].min())
+
+    def at(self, step):
+        """ position at the end of step (scalar) """
+        seg = bisect_right(self._starts, step) - 1
+        return float(self.pos0[seg] + self._advance(seg, step - self._starts[seg] + 1))
+
+    def at_steps(self, steps):
+        """ position at the end of every step in steps (array) """
+        steps = np.asarray(steps, dtype=np.int64)
+        seg = np.searchsorted(self.start_step, steps, side='right') - 1
+        n = steps - self.start_step[seg] + 1
+        return self.pos0[seg] + self.dt * (n * self.v_start[seg] + self.dv[seg] * n * (n - 1) / 2)
+
+    def first_step_reaching(self, positions, n_steps):
+        """
+        For every position p, the first step k < n_steps with
+        pos(k) >= p (n_steps if never reached); vectorized bisection
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        lo = np.zeros(len(positions), dtype=np.int64)
+        hi = np.full(len(positions), n_steps, dtype=np.int64)
+        while np.any(lo < hi):
+            mid = (lo + hi) // 2
+            reached = self.at_steps(np.minimum(mid, n_steps - 1)) >= positions
+            hi = np.where((lo < hi) & reached, mid, hi)
+            lo = np.where((lo < hi) & ~reached, mid + 1, lo)
+        return lo
+
+# ---------------------------------------------------
+class EventRun:
+    """
+    Result of an event driven run: the processed events and the AVL
+    estimate after every change. dense() expands it to a TramTrace.
+    """
+
+    def __init__(self, n_steps, position, events, change_steps, change_avl, start_pos):
+        self.n_steps = n_steps
+        self.position = position
+        self.events = events
+        self.change_steps = np.array(change_steps, dtype=np.int64)
+        self.change_avl = np.array(change_avl, dtype=np.float64)
+        self.start_pos = start_pos
+
+    def avl_at_steps(self, steps):
+        i = np.searchsorted(self.change_steps, steps, side='right') - 1
+        return np.where(i >= 0, self.change_avl[np.maximum(i, 0)], float(self.start_pos))
+
+    def dense(self, steps=None):
+        """
+        Dense trace at the given steps (default: every step of the run)
+        """
+        if steps is None:
+            steps = np.arange(self.n_steps, dtype=np.int64)
+        real_pos = self.position.at_steps(steps)
+        avl_pos = self.avl_at_steps(steps)
+        odo = np.zeros(len(steps))
+        delivered = [(step, value) for step, kind, value in self.events if kind == EV_ODO_DELIVERY]
+        if delivered:
+            d_steps, d_values = np.array(delivered).T
+            where = np.searchsorted(steps, d_steps)
+            inside = (where < len(steps)) & (steps[np.minimum(where, len(steps) - 1)] == d_steps)
+            odo[where[inside]] = d_values[inside]
+        return TramTrace(steps * POS_SAMPLING_PERIOD_MS / 1000, real_pos, odo, avl_pos,
+                         real_pos - avl_pos)
+
+    def error_extrema(self):
+        """
+        (min, max) of the error without expanding the trace: with
+        non-negative speed the error only grows between two changes of
+        the AVL estimate, so it is enough to look at the steps where the
+        estimate changes and at the steps right before them
+        """
+        starts = np.unique(np.concatenate(([0], self.change_steps)))
+        ends = np.append(starts[1:] - 1, self.n_steps - 1)
+        steps = np.concatenate((starts, ends))
+        error = self.position.at_steps(steps) - self.avl_at_steps(steps)
+        return float(error.min()), float(error.max())
+
+    def event_counts(self):
+        counts = dict.fromkeys(EVENT_NAMES, 0)
+        for _, kind, _ in self.events:
+            counts[EVENT_NAMES[kind]] += 1
+        return counts
+
+# ---------------------------------------------------
+def simulate_events(t_end_ms, v0, update_speed, tag_pos_list, odo_delay_ms,
+                    start_pos=START_POS, segments=None):
+    """
+    Event driven equivalent of tramvec.simulate(). Linear speed segments
+    (start_step, speed, speed_change_per_step) can be passed instead of
+    the update_speed callback. The speed shall never be negative.
+    """
+    if odo_delay_ms < 0:
+        raise ValueError(f"odometer delay shall be >= 0 (got {odo_delay_ms})")
+    n_steps = t_end_ms // POS_SAMPLING_PERIOD_MS + 1
+    if segments is None:
+        segments = speed_segments(update_speed, v0, t_end_ms)
+    position = ClosedFormPosition(segments, start_pos)
+    if position.min_speed(n_steps) < 0:
+        raise ValueError("the event driven core supports only forward travel")
+    if not isinstance(tag_pos_list, TagLayout):
+        tag_pos_list = TagLayout(tag_pos_list)
+
+    queue = []
+    for step, _, _ in segments[1:]:
+        if step < n_steps:
+            queue.append((step, EV_SPEED, 0, 0.0))
+    # the estimate is reset to the first tag (in list order) crossed in a step
+    crossing = position.first_step_reaching(tag_pos_list.positions, n_steps)
+    for step, list_index, tag_pos in zip(crossing.tolist(), tag_pos_list.list_index.tolist(),
+                                         tag_pos_list.positions.tolist()):
+        if step < n_steps and tag_pos > start_pos:
+            queue.append((step, EV_TAG, list_index, tag_pos))
+    heapq.heapify(queue)
+
+    def schedule_odometer(t_ms):
+        # first odometer sample delivered at or after t_ms
+        t_ms = max(t_ms, odo_delay_ms + ODO_SAMPLING_PERIOD_MS)
+        t_ms = -(-t_ms // ODO_SAMPLING_PERIOD_MS) * ODO_SAMPLING_PERIOD_MS
+        if t_ms <= t_end_ms:
+            heapq.heappush(queue, ((t_ms - odo_delay_ms) // POS_SAMPLING_PERIOD_MS,
+                                   EV_ODO_SAMPLE, t_ms, 0.0))
+
+    schedule_odometer(0)
+
+    events = []
+    change_steps = []
+    change_avl = []
+    avl_pos = float(start_pos)
+    last_reset_step = -1
+    while queue:
+        step, kind, key, value = heapq.heappop(queue)
+        if kind == EV_TAG:
+            if step == last_reset_step:
+                continue
+            last_reset_step = step
+            avl_pos = value
+        elif kind == EV_ODO_SAMPLE:
+            t_deliver_ms = key
+            t_new_odo_ms = t_deliver_ms - odo_delay_ms
+            t_prev_odo_ms = t_new_odo_ms - ODO_SAMPLING_PERIOD_MS
+            value = abs(position.at(t_new_odo_ms // POS_SAMPLING_PERIOD_MS) -
+                        position.at(t_prev_odo_ms // POS_SAMPLING_PERIOD_MS))
+            heapq.heappush(queue, (t_deliver_ms // POS_SAMPLING_PERIOD_MS,
+                                   EV_ODO_DELIVERY, t_deliver_ms, value))
+            schedule_odometer(t_deliver_ms + ODO_SAMPLING_PERIOD_MS)
+        elif kind == EV_ODO_DELIVERY:
+            avl_pos += value
+        events.append((step, kind, value))
+        if kind in (EV_TAG, EV_ODO_DELIVERY):
+            if change_steps and change_steps[-1] == step:
+                change_avl[-1] = avl_pos
+            else:
+                change_steps.append(step)
+                change_avl.append(avl_pos)
+
+    return EventRun(n_steps, position, events, change_steps, change_avl, start_pos)
+
+# ---------------------------------------------------
+def simulate_scenario_events(scenario):
+    return simulate_events(scenario.t_end_ms, scenario.v0, scenario.update_speed,
+                           scenario.tags, scenario.odo_delay_ms)
+
+# ---------------------------------------------------
+def main():
+    # 1. same traces of the step engines, up to rounding
+    all_ok = True
+    for scenario in SCENARIOS:
+        reference = simulate_scenario(scenario)
+        run = simulate_scenario_events(scenario)
+        trace = run.dense()
+        ok = all(np.allclose(a, b, rtol=0, atol=1e-6) for a, b in zip(trace, reference))
+        err_min, err_max = run.error_extrema()
+        ok = ok and math.isclose(err_max, reference.error.max(), abs_tol=1e-6)
+        ok = ok and math.isclose(err_min, reference.error.min(), abs_tol=1e-6)
+        all_ok = all_ok and ok
+        print(f"{scenario.name:52s} {'OK' if ok else 'MISMATCH'}")
+
+    # 2. a 10 hours run with a slow odometer and sparse tags
+    t0 = time.perf_counter()
+    run = simulate_events(10 * 3600 * 1000, 19.4, update_speed_constant,
+                          np.arange(1019, 1019 + 19.4 * 36000, 2000.0), 256)
+    elapsed = time.perf_counter() - t0
+    print(f"10 hours run: {run.n_steps} steps, {len(run.events)} events "
+          f"in {elapsed:.2f} s {run.event_counts()}, error range {run.error_extrema()}")
+
+    return 0 if all_ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
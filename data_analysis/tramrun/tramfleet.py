@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+#
+# Fleet mode: many trams simulated at once.
+#
+# The state of the whole fleet is kept in 2-D arrays shaped
+# (n_trams, n_samples) and advanced with batched array operations; every
+# tram has its own speed profile, start position, odometer delay and tag
+# set. Long runs are processed in time chunks, so memory is bounded by
+# n_trams * chunk_samples. The speed profiles and the tag layouts of the
+# fleet are flattened into single arrays (one block per tram) so that the
+# segment and tag lookups are made for all the trams at once; trams
+# driven by an (update_speed, v0) callback are still computed one by one.
+#
+# Example:
+#   ./tramfleet.py --trams 500 --hours 18
+#
+
+import sys
+import time
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from trammodel import POS_SAMPLING_PERIOD_MS, ODO_SAMPLING_PERIOD_MS, START_POS
+from trammodel import SCENARIOS
+from tramtags import TagLayout
+from tramvec import speed_trace, simulate_scenario
+from tramstream import ring_buffer_len
+from tramprofile import SpeedProfile, timetable_profile, simulate_profile
+
+DEFAULT_CHUNK_SAMPLES = 8192
+
+# speed is a SpeedProfile or an (update_speed, v0) pair
+TramSpec = namedtuple('TramSpec', ['speed', 'start_pos', 'odo_delay_ms', 'tags'])
+
+FleetTrace = namedtuple('FleetTrace', ['t', 'real_pos', 'odo', 'avl_pos', 'error'])
+
+# ---------------------------------------------------
+def tram_spec_from_scenario(scenario, start_pos=START_POS):
+    return TramSpec((scenario.update_speed, scenario.v0), start_pos,
+                    scenario.odo_delay_ms, scenario.tags)
+
+# ---------------------------------------------------
+class FleetProfiles:
+    """
+    Speed profiles of some trams of the fleet, their segment tables
+    concatenated, evaluated for all of them with one lookup
+    """
+
+    def __init__(self, profiles):
+        tables = [profile.table() for profile in profiles]
+        lengths = np.array([len(table[0]) for table in tables], dtype=np.int64)
+        self.first = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        self.last = self.first + lengths - 1
+        self.t0, self.v_start, self.accel, _ = (np.concatenate(columns) for columns in zip(*tables))
+        # tram of every segment
+        self.row = np.repeat(np.arange(len(tables)), lengths)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def speed_at(self, t):
+        """
+        speed (n_profiles, len(t)) at the sorted times t (s), the same
+        values as SpeedProfile.speed_at() row by row
+        """
+        n = len(t)
+        # sample from which every segment is in force: counting them per
+        # sample gives the segment of every (tram, sample)
+        starts = np.searchsorted(t, self.t0, side='left')
+        started = np.bincount(self.row * (n + 1) + starts, minlength=len(self.first) * (n + 1))
+        started = np.cumsum(started.reshape(len(self.first), n + 1)[:, :n], axis=1)
+        seg = np.clip(self.first[:, None] + started - 1, self.first[:, None], self.last[:, None])
+        return self.v_start[seg] + self.accel[seg] * (t - self.t0[seg])
+
+# ---------------------------------------------------
+class FleetTags:
+    """
+    Tag layouts of the whole fleet in one sorted array. The (tram, tag
+    position) keys are stored as complex numbers, which NumPy orders
+    lexicographically, so one searchsorted finds the crossings of every
+    tram without mixing up the layouts nor rounding the positions.
+    """
+
+    def __init__(self, layouts):
+        counts = np.array([len(layout) for layout in layouts], dtype=np.int64)
+        self.positions = np.concatenate([layout.positions for layout in layouts] + [np.empty(0)])
+        self.list_index = np.concatenate([layout.list_index for layout in layouts] +
+                                         [np.empty(0, dtype=np.int64)])
+        rows = np.repeat(np.arange(len(layouts), dtype=np.float64), counts)
+        self.keys = rows + 1j * self.positions
+        self.bidirectional = np.array([layout.bidirectional for layout in layouts], dtype=bool)
+
+    def _count(self, pos, side):
+        """
+        index in positions of the first tag of every row (tram) after
+        pos, or at pos with side='left'
+        """
+        rows = np.arange(len(pos), dtype=np.float64).reshape((-1,) + (1,) * (pos.ndim - 1))
+        return np.searchsorted(self.keys, rows + 1j * pos, side=side)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def bulk_resets(self, real_pos, start_pos):
+        """
+        TagLayout.bulk_resets() of every tram: real_pos is (n_trams,
+        n_samples), start_pos the positions before the first sample.
+        Returns (rows, steps, values)
+        """
+        prev_pos = np.concatenate((start_pos[:, None], real_pos[:, :-1]), axis=1)
+        forward = real_pos >= prev_pos
+        hi = self._count(real_pos, 'right')
+        # the previous position of a step is the position of the step before
+        lo = np.concatenate((self._count(start_pos, 'right')[:, None], hi[:, :-1]), axis=1)
+        back = ~forward & self.bidirectional[:, None]
+        if back.any():
+            lo[back] = self._count(real_pos, 'left')[back]
+            hi[back] = self._count(prev_pos, 'left')[back]
+        hi[~forward & ~back] = lo[~forward & ~back]
+        rows, steps = np.nonzero(hi > lo)
+        lo, hi = lo[rows, steps], hi[rows, steps]
+        first = lo.copy()
+        # more tags in the same step: keep the first in the original list
+        for i in np.nonzero(hi - lo > 1)[0].tolist():
+            first[i] = lo[i] + np.argmin(self.list_index[lo[i]:hi[i]])
+        return rows, steps, self.positions[first]
+
+# ---------------------------------------------------
+def fleet_chunks(fleet, t_end_ms, chunk_samples=DEFAULT_CHUNK_SAMPLES):
+    """
+    Generator of FleetTrace chunks: t has shape (n_samples,), the other
+    fields (n_trams, n_samples). Matches tramvec.simulate() run on every
+    tram up to rounding (the AVL estimate is rebuilt from a cumulative
+    sum instead of being accumulated one sample at a time).
+    """
+    n_trams = len(fleet)
+    delays = np.array([tram.odo_delay_ms for tram in fleet], dtype=np.int64)
+    if np.any(delays < 0):
+        raise ValueError("odometer delays shall be >= 0")
+    tags = FleetTags([tram.tags if isinstance(tram.tags, TagLayout) else TagLayout(tram.tags)
+                      for tram in fleet])
+    profiled = [i for i, tram in enumerate(fleet) if isinstance(tram.speed, SpeedProfile)]
+    profiles = FleetProfiles([fleet[i].speed for i in profiled]) if profiled else None
+    callbacks = [i for i, tram in enumerate(fleet) if not isinstance(tram.speed, SpeedProfile)]
+    history_len = ring_buffer_len(int(delays.max()) if n_trams else 0)
+
+    v = {i: fleet[i].speed[1] for i in callbacks}
+    last_pos = np.array([tram.start_pos for tram in fleet], dtype=np.float64)
+    last_avl = last_pos.copy()
+    history = np.empty((n_trams, 0), dtype=np.float64)
+    dt = POS_SAMPLING_PERIOD_MS / 1000
+    n_total = t_end_ms // POS_SAMPLING_PERIOD_MS + 1
+    rows = np.arange(n_trams)[:, None]
+
+    for k0 in range(0, n_total, chunk_samples):
+        k1 = min(k0 + chunk_samples, n_total)
+        t_ms = np.arange(k0, k1, dtype=np.int64) * POS_SAMPLING_PERIOD_MS
+        n = len(t_ms)
+
+        # speed, one row per tram
+        speed = np.empty((n_trams, n), dtype=np.float64)
+        if profiles is not None:
+            speed[profiled] = profiles.speed_at(t_ms / 1000)
+        for i in callbacks:
+            speed[i] = speed_trace(fleet[i].speed[0], v[i], t_ms)
+            v[i] = speed[i, -1]
+
+        real_pos = np.add.accumulate(np.concatenate((last_pos[:, None], speed * dt), axis=1),
+                                     axis=1)[:, 1:]
+
+        # odometer deltas, every tram with its own delay
+        window = np.concatenate((history, real_pos), axis=1)
+        window_k0 = k0 - history.shape[1]
+        odo = np.zeros((n_trams, n), dtype=np.float64)
+        cols = np.nonzero(t_ms % ODO_SAMPLING_PERIOD_MS == 0)[0]
+        if len(cols):
+            t_new_odo_ms = t_ms[cols][None, :] - delays[:, None]
+            t_prev_odo_ms = t_new_odo_ms - ODO_SAMPLING_PERIOD_MS
+            valid = t_prev_odo_ms >= 0
+            i_new = np.where(valid, t_new_odo_ms // POS_SAMPLING_PERIOD_MS - window_k0, 0)
+            i_prev = np.where(valid, t_prev_odo_ms // POS_SAMPLING_PERIOD_MS - window_k0, 0)
+            odo[:, cols] = np.where(valid, np.abs(window[rows, i_new] - window[rows, i_prev]), 0.0)
+
+        # tag resets: index of the last reset at or before every sample
+        last_reset = np.full((n_trams, n), -1, dtype=np.int64)
+        reset_value = np.zeros((n_trams, n), dtype=np.float64)
+        reset_rows, steps, values = tags.bulk_resets(real_pos, last_pos)
+        last_reset[reset_rows, steps] = steps
+        reset_value[reset_rows, steps] = values
+        last_reset = np.maximum.accumulate(last_reset, axis=1)
+
+        # AVL estimate: base (tag or carried estimate) + odometer sum since then
+        cum_odo = np.concatenate((np.zeros((n_trams, 1)), np.cumsum(odo, axis=1)), axis=1)
+        since = np.maximum(last_reset, 0)
+        base = np.where(last_reset >= 0, reset_value[rows, since], last_avl[:, None])
+        avl_pos = base + cum_odo[:, 1:] - np.where(last_reset >= 0, cum_odo[rows, since], 0.0)
+        error = real_pos - avl_pos
+
+        history = window[:, -history_len:].copy()
+        last_pos = real_pos[:, -1].copy()
+        last_avl = avl_pos[:, -1].copy()
+        yield FleetTrace(t_ms / 1000, real_pos, odo, avl_pos, error)
+
+# ---------------------------------------------------
+def simulate_fleet(fleet, t_end_ms, chunk_samples=DEFAULT_CHUNK_SAMPLES):
+    """
+    Whole run of the fleet as one FleetTrace; only for runs that fit in memory
+    """
+    chunks = list(fleet_chunks(fleet, t_end_ms, chunk_samples))
+    return FleetTrace(np.concatenate([c.t for c in chunks]),
+                      *(np.concatenate([getattr(c, field) for c in chunks], axis=1)
+                        for field in FleetTrace._fields[1:]))
+
+# ---------------------------------------------------
+def fleet_error_summary(fleet, t_end_ms, chunk_samples=DEFAULT_CHUNK_SAMPLES):
+    """
+    Per tram max and mean absolute error, computed chunk by chunk
+    """
+    max_abs = np.zeros(len(fleet))
+    sum_abs = np.zeros(len(fleet))
+    count = 0
+    for chunk in fleet_chunks(fleet, t_end_ms, chunk_samples):
+        abs_err = np.abs(chunk.error)
+        np.maximum(max_abs, abs_err.max(axis=1), out=max_abs)
+        sum_abs += abs_err.sum(axis=1)
+        count += len(chunk.t)
+    return {'err_max': max_abs, 'err_mean': sum_abs / count}
+
+# ---------------------------------------------------
+def random_fleet(n_trams, hours, seed=0):
+    """
+    Trams running a timetable for the given hours, each with its own
+    cruise speed, start position, odometer delay and tags every 200-600 m
+    """
+    rng = np.random.default_rng(seed)
+    # a leg (run, stop, dwell) lasts about 100 s, 30 m/s is never reached
+    n_legs = int(hours * 3600 / 60) + 1
+    line_length = hours * 3600 * 30
+    fleet = []
+    for _ in range(n_trams):
+        legs = zip(rng.uniform(20, 60, n_legs), rng.uniform(15, 40, n_legs))
+        start_pos = rng.uniform(0, 10000)
+        tags = start_pos + np.cumsum(rng.uniform(200, 600, int(line_length / 200)))
+        fleet.append(TramSpec(timetable_profile(legs, rng.uniform(12, 20)), start_pos,
+                              int(rng.choice((0, 128, 256, 512))), tags))
+    return fleet
+
+# ---------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='tramrun fleet mode')
+    parser.add_argument('--trams', type=int, default=500, help='number of trams')
+    parser.add_argument('--hours', type=float, default=18, help='length of the service day')
+    args = parser.parse_args(argv)
+
+    # 1. the five scenarios as a fleet of five trams
+    fleet = [tram_spec_from_scenario(scenario) for scenario in SCENARIOS]
+    t_end_ms = max(scenario.t_end_ms for scenario in SCENARIOS)
+    traces = simulate_fleet(fleet, t_end_ms, chunk_samples=300)
+    all_ok = True
+    for i, scenario in enumerate(SCENARIOS):
+        reference = simulate_scenario(scenario)
+        n = len(reference.t)
+        ok = all(np.allclose(getattr(traces, field)[i, :n], getattr(reference, field),
+                             rtol=0, atol=1e-9)
+                 for field in ('real_pos', 'odo', 'avl_pos', 'error'))
+        all_ok = all_ok and ok
+        print(f"{scenario.name:52s} {'OK' if ok else 'MISMATCH'}")
+
+    # 2. timetable trams (batched profiles and tags) against tramprofile
+    fleet = random_fleet(20, 0.25, seed=1)
+    t_end_ms = 15 * 60 * 1000
+    traces = simulate_fleet(fleet, t_end_ms)
+    ok = True
+    for i, tram in enumerate(fleet):
+        reference = simulate_profile(tram.speed, t_end_ms, tram.tags, tram.odo_delay_ms,
+                                     tram.start_pos)
+        ok = ok and all(np.allclose(getattr(traces, field)[i], getattr(reference, field),
+                                    rtol=0, atol=1e-6)
+                        for field in ('real_pos', 'odo', 'avl_pos', 'error'))
+    all_ok = all_ok and ok
+    print(f"{'20 timetable trams vs tramprofile.simulate_profile':52s} {'OK' if ok else 'MISMATCH'}")
+
+    # 3. the fleet over a service day
+    fleet = random_fleet(args.trams, args.hours)
+    t_end_ms = int(args.hours * 3600 * 1000)
+    t0 = time.perf_counter()
+    summary = fleet_error_summary(fleet, t_end_ms)
+    elapsed = time.perf_counter() - t0
+    n_samples = args.trams * (t_end_ms // POS_SAMPLING_PERIOD_MS + 1)
+    print(f"{args.trams} trams, {args.hours:g} hours: {n_samples / 1e6:.0f} M samples in "
+          f"{elapsed:.1f} s ({n_samples / elapsed / 1e6:.1f} M samples/s), "
+          f"worst tram max |error| {summary['err_max'].max():.2f} m")
+    return 0 if all_ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
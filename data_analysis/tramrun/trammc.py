@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+#
+# Monte Carlo of the tram AVL estimator with a noisy odometer and
+# missed tag readings.
+#
+# Every trial runs a scenario with random odometer errors (calibration
+# error per trial, additive noise and wheel slip per odometer sample),
+# random odometer delay jitter and randomly missed tags. Trials are run
+# in batches of 2-D arrays (trials x samples) spread over a process
+# pool; each batch has its own seed spawned from the main one, so the
+# results do not depend on the number of workers. The error of all the
+# trials is accumulated in per-sample histograms, from which the error
+# percentile envelopes over time are taken. Every worker runs a share of
+# the batches and sums their histograms itself: only one histogram per
+# worker goes back to the parent.
+#
+# The histograms only span the error bins actually hit (grown as needed),
+# and are filled a few samples at a time: a worker holds about
+# n_samples * hit_bins * 4 bytes (uint32 counts) plus the arrays of one
+# batch (batch_trials * n_samples), the parent n_samples * hit_bins * 8
+# bytes, instead of n_samples * n_bins() for the whole error range.
+#
+# Example:
+#   ./trammc.py --trials 100000 --tag-miss-prob 0.1 --odo-noise 0.02 --out mc.npz --plot mc.png
+#
+
+import os
+import sys
+import time
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from trammodel import POS_SAMPLING_PERIOD_MS, ODO_SAMPLING_PERIOD_MS, START_POS, SCENARIOS
+from tramvec import time_vector_ms, speed_trace, position_trace, tag_resets
+
+NoiseModel = namedtuple('NoiseModel', ['odo_scale_sigma', 'odo_noise_sigma', 'slip_prob',
+                                       'slip_factor', 'delay_jitter_ms', 'tag_miss_prob'])
+NoiseModel.__new__.__defaults__ = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+# error histogram: bins of ERROR_BIN_M meters in [-ERROR_RANGE_M, ERROR_RANGE_M],
+# plus one underflow and one overflow bin
+ERROR_RANGE_M = 50.0
+ERROR_BIN_M = 0.02
+DEFAULT_QUANTILES = (0.01, 0.05, 0.5, 0.95, 0.99)
+# cells of the int64 temporary of one histogram fill (8 MiB)
+FILL_CELLS = 1 << 20
+
+# ---------------------------------------------------
+def n_bins():
+    return int(round(2 * ERROR_RANGE_M / ERROR_BIN_M)) + 2
+
+# ---------------------------------------------------
+def grow_histogram(lo, counts, bin_lo, bin_hi, n_samples, dtype=np.uint32):
+    """
+    (lo, counts) histogram (counts[:, j] is the bin lo + j) widened to
+    hold the bins bin_lo to bin_hi (excluded); counts None is empty
+    """
+    if counts is None:
+        return bin_lo, np.zeros((n_samples, bin_hi - bin_lo), dtype=dtype)
+    hi = lo + counts.shape[1]
+    if bin_lo >= lo and bin_hi <= hi:
+        return lo, counts
+    new_lo, new_hi = min(lo, bin_lo), max(hi, bin_hi)
+    grown = np.zeros((n_samples, new_hi - new_lo), dtype=counts.dtype)
+    grown[:, lo - new_lo:hi - new_lo] = counts
+    return new_lo, grown
+
+def add_to_histogram(lo, counts, bins):
+    """
+    adds the bins (n_trials, n_samples) to the per sample (lo, counts)
+    histogram, a few samples at a time; returns the (maybe grown) histogram
+    """
+    n = bins.shape[1]
+    lo, counts = grow_histogram(lo, counts, int(bins.min()), int(bins.max()) + 1, n)
+    span = counts.shape[1]
+    step = max(1, FILL_CELLS // span)
+    for k0 in range(0, n, step):
+        k1 = min(k0 + step, n)
+        flat = (np.arange(k1 - k0)[None, :] * span + (bins[:, k0:k1] - lo)).ravel()
+        np.add(counts[k0:k1], np.bincount(flat, minlength=(k1 - k0) * span).reshape(k1 - k0, span),
+               out=counts[k0:k1], casting='unsafe')
+    return lo, counts
+
+# ---------------------------------------------------
+def run_batch(scenario, noise, n_trials, seed, start_pos=START_POS):
+    """
+    Runs n_trials randomized trials of the scenario; returns (histogram
+    bin of every error, shaped (n_trials, n_samples), max |error| per
+    trial)
+    """
+    rng = np.random.default_rng(seed)
+    t_ms = time_vector_ms(scenario.t_end_ms)
+    n = len(t_ms)
+    real_pos = position_trace(speed_trace(scenario.update_speed, scenario.v0, t_ms), start_pos)
+
+    # odometer deltas, at the odometer sampling instants only
+    cols = np.nonzero(t_ms % ODO_SAMPLING_PERIOD_MS == 0)[0]
+    jitter = rng.normal(0.0, noise.delay_jitter_ms, (n_trials, len(cols))) if noise.delay_jitter_ms else 0.0
+    delay = np.broadcast_to(np.maximum(scenario.odo_delay_ms + jitter, 0.0), (n_trials, len(cols)))
+    t_new_odo_ms = t_ms[cols][None, :] - delay
+    t_prev_odo_ms = t_new_odo_ms - ODO_SAMPLING_PERIOD_MS
+    valid = t_prev_odo_ms >= 0
+    i_new = np.where(valid, t_new_odo_ms // POS_SAMPLING_PERIOD_MS, 0).astype(np.int64)
+    i_prev = np.where(valid, t_prev_odo_ms // POS_SAMPLING_PERIOD_MS, 0).astype(np.int64)
+    odo = np.where(valid, np.abs(real_pos[i_new] - real_pos[i_prev]), 0.0)
+    odo *= 1.0 + rng.normal(0.0, noise.odo_scale_sigma, (n_trials, 1))
+    if noise.slip_prob:
+        odo *= np.where(rng.random(odo.shape) < noise.slip_prob, 1.0 - noise.slip_factor, 1.0)
+    if noise.odo_noise_sigma:
+        odo += np.where(valid, rng.normal(0.0, noise.odo_noise_sigma, odo.shape), 0.0)
+
+    # AVL estimate: odometer sum since the last tag actually read
+    cum_odo = np.zeros((n_trials, n + 1))
+    cum_odo[:, cols + 1] = odo
+    np.cumsum(cum_odo, axis=1, out=cum_odo)
+    reset_steps, reset_values = tag_resets(real_pos, scenario.tags, start_pos)
+    read = rng.random((n_trials, len(reset_steps))) >= noise.tag_miss_prob
+    last_reset = np.full((n_trials, n), -1, dtype=np.int64)
+    reset_value = np.zeros((n_trials, n))
+    trials, which = np.nonzero(read)
+    last_reset[trials, reset_steps[which]] = reset_steps[which]
+    reset_value[trials, reset_steps[which]] = reset_values[which]
+    np.maximum.accumulate(last_reset, axis=1, out=last_reset)
+    rows = np.arange(n_trials)[:, None]
+    since = np.maximum(last_reset, 0)
+    base = np.where(last_reset >= 0, reset_value[rows, since], float(start_pos))
+    avl_pos = base + cum_odo[:, 1:] - np.where(last_reset >= 0, cum_odo[rows, since], 0.0)
+    error = real_pos[None, :] - avl_pos
+
+    # histogram bin of every error (int16: n_bins() < 32768)
+    bins = np.clip(np.floor((error + ERROR_RANGE_M) / ERROR_BIN_M) + 1, 0, n_bins() - 1)
+    return bins.astype(np.int16), np.abs(error).max(axis=1)
+
+# ---------------------------------------------------
+def run_batches(scenario, noise, sizes, seeds, start_pos=START_POS):
+    """
+    Runs several batches and sums their histograms; returns (first bin,
+    counts of the bins from the first to the last one hit, shaped
+    (n_samples, n_hit_bins), max |error| per trial)
+    """
+    lo, counts = 0, None
+    maxima = []
+    for size, seed in zip(sizes, seeds):
+        bins, batch_max = run_batch(scenario, noise, size, seed, start_pos)
+        # a bin holds at most n_trials counts: uint32
+        lo, counts = add_to_histogram(lo, counts, bins)
+        maxima.append(batch_max)
+    return lo, counts, np.concatenate(maxima)
+
+# ---------------------------------------------------
+def histogram_quantiles(counts, quantiles=DEFAULT_QUANTILES, lo=0):
+    """
+    Error quantiles of every sample from the histogram counts of the bins
+    from lo on, shaped (len(quantiles), n_samples); values in the
+    under/overflow bins are clipped to the histogram range
+    """
+    cum = np.cumsum(counts, axis=1)
+    total = cum[:, -1:]
+    centers = -ERROR_RANGE_M + (lo + np.arange(counts.shape[1]) - 0.5) * ERROR_BIN_M
+    centers = np.clip(centers, -ERROR_RANGE_M, ERROR_RANGE_M)
+    envelopes = []
+    for q in quantiles:
+        first = (cum >= np.ceil(q * total)).argmax(axis=1)
+        envelopes.append(centers[first])
+    return np.array(envelopes)
+
+# ---------------------------------------------------
+def monte_carlo(scenario, noise, n_trials, batch_trials=1000, seed=0, workers=None,
+                quantiles=DEFAULT_QUANTILES):
+    """
+    Runs n_trials trials in batches over a process pool (workers=1 runs in
+    this process) and returns (t, envelopes, trial_max_abs_error)
+    """
+    sizes = [min(batch_trials, n_trials - k) for k in range(0, n_trials, batch_trials)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    n_jobs = 1 if workers == 1 else min(workers or os.cpu_count() or 1, len(sizes))
+    # batches dealt round robin: one job (and one histogram) per worker
+    jobs = [(scenario, noise, sizes[k::n_jobs], seeds[k::n_jobs]) for k in range(n_jobs)]
+    t = time_vector_ms(scenario.t_end_ms) / 1000
+    lo, counts = 0, None
+    maxima = [None] * len(sizes)
+    if workers == 1:
+        results = [run_batches(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(run_batches, *zip(*jobs)))
+    for k, (job_lo, job_counts, job_max) in enumerate(results):
+        lo, counts = grow_histogram(lo, counts, job_lo, job_lo + job_counts.shape[1], len(t),
+                                    dtype=np.int64)
+        counts[:, job_lo - lo:job_lo - lo + job_counts.shape[1]] += job_counts
+        # maxima in batch order, whatever the number of workers
+        offsets = np.cumsum([0] + sizes[k::n_jobs])
+        for j, batch in enumerate(range(k, len(sizes), n_jobs)):
+            maxima[batch] = job_max[offsets[j]:offsets[j + 1]]
+    return t, histogram_quantiles(counts, quantiles, lo), np.concatenate(maxima)
+
+# ---------------------------------------------------
+def plot_envelopes(t, envelopes, quantiles, title, fname):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    n = len(quantiles)
+    for i in range(n // 2):
+        ax.fill_between(t, envelopes[i], envelopes[n - 1 - i], color='lightblue',
+                        alpha=0.4 + 0.3 * i, label=f"{quantiles[i]:.0%} - {quantiles[n - 1 - i]:.0%}")
+    if n % 2:
+        ax.plot(t, envelopes[n // 2], color='blue', label=f"{quantiles[n // 2]:.0%}")
+    ax.set_xlabel('time (s)')
+    ax.set_ylabel('Error (m)')
+    ax.set_title(title)
+    ax.legend()
+    fig.savefig(fname)
+    plt.close(fig)
+
+# ---------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Monte Carlo of the tram AVL estimator')
+    parser.add_argument('--scenario', default=SCENARIOS[-1].name, choices=[s.name for s in SCENARIOS])
+    parser.add_argument('--trials', type=int, default=10000)
+    parser.add_argument('--batch', type=int, default=1000, help='trials per batch')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--odo-scale', type=float, default=0.01,
+                        help='sigma of the odometer calibration error (fraction, per trial)')
+    parser.add_argument('--odo-noise', type=float, default=0.01,
+                        help='sigma of the odometer additive noise (m, per sample)')
+    parser.add_argument('--slip-prob', type=float, default=0.01, help='wheel slip probability per sample')
+    parser.add_argument('--slip-factor', type=float, default=0.5, help='distance lost on slip (fraction)')
+    parser.add_argument('--delay-jitter', type=float, default=16.0,
+                        help='sigma of the odometer delay jitter (ms)')
+    parser.add_argument('--tag-miss-prob', type=float, default=0.05)
+    parser.add_argument('--out', default='trammc.npz', help='output file (t, quantiles, envelopes)')
+    parser.add_argument('--plot', help='also draw the envelopes in this image file')
+    args = parser.parse_args(argv)
+
+    scenario = next(s for s in SCENARIOS if s.name == args.scenario)
+    noise = NoiseModel(args.odo_scale, args.odo_noise, args.slip_prob, args.slip_factor,
+                       args.delay_jitter, args.tag_miss_prob)
+    t0 = time.perf_counter()
+    t, envelopes, maxima = monte_carlo(scenario, noise, args.trials, args.batch, args.seed,
+                                       args.workers)
+    print(f"{args.trials} trials of {scenario.name} in {time.perf_counter() - t0:.2f} s, "
+          f"max |error| p50 {np.median(maxima):.2f} m, p99 {np.percentile(maxima, 99):.2f} m")
+    np.savez_compressed(args.out, t=t, quantiles=np.array(DEFAULT_QUANTILES),
+                        envelopes=envelopes, trial_max_abs_error=maxima)
+    if args.plot:
+        plot_envelopes(t, envelopes, DEFAULT_QUANTILES, f"{scenario.name}, {args.trials} trials",
+                       args.plot)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# Scalar tram/AVL model shared by the tramrun scripts.
+#
+# The functions here are the per-step reference implementation:
+# every faster engine is checked against simulate_loop().
+#
+
+from collections import namedtuple
+
+from tramtags import TagLayout
+from tramtiming import timer_from_env, add_report
+
+POS_SAMPLING_PERIOD_MS = 4  # milliseconds
+ODO_SAMPLING_PERIOD_MS = 128 # milliseconds, shall be a sample of POS_SAMPLING_PERIOD_MS
+ODO_SAMPLING_FACTOR = ODO_SAMPLING_PERIOD_MS / POS_SAMPLING_PERIOD_MS
+
+START_POS = 1000
+START_ODO = 123456
+
+# ---------------------------------------------------
+def update_speed_constant(v, t, delta_t):
+    return v
+
+# ---------------------------------------------------
+def update_speed_constant_until2_then_stop(v, t, delta_t):
+    if t < 2000:
+        return v
+    return 0
+
+# ---------------------------------------------------
+def update_speed_constant_until2_then_soft_bracking(v, t, delta_t):
+    if t < 2000:
+        return v
+    if v >= 1:
+        return v - 0.05
+    return 0
+
+# ---------------------------------------------------
+def update_pos(s0, v0, delta_t_ms):
+    """
+    Given the position and speed at time t0 (s0, v0),
+    computes the new position at time t1 = t0 + delta_t
+    """
+    return s0 + (v0 * delta_t_ms / 1000)
+
+# ---------------------------------------------------
+def time_to_sampling_index(t_ms, sampling_time_ms):
+    """
+    Given a time in second and a sampling time in ms,
+    return the index in the position array with the
+    position at time t_ms
+    """
+    return t_ms // sampling_time_ms
+
+
+# ---------------------------------------------------
+def tag_checking(prev_real_pos, curr_real_pos, curr_avl_pos, tag_pos_list):
+    if isinstance(tag_pos_list, TagLayout):
+        return tag_pos_list.check(prev_real_pos, curr_real_pos, curr_avl_pos)
+    for tag_pos in tag_pos_list:
+        if prev_real_pos < tag_pos and tag_pos <= curr_real_pos:
+            return tag_pos
+    return curr_avl_pos
+
+# ---------------------------------------------------
+def odometer_delta(real_pos, t_ms, odo_delay_ms,
+                   odo_period_ms=ODO_SAMPLING_PERIOD_MS, pos_period_ms=POS_SAMPLING_PERIOD_MS):
+    if t_ms % odo_period_ms == 0:
+        t_new_odo_ms = t_ms - odo_delay_ms
+        t_prev_odo_ms = t_new_odo_ms - odo_period_ms
+        if t_prev_odo_ms >= 0:
+            return abs(real_pos[time_to_sampling_index(t_new_odo_ms, pos_period_ms)] -
+                       real_pos[time_to_sampling_index(t_prev_odo_ms, pos_period_ms)])
+    return 0
+
+
+# ---------------------------------------------------
+# The five scenarios plotted by tramrun.py. t_start is always 0.
+Scenario = namedtuple('Scenario',
+                      ['name', 't_end_ms', 'v0', 'update_speed', 'tags', 'odo_delay_ms'])
+
+SCENARIOS = (
+    Scenario('constant_speed_no_odo_delay_no_tag',
+             2000, 19.4, update_speed_constant, (), 0),
+    Scenario('constant_speed_no_odo_delay_with_tag',
+             2000, 19.4, update_speed_constant, (1019,), 0),
+    Scenario('constant_speed_odo_delay_with_tag',
+             2000, 19.4, update_speed_constant, (1019,), 256),
+    Scenario('constant_speed_then_hard_stop_odo_delay_with_tag',
+             2500, 19.4, update_speed_constant_until2_then_stop, (1019,), 256),
+    Scenario('constant_speed_then_soft_stop_odo_delay_with_tag',
+             5000, 19.4, update_speed_constant_until2_then_soft_bracking, (1019,), 256),
+)
+
+# ---------------------------------------------------
+def simulate_loop(t_end_ms, v_m_s, update_speed, tag_pos_list, odo_delay_ms,
+                  start_pos=START_POS, pos_period_ms=POS_SAMPLING_PERIOD_MS, profile=None):
+    """
+    Runs the per-step simulation loop used by the tram_run_* functions
+    and returns (t_array, real_pos, avl_pos, error) as Python lists.
+    With a tramtiming.StageTimer as profile (or TRAMRUN_PROFILE set)
+    every stage of the step is timed.
+    """
+    t_array = []
+    real_pos = []
+    avl_pos = []
+    error = []
+    t_ms = 0
+    current_real_pos = start_pos
+    current_avl_pos = start_pos
+
+    report = None
+    if profile is None:
+        profile, report = timer_from_env('simulate_loop')
+    # when not profiling the stages are the plain functions
+    stage_speed, stage_pos = update_speed, update_pos
+    stage_tag, stage_odo = tag_checking, odometer_delta
+    append_t, append_real = t_array.append, real_pos.append
+    append_avl, append_err = avl_pos.append, error.append
+    if profile is not None:
+        stage_speed = profile.wrap('update_speed', update_speed)
+        stage_pos = profile.wrap('update_pos', update_pos)
+        stage_tag = profile.wrap('tag_checking', tag_checking)
+        stage_odo = profile.wrap('odometer_delta', odometer_delta)
+        append_t, append_real, append_avl, append_err = (
+            profile.wrap('append', append) for append in (append_t, append_real, append_avl, append_err))
+        profile.start()
+
+    while t_ms <= t_end_ms:
+
+        append_t(t_ms / 1000)
+
+        previous_real_pos = current_real_pos
+        v_m_s = stage_speed(v_m_s, t_ms, pos_period_ms)
+        current_real_pos = stage_pos(current_real_pos, v_m_s, pos_period_ms)
+        append_real(current_real_pos)
+
+        current_avl_pos = stage_tag(previous_real_pos, current_real_pos, current_avl_pos, tag_pos_list)
+        current_avl_pos += stage_odo(real_pos, t_ms, odo_delay_ms,
+                                     pos_period_ms=pos_period_ms)
+        append_avl(current_avl_pos)
+
+        append_err(current_real_pos - current_avl_pos)
+
+        t_ms += pos_period_ms
+
+    if profile is not None:
+        profile.stop(len(t_array))
+        if report is not None:
+            add_report(profile, report)
+    return t_array, real_pos, avl_pos, error
+
+# ---------------------------------------------------
+def simulate_scenario_loop(scenario):
+    return simulate_loop(scenario.t_end_ms, scenario.v0, scenario.update_speed,
+                         scenario.tags, scenario.odo_delay_ms)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+#
+# Declarative piecewise speed profiles.
+#
+# A SpeedProfile is a list of segments (constant speed, linear
+# acceleration or deceleration, stop, dwell) instead of a Python callback
+# called once per step. It is evaluated over a whole time vector in one
+# vectorized call, integrates to position analytically and can be saved
+# to / loaded from JSON.
+#
+# Example, the soft braking scenario of tramrun.py:
+#   SpeedProfile(19.4).constant(2.0).stop(rate=12.5)
+#
+
+import sys
+import json
+import time
+
+import numpy as np
+
+from trammodel import POS_SAMPLING_PERIOD_MS, START_POS
+from trammodel import update_speed_constant_until2_then_soft_bracking
+from tramvec import time_vector_ms, simulate
+from tramevent import simulate_events
+
+SEGMENT_KINDS = ('constant', 'accelerate', 'decelerate', 'stop', 'dwell')
+
+# ---------------------------------------------------
+class SpeedProfile:
+    """
+    Speed as a function of time (s), made of consecutive segments.
+    Every segment starts from the speed the previous one ends with
+    (v0 for the first one); after the last segment the final speed is
+    kept.
+    """
+
+    def __init__(self, v0=0.0, segments=()):
+        self.v0 = float(v0)
+        self.segments = []
+        self._table = None
+        for segment in segments:
+            self._add(dict(segment))
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _add(self, segment):
+        if segment['kind'] not in SEGMENT_KINDS:
+            raise ValueError(f"unknown segment kind {segment['kind']!r}")
+        self.segments.append(segment)
+        self._table = None
+        return self
+
+    def constant(self, duration):
+        """ keeps the current speed for duration seconds """
+        return self._add({'kind': 'constant', 'duration': duration})
+
+    def accelerate(self, rate, to_speed):
+        """ changes speed linearly (rate in m/s^2, > 0) up to to_speed """
+        return self._add({'kind': 'accelerate', 'rate': rate, 'to_speed': to_speed})
+
+    def decelerate(self, rate, to_speed):
+        """ changes speed linearly (rate in m/s^2, > 0) down to to_speed """
+        return self._add({'kind': 'decelerate', 'rate': rate, 'to_speed': to_speed})
+
+    def stop(self, rate):
+        """ brakes down to zero speed """
+        return self._add({'kind': 'stop', 'rate': rate})
+
+    def dwell(self, duration):
+        """ stands still for duration seconds (speed shall already be zero) """
+        return self._add({'kind': 'dwell', 'duration': duration})
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def to_dict(self):
+        return {'v0': self.v0, 'segments': [dict(segment) for segment in self.segments]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['v0'], data['segments'])
+
+    def save(self, fname):
+        with open(fname, 'w') as fout:
+            json.dump(self.to_dict(), fout)
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname) as fin:
+            return cls.from_dict(json.load(fin))
+
+    def __eq__(self, other):
+        return isinstance(other, SpeedProfile) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"SpeedProfile(v0={self.v0}, {len(self.segments)} segments, {self.duration} s)"
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def table(self):
+        """
+        Normalized segments as arrays: start time, start speed,
+        acceleration and start position (relative to the profile start)
+        """
+        if self._table is not None:
+            return self._table
+        t0, v_start, accel, pos0 = [0.0], [self.v0], [0.0], [0.0]
+        v = self.v0
+        for segment in self.segments:
+            kind = segment['kind']
+            if kind == 'constant':
+                a, duration = 0.0, segment['duration']
+            elif kind == 'dwell':
+                if v != 0:
+                    raise ValueError(f"dwell at non zero speed ({v} m/s)")
+                a, duration = 0.0, segment['duration']
+            else:
+                to_speed = 0.0 if kind == 'stop' else segment['to_speed']
+                rate = segment['rate']
+                if rate <= 0:
+                    raise ValueError(f"{kind} rate shall be > 0 (got {rate})")
+                a = rate if kind == 'accelerate' else -rate
+                duration = (to_speed - v) / a
+                if duration < 0:
+                    raise ValueError(f"cannot {kind} from {v} to {to_speed} m/s")
+            # the last row is the open ended "after the profile" segment
+            accel[-1] = a
+            t0.append(t0[-1] + duration)
+            pos0.append(pos0[-1] + v * duration + a * duration * duration / 2)
+            v = v + a * duration
+            v_start.append(v)
+            accel.append(0.0)
+        self._table = tuple(np.array(col, dtype=np.float64) for col in (t0, v_start, accel, pos0))
+        return self._table
+
+    @property
+    def duration(self):
+        return float(self.table()[0][-1])
+
+    def _locate(self, t):
+        t0, v_start, accel, pos0 = self.table()
+        t = np.asarray(t, dtype=np.float64)
+        seg = np.clip(np.searchsorted(t0, t, side='right') - 1, 0, len(t0) - 1)
+        return seg, t - t0[seg]
+
+    def speed_at(self, t):
+        """ speed (m/s) at the times t (s), vectorized """
+        _, v_start, accel, _ = self.table()
+        seg, tau = self._locate(t)
+        return v_start[seg] + accel[seg] * tau
+
+    def position_at(self, t, start_pos=0.0):
+        """ exact travelled distance at the times t (s), plus start_pos """
+        _, v_start, accel, pos0 = self.table()
+        seg, tau = self._locate(t)
+        return start_pos + pos0[seg] + v_start[seg] * tau + accel[seg] * tau * tau / 2
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def step_segments(self, delta_t_ms=POS_SAMPLING_PERIOD_MS):
+        """
+        Linear per-step speed segments (start_step, speed, speed change
+        per step) of the sampled profile, for tramevent.simulate_events()
+        """
+        t0, _, accel, _ = self.table()
+        dt = delta_t_ms / 1000
+        steps = np.ceil(np.round(t0 / dt, 9)).astype(np.int64)
+        segments = []
+        for i in range(len(t0)):
+            if i + 1 < len(t0) and steps[i + 1] <= steps[i]:
+                continue  # shorter than one step
+            if segments and segments[-1][0] == steps[i]:
+                segments.pop()
+            speed = float(self.speed_at(steps[i] * dt))
+            segments.append((int(steps[i]), speed, float(accel[i] * dt)))
+        return segments
+
+# ---------------------------------------------------
+def simulate_profile(profile, t_end_ms, tag_pos_list, odo_delay_ms, start_pos=START_POS):
+    """
+    tramvec.simulate() with the speed sampled from a SpeedProfile
+    """
+    speed = profile.speed_at(time_vector_ms(t_end_ms) / 1000)
+    return simulate(t_end_ms, profile.v0, None, tag_pos_list, odo_delay_ms, start_pos, speed)
+
+# ---------------------------------------------------
+def simulate_profile_events(profile, t_end_ms, tag_pos_list, odo_delay_ms, start_pos=START_POS):
+    """
+    tramevent.simulate_events() on the step segments of a SpeedProfile
+    """
+    return simulate_events(t_end_ms, profile.v0, None, tag_pos_list, odo_delay_ms, start_pos,
+                           profile.step_segments())
+
+# ---------------------------------------------------
+def timetable_profile(legs, cruise_speed, accel_rate=1.2, brake_rate=1.0):
+    """
+    Profile of a run through stations: legs is a list of
+    (cruise_time_s, dwell_time_s); every leg accelerates to
+    cruise_speed, cruises, brakes to a stop and dwells at the station
+    """
+    profile = SpeedProfile(0.0)
+    for cruise_time, dwell_time in legs:
+        profile.accelerate(accel_rate, cruise_speed).constant(cruise_time).stop(brake_rate)
+        profile.dwell(dwell_time)
+    return profile
+
+# ---------------------------------------------------
+def main():
+    # 1. the soft braking scenario, as a declarative profile
+    soft = SpeedProfile(19.4).constant(2.0).stop(rate=0.05 / (POS_SAMPLING_PERIOD_MS / 1000))
+    assert SpeedProfile.from_dict(json.loads(json.dumps(soft.to_dict()))) == soft
+    reference = simulate(5000, 19.4, update_speed_constant_until2_then_soft_bracking, (1019,), 256)
+    trace = simulate_profile(soft, 5000, (1019,), 256)
+    print(f"soft braking profile: max position difference vs callback "
+          f"{np.abs(trace.real_pos - reference.real_pos).max():.3f} m")
+
+    # 2. a service day from a timetable: 200 stations
+    rng = np.random.default_rng(0)
+    day = timetable_profile(zip(rng.uniform(30, 90, 200), rng.uniform(15, 40, 200)), 19.4)
+    t_end_ms = int(day.duration * 1000) // POS_SAMPLING_PERIOD_MS * POS_SAMPLING_PERIOD_MS
+    t0 = time.perf_counter()
+    trace = simulate_profile(day, t_end_ms, np.arange(1019, 1000 + 200 * 1500, 500.0), 256)
+    elapsed = time.perf_counter() - t0
+    print(f"{day}: {len(trace.t)} samples in {elapsed:.2f} s, "
+          f"max |error| {np.abs(trace.error).max():.2f} m")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
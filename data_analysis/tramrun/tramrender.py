@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+#
+# Headless batch rendering of the tramrun figures.
+#
+# The scenarios are simulated first, in this process, then every figure
+# is drawn and saved (PNG/SVG/...) by a pool of worker processes using
+# the non interactive Agg backend: no display is needed and figures are
+# drawn in parallel.
+#
+# Example:
+#   ./tramrender.py --out-dir report --formats png svg --dpi 150
+#   ./tramrender.py --odo-delays 0 64 128 256 512 --workers 8
+#
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# shall be selected before pyplot is imported (by tramrun)
+import matplotlib
+matplotlib.use('Agg')
+
+from trammodel import SCENARIOS
+from tramcache import simulate_scenario_cached
+
+# ---------------------------------------------------
+def _init_worker():
+    import seaborn as sns
+    sns.set_style('darkgrid')
+
+# ---------------------------------------------------
+def render_trace(scenario, trace, out_dir, formats=('png',), dpi=100, decimate=None):
+    """
+    Draws one scenario and saves it as out_dir/<scenario name>.<format>;
+    returns the list of written files
+    """
+    import matplotlib.pyplot as plt
+    from tramrun import plot_scenario
+
+    fig = plot_scenario(scenario, trace, decimate)
+    fnames = []
+    for fmt in formats:
+        fname = os.path.join(out_dir, f"{scenario.name}.{fmt}")
+        fig.savefig(fname, dpi=dpi)
+        fnames.append(fname)
+    plt.close(fig)
+    return fnames
+
+# ---------------------------------------------------
+def render_batch(scenarios, out_dir, formats=('png',), dpi=100, workers=None, decimate=None):
+    """
+    Simulates all the scenarios (through the result cache), then renders
+    them in parallel
+    (workers=1 renders in this process)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    traces = [simulate_scenario_cached(scenario) for scenario in scenarios]
+    jobs = [(scenario, trace, out_dir, tuple(formats), dpi, decimate)
+            for scenario, trace in zip(scenarios, traces)]
+    if workers == 1:
+        _init_worker()
+        return [render_trace(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(render_trace, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+# ---------------------------------------------------
+def scenario_variants(scenarios, odo_delays_ms):
+    """ every scenario repeated with each odometer delay """
+    return [scenario._replace(name=f"{scenario.name}_delay{delay}", odo_delay_ms=delay)
+            for scenario in scenarios for delay in odo_delays_ms]
+
+# ---------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless rendering of the tramrun figures')
+    parser.add_argument('--out-dir', default='tramrun_figures', help='output directory')
+    parser.add_argument('--formats', nargs='+', default=['png'], help='image formats')
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--decimate', choices=['minmax', 'lttb'],
+                        help='downsample the curves to the figure width (long runs)')
+    parser.add_argument('--scenarios', nargs='+', choices=[s.name for s in SCENARIOS],
+                        help='scenarios to render (default: all)')
+    parser.add_argument('--odo-delays', nargs='+', type=int,
+                        help='render every scenario with each of these odometer delays (ms)')
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in SCENARIOS if args.scenarios is None or s.name in args.scenarios]
+    if args.odo_delays:
+        scenarios = scenario_variants(scenarios, args.odo_delays)
+
+    t0 = time.perf_counter()
+    fnames = render_batch(scenarios, args.out_dir, args.formats, args.dpi, args.workers,
+                          args.decimate)
+    print(f"{sum(len(f) for f in fnames)} files written in {args.out_dir} "
+          f"in {time.perf_counter() - t0:.2f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
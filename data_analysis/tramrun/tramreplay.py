@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Replay of the AVL estimator over recorded logs.
+#
+# A log has one record per sample: timestamp, cumulative odometer count,
+# position of the tag read in that sample (NaN when none) and reference
+# position. The estimator of tramrun (tag reset + odometer deltas) runs
+# over the log one chunk at a time, reading the records through a
+# memory map, and writes the error trace (as a TraceStore) and a JSON
+# summary: the log is never loaded in memory as a whole.
+#
+# Logs are raw binary files of LOG_DTYPE records (.bin), .npy files of
+# the same structured dtype, or CSV files with header
+# t_ms,odo_count,tag_pos,ref_pos (converted first, streaming, to
+# log.bin in the output directory).
+#
+# Example:
+#   ./tramreplay.py --make-demo demo.bin
+#   ./tramreplay.py demo.bin --m-per-count 0.01 --out-dir replay_out
+#
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+from trammodel import ODO_SAMPLING_PERIOD_MS, POS_SAMPLING_PERIOD_MS
+from trammodel import update_speed_constant_until2_then_soft_bracking
+from tramvec import TramTrace, avl_trace, simulate
+from tramstream import RunningStats
+from tramtrace import TraceStore
+
+LOG_DTYPE = np.dtype([('t_ms', '<i8'), ('odo_count', '<i8'), ('tag_pos', '<f8'), ('ref_pos', '<f8')])
+LOG_COLUMNS = LOG_DTYPE.names
+
+DEFAULT_CHUNK_ROWS = 1 << 20
+
+# ---------------------------------------------------
+def open_log(fname):
+    """
+    Memory maps a binary log (.bin raw records or .npy), read only
+    """
+    if fname.endswith('.npy'):
+        log = np.load(fname, mmap_mode='r')
+        if log.dtype != LOG_DTYPE:
+            raise ValueError(f"{fname}: unexpected record type {log.dtype}")
+        return log
+    return np.memmap(fname, dtype=LOG_DTYPE, mode='r')
+
+# ---------------------------------------------------
+def csv_to_binary(csv_fname, bin_fname, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Converts a CSV log to raw binary records, streaming; returns the
+    number of records
+    """
+    import pandas as pd
+
+    n_rows = 0
+    with open(bin_fname, 'wb') as fout:
+        for frame in pd.read_csv(csv_fname, usecols=list(LOG_COLUMNS), chunksize=chunk_rows,
+                                 dtype={'t_ms': np.int64, 'odo_count': np.int64,
+                                        'tag_pos': np.float64, 'ref_pos': np.float64}):
+            records = np.empty(len(frame), dtype=LOG_DTYPE)
+            for name in LOG_COLUMNS:
+                records[name] = frame[name].to_numpy()
+            records.tofile(fout)
+            n_rows += len(records)
+    return n_rows
+
+# ---------------------------------------------------
+def replay_chunks(log, m_per_count, chunk_rows=DEFAULT_CHUNK_ROWS, start_pos=None, stats=None,
+                  counters=None):
+    """
+    Generator of TramTrace chunks of the estimator run over the log:
+    real_pos is the reference position, odo the odometer delta applied
+    in every sample. The estimate starts from start_pos (default: the
+    first reference position). stats (RunningStats) is updated with the
+    errors, counters (dict) with the number of 'tag_reads'.
+    """
+    if len(log) == 0:
+        return
+    last_count = int(log['odo_count'][0])
+    last_avl = float(log['ref_pos'][0] if start_pos is None else start_pos)
+    for k0 in range(0, len(log), chunk_rows):
+        chunk = log[k0:k0 + chunk_rows]
+        counts = np.asarray(chunk['odo_count'])
+        odo = np.abs(np.diff(counts, prepend=last_count)) * m_per_count
+        tag_pos = np.asarray(chunk['tag_pos'])
+        reset_steps = np.nonzero(~np.isnan(tag_pos))[0]
+        avl_pos = avl_trace(odo, reset_steps, tag_pos[reset_steps], last_avl)
+        ref_pos = np.asarray(chunk['ref_pos'], dtype=np.float64)
+        error = ref_pos - avl_pos
+        last_count = int(counts[-1])
+        last_avl = float(avl_pos[-1])
+        if stats is not None:
+            stats.update(error)
+        if counters is not None:
+            counters['tag_reads'] = counters.get('tag_reads', 0) + len(reset_steps)
+        yield TramTrace(np.asarray(chunk['t_ms']) / 1000, ref_pos, odo, avl_pos, error)
+
+# ---------------------------------------------------
+def replay(log_fname, out_dir, m_per_count, chunk_rows=DEFAULT_CHUNK_ROWS, dtype=np.float64):
+    """
+    Replays a log (CSV or binary) and writes the error trace in out_dir
+    (TraceStore) and the summary in out_dir/summary.json; a CSV log is
+    converted to out_dir/log.bin first
+    """
+    if log_fname.endswith('.csv'):
+        os.makedirs(out_dir, exist_ok=True)
+        bin_fname = os.path.join(out_dir, 'log.bin')
+        csv_to_binary(log_fname, bin_fname, chunk_rows)
+        log_fname = bin_fname
+    log = open_log(log_fname)
+
+    stats = RunningStats()
+    counters = {'tag_reads': 0}
+    store = TraceStore(len(log), dtype, out_dir)
+    for chunk in replay_chunks(log, m_per_count, chunk_rows, stats=stats, counters=counters):
+        store.append(chunk)
+    store.close()
+
+    summary = {'log': log_fname, 'records': len(log), 'tag_reads': counters['tag_reads'],
+               'm_per_count': m_per_count, 'error': stats.as_dict()}
+    with open(os.path.join(out_dir, 'summary.json'), 'w') as fout:
+        json.dump(summary, fout, indent=1)
+    return summary
+
+# ---------------------------------------------------
+def make_demo_log(fname, t_end_ms, m_per_count=0.01, odo_delay_ms=256, tags=(1019,)):
+    """
+    Writes a synthetic log from a simulated run: odometer counts are
+    updated every odometer period, with odometer delay
+    """
+    trace = simulate(t_end_ms, 19.4, update_speed_constant_until2_then_soft_bracking,
+                     tags, odo_delay_ms)
+    n = len(trace.t)
+    t_ms = np.round(trace.t * 1000).astype(np.int64)
+    # odometer: position measured odo_delay_ms ago, held for one period
+    held = (t_ms // ODO_SAMPLING_PERIOD_MS) * ODO_SAMPLING_PERIOD_MS - odo_delay_ms
+    idx = np.clip(held // POS_SAMPLING_PERIOD_MS, 0, n - 1)
+    measured = np.where(held >= 0, trace.real_pos[idx], trace.real_pos[0])
+    records = np.empty(n, dtype=LOG_DTYPE)
+    records['t_ms'] = t_ms
+    records['odo_count'] = np.round((measured - measured[0]) / m_per_count).astype(np.int64)
+    records['tag_pos'] = np.nan
+    prev_pos = np.concatenate(([trace.real_pos[0]], trace.real_pos[:-1]))
+    for tag in tags:
+        records['tag_pos'][(prev_pos < tag) & (tag <= trace.real_pos)] = tag
+    records['ref_pos'] = trace.real_pos
+    records.tofile(fname)
+    return n
+
+# ---------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay of the AVL estimator over recorded logs')
+    parser.add_argument('log', nargs='?', help='log file (.csv, .bin or .npy)')
+    parser.add_argument('--m-per-count', type=float, default=0.01,
+                        help='odometer scale (m per count)')
+    parser.add_argument('--out-dir', default='replay_out', help='output directory')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--float32', action='store_true', help='store the trace in float32')
+    parser.add_argument('--make-demo', metavar='BIN',
+                        help='write a synthetic one hour binary log and exit')
+    args = parser.parse_args(argv)
+
+    if args.make_demo:
+        n = make_demo_log(args.make_demo, 3600 * 1000, args.m_per_count)
+        print(f"{n} records written in {args.make_demo}")
+        return 0
+    if args.log is None:
+        parser.error('a log file is required')
+
+    t0 = time.perf_counter()
+    summary = replay(args.log, args.out_dir, args.m_per_count, args.chunk_rows,
+                     np.float32 if args.float32 else np.float64)
+    print(f"{summary['records']} records replayed in {time.perf_counter() - t0:.2f} s")
+    print(json.dumps(summary['error'], indent=1))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
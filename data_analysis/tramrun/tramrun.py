@@ -3,21 +3,34 @@
 # References:
 #   - https://realpython.com/python-matplotlib-guide/
 #
+# Plotting modules (matplotlib, seaborn, plotutils) are only imported
+# when a figure is drawn: with --no-plot the scenarios are simulated and
+# the numeric results written without loading any plotting library.
+#
+# Example:
+#   ./tramrun.py                               (shows all the figures)
+#   ./tramrun.py --no-plot --out tramrun.npz
+#
 
 import os
+import re
 import sys
+import time
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-from plotutils import mplu_text, mplu_realcircle
+from trammodel import SCENARIOS
+from tramcache import simulate_scenario_cached
 
-POS_SAMPLING_PERIOD_MS = 4  # milliseconds
-ODO_SAMPLING_PERIOD_MS = 128 # milliseconds, shall be a sample of POS_SAMPLING_PERIOD_MS
-ODO_SAMPLING_FACTOR = ODO_SAMPLING_PERIOD_MS / POS_SAMPLING_PERIOD_MS
+# the annotation helpers (plotutils) are shared with playwithplots
+PLOTUTILS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'playwithplots')
 
-START_POS = 1000
-START_ODO = 123456
+# ---------------------------------------------------
+def import_plotutils():
+    if PLOTUTILS_DIR not in sys.path:
+        sys.path.append(PLOTUTILS_DIR)
+    import plotutils
+    return plotutils
 
 # ---------------------------------------------------
 # from: https://matplotlib.org/examples/showcase/anatomy.html
@@ -49,91 +62,59 @@ def text(ax, x, y, text):
 
 
 # ---------------------------------------------------
-def update_speed_constant(v, t, delta_t):
-    return v
-
-# ---------------------------------------------------
-def update_speed_constant_until2_then_stop(v, t, delta_t):
-    if t < 2000:
-        return v
-    return 0
-
-# ---------------------------------------------------
-def update_speed_constant_until2_then_soft_bracking(v, t, delta_t):
-    if t < 2000:
-        return v
-    if v >= 1:
-        return v - 0.05
-    return 0
+# plot settings of the scenarios: the title is formatted with the
+# scenario fields, tag_mark is (circle x, circle y, text y)
+SCENARIO_PLOTS = {
+    'constant_speed_no_odo_delay_no_tag': {
+        'title': "Tram position sampling error (constant speed = {v0} m/s)",
+        'err_ylim': [-5, 40], 'pos_ylim': [995, 1040], 'tag_mark': None},
+    'constant_speed_no_odo_delay_with_tag': {
+        'title': "Tram position, sampling error after tag reading (constant speed = {v0} m/s)",
+        'err_ylim': [-5, 40], 'pos_ylim': [995, 1040], 'tag_mark': (0.975, 1017.5, 1017.5)},
+    'constant_speed_odo_delay_with_tag': {
+        'title': "Tram position, with odometer delay (constant speed = {v0} m/s)",
+        'err_ylim': [-5, 40], 'pos_ylim': [995, 1040], 'tag_mark': (0.975, 1012.5, 1012)},
+    'constant_speed_then_hard_stop_odo_delay_with_tag': {
+        'title': "Tram position, with odometer delay (constant speed + hard bracking)",
+        'err_ylim': [-10, 45], 'pos_ylim': [995, 1050], 'tag_mark': (0.975, 1012.5, 1012)},
+    'constant_speed_then_soft_stop_odo_delay_with_tag': {
+        'title': "Tram position, with odometer delay (constant speed + soft braking)",
+        'err_ylim': [-10, 60], 'pos_ylim': [995, 1065], 'tag_mark': None},
+}
 
 # ---------------------------------------------------
-def update_pos(s0, v0, delta_t_ms):
+def plot_curve(ax, x, y, decimate=None, **kwargs):
     """
-    Given the position and speed at time t0 (s0, v0),
-    computes the new position at time t1 = t0 + delta_t
+    ax.plot(x, y), downsampled to the axes width when decimate is
+    'minmax' or 'lttb'
     """
-    return s0 + (v0 * delta_t_ms / 1000)
+    if decimate is None:
+        return ax.plot(x, y, **kwargs)
+    from tramdecimate import plot_decimated
+    return [plot_decimated(ax, x, y, decimate, **kwargs)]
 
 # ---------------------------------------------------
-def time_to_sampling_index(t_ms, sampling_time_ms):
+def fill_curve(ax, x, y, decimate=None, **kwargs):
     """
-    Given a time in second and a sampling time in ms,
-    return the index in the position array with the
-    position at time t_ms
+    ax.fill_between(x, y), drawn as min/max envelope when decimate is set
     """
-    return t_ms // sampling_time_ms
-
-
-# ---------------------------------------------------
-def tag_checking(prev_real_pos, curr_real_pos, curr_avl_pos, tag_pos_list):
-    for tag_pos in tag_pos_list:
-        if prev_real_pos < tag_pos and tag_pos <= curr_real_pos:
-            return tag_pos
-    return curr_avl_pos
-
-# ---------------------------------------------------
-def odometer_delta(real_pos, t_ms, odo_delay_ms):
-    if t_ms % ODO_SAMPLING_PERIOD_MS == 0:
-        t_new_odo_ms = t_ms - odo_delay_ms
-        t_prev_odo_ms = t_new_odo_ms - ODO_SAMPLING_PERIOD_MS
-        if t_prev_odo_ms >= 0:
-            return abs(real_pos[time_to_sampling_index(t_new_odo_ms, POS_SAMPLING_PERIOD_MS)] -
-                       real_pos[time_to_sampling_index(t_prev_odo_ms, POS_SAMPLING_PERIOD_MS)])
-    return 0
+    if decimate is None:
+        return ax.fill_between(x, y, **kwargs)
+    from tramdecimate import fill_decimated
+    return fill_decimated(ax, x, y, **kwargs)
 
 # ---------------------------------------------------
-def tram_run_constant_speed_no_odo_delay_no_tag():
-    t_start_ms = 0
-    t_end_ms = 2000
-
-    t_array = []
-    real_pos = []
-    odo = []
-    avl_pos = []
-    error = []
-    t_ms = t_start_ms
-    v_m_s = 19.4
-    current_real_pos = START_POS
-    current_avl_pos = START_POS
-
-    current_odo = START_ODO
-
-    while t_ms <= t_end_ms:
-
-        t_array.append(t_ms / 1000)
-
-        previous_real_pos = current_real_pos
-        v_m_s = update_speed_constant(v_m_s, t_ms, POS_SAMPLING_PERIOD_MS)
-        current_real_pos = update_pos(current_real_pos,v_m_s, POS_SAMPLING_PERIOD_MS)
-        real_pos.append(current_real_pos)
-
-        current_avl_pos = tag_checking(previous_real_pos, current_real_pos, current_avl_pos, ())
-        current_avl_pos += odometer_delta(real_pos, t_ms, 0)
-        avl_pos.append(current_avl_pos)
-
-        error.append(current_real_pos - current_avl_pos)
-
-        t_ms += POS_SAMPLING_PERIOD_MS
+def plot_tram_run(t_array, real_pos, avl_pos, error, title,
+                  err_ylim=None, pos_ylim=None, tag_mark=None, decimate=None):
+    """
+    Plots a tram run: error (filled) on the left axis, real and
+    estimated position on the right one. Returns the figure.
+    With decimate='minmax' or 'lttb' the curves are downsampled to the
+    width of the axes (and again on every zoom), for long traces.
+    """
+    import matplotlib.pyplot as plt
+    plotutils = import_plotutils()
+    mplu_text, mplu_realcircle = plotutils.mplu_text, plotutils.mplu_realcircle
 
     fig, ax_err = plt.subplots()
 
@@ -141,267 +122,139 @@ def tram_run_constant_speed_no_odo_delay_no_tag():
 
     # instantiate a second axes that shares the same x-axis
     ax_err.set_ylabel('Error (m)', color='blue')
-    ax_err.plot(t_array, error, color='lightblue')
+    plot_curve(ax_err, t_array, error, decimate, color='lightblue')
     ax_err.tick_params(axis='y', color='blue')
-    ax_err.set_ylim([-5, 40])
-    ax_err.fill_between(t_array, error, color='lightblue')
+    if err_ylim is not None:
+        ax_err.set_ylim(err_ylim)
+    fill_curve(ax_err, t_array, error, decimate, color='lightblue')
 
     ax = ax_err.twinx()
     ax.set_ylabel('Tram position (m)')
-    ax.plot(t_array, real_pos, color='tab:green')
-    ax.plot(t_array, avl_pos, color='firebrick')
+    plot_curve(ax, t_array, real_pos, decimate, color='tab:green')
+    plot_curve(ax, t_array, avl_pos, decimate, color='firebrick')
     ax.tick_params(axis='y')
-    ax.set_ylim([995, 1040])
-    ax.set_title(f"Tram position sampling error (constant speed = {v_m_s} m/s)")
+    if pos_ylim is not None:
+        ax.set_ylim(pos_ylim)
+    ax.set_title(title)
 
     ax.legend(['real pos', 'estimated pos'], loc=(0.05, 0.86))
     ax_err.legend(['error'], loc=(0.05,0.78))
 
-# ---------------------------------------------------
-def tram_run_constant_speed_no_odo_delay_with_tag():
-    t_start_ms = 0
-    t_end_ms = 2000
-
-    t_array = []
-    real_pos = []
-    odo = []
-    avl_pos = []
-    error = []
-    t_ms = t_start_ms
-    current_real_pos = START_POS
-    current_avl_pos = START_POS
-    v_m_s = 19.4
-
-    current_odo = START_ODO
-
-    while t_ms <= t_end_ms:
-
-        t_array.append(t_ms / 1000)
-
-        previous_real_pos = current_real_pos
-        v_m_s = update_speed_constant(v_m_s, t_ms, POS_SAMPLING_PERIOD_MS)
-        current_real_pos = update_pos(current_real_pos, v_m_s, POS_SAMPLING_PERIOD_MS)
-        real_pos.append(current_real_pos)
-
-        current_avl_pos = tag_checking(previous_real_pos, current_real_pos, current_avl_pos, (1019,))
-        current_avl_pos += odometer_delta(real_pos, t_ms, 0)
-        avl_pos.append(current_avl_pos)
+    if tag_mark is not None:
+        circle_x, circle_y, text_y = tag_mark
+        mplu_realcircle(ax, circle_x, circle_y, 0.03)
+        mplu_text(ax, 1.24, text_y, "tag reading")
 
-        error.append(current_real_pos - current_avl_pos)
+    return fig
 
-        t_ms += POS_SAMPLING_PERIOD_MS
-
-    fig, ax_err = plt.subplots()
-
-    ax_err.set_xlabel('time (s)')
+# ---------------------------------------------------
+def scenario_plot_settings(scenario):
+    """
+    Plot settings of a scenario; the odometer delay variants of
+    tramrender (<name>_delay<ms>) take the settings of their scenario
+    """
+    settings = SCENARIO_PLOTS.get(scenario.name)
+    if settings is None:
+        base = SCENARIO_PLOTS.get(re.sub(r'_delay\d+$', '', scenario.name))
+        if base is None:
+            return {'title': scenario.name}
+        settings = dict(base, title=base['title'] + " - odometer delay {odo_delay_ms} ms")
+    return settings
 
-    # instantiate a second axes that shares the same x-axis
-    ax_err.set_ylabel('Error (m)', color='blue')
-    ax_err.plot(t_array, error, color='lightblue')
-    ax_err.tick_params(axis='y', color='blue')
-    ax_err.set_ylim([-5, 40])
-    ax_err.fill_between(t_array, error, color='lightblue')
+# ---------------------------------------------------
+def plot_scenario(scenario, trace=None, decimate=None):
+    """
+    Plots a scenario; the trace is simulated (or taken from the result
+    cache) when not given
+    """
+    if trace is None:
+        trace = simulate_scenario_cached(scenario)
+    settings = scenario_plot_settings(scenario)
+    return plot_tram_run(trace.t, trace.real_pos, trace.avl_pos, trace.error,
+                         settings['title'].format(**scenario._asdict()),
+                         settings.get('err_ylim'), settings.get('pos_ylim'),
+                         settings.get('tag_mark'), decimate)
 
-    ax = ax_err.twinx()
-    ax.set_ylabel('Tram position (m)')
-    ax.plot(t_array, real_pos, color='tab:green')
-    ax.plot(t_array, avl_pos, color='firebrick')
-    ax.tick_params(axis='y')
-    ax.set_ylim([995, 1040])
-    ax.set_title(f"Tram position, sampling error after tag reading (constant speed = {v_m_s} m/s)")
+# ---------------------------------------------------
+def scenario_by_name(name):
+    for scenario in SCENARIOS:
+        if scenario.name == name:
+            return scenario
+    raise KeyError(f"unknown scenario {name!r}")
 
-    ax.legend(['real pos', 'estimated pos'], loc=(0.05, 0.86))
-    ax_err.legend(['error'], loc=(0.05,0.78))
+# ---------------------------------------------------
+def tram_run_constant_speed_no_odo_delay_no_tag():
+    return plot_scenario(scenario_by_name('constant_speed_no_odo_delay_no_tag'))
 
-    mplu_realcircle(ax, 0.975, 1017.5, 0.03)
-    mplu_text(ax, 1.24, 1017.5, "tag reading")
+# ---------------------------------------------------
+def tram_run_constant_speed_no_odo_delay_with_tag():
+    return plot_scenario(scenario_by_name('constant_speed_no_odo_delay_with_tag'))
 
 # ---------------------------------------------------
 def tram_run_constant_speed_odo_delay_with_tag():
-    t_start_ms = 0
-    t_end_ms = 2000
-
-    t_array = []
-    real_pos = []
-    odo = []
-    avl_pos = []
-    error = []
-    t_ms = t_start_ms
-    current_real_pos = START_POS
-    current_avl_pos = START_POS
-    v_m_s = 19.4
-
-    current_odo = START_ODO
-
-    while t_ms <= t_end_ms:
-
-        t_array.append(t_ms / 1000)
-
-        previous_real_pos = current_real_pos
-        v_m_s = update_speed_constant(v_m_s, t_ms, POS_SAMPLING_PERIOD_MS)
-        current_real_pos = update_pos(current_real_pos, v_m_s, POS_SAMPLING_PERIOD_MS)
-        real_pos.append(current_real_pos)
-
-        current_avl_pos = tag_checking(previous_real_pos, current_real_pos, current_avl_pos, (1019,))
-        current_avl_pos += odometer_delta(real_pos, t_ms, 256)
-        avl_pos.append(current_avl_pos)
-
-        error.append(current_real_pos - current_avl_pos)
-
-        t_ms += POS_SAMPLING_PERIOD_MS
-
-    fig, ax_err = plt.subplots()
-
-    ax_err.set_xlabel('time (s)')
-
-    # instantiate a second axes that shares the same x-axis
-    ax_err.set_ylabel('Error (m)', color='blue')
-    ax_err.plot(t_array, error, color='lightblue')
-    ax_err.tick_params(axis='y', color='blue')
-    ax_err.set_ylim([-5, 40])
-    ax_err.fill_between(t_array, error, color='lightblue')
-
-    ax = ax_err.twinx()
-    ax.set_ylabel('Tram position (m)')
-    ax.plot(t_array, real_pos, color='tab:green')
-    ax.plot(t_array, avl_pos, color='firebrick')
-    ax.tick_params(axis='y')
-    ax.set_ylim([995, 1040])
-    ax.set_title(f"Tram position, with odometer delay (constant speed = {v_m_s} m/s)")
-
-    ax.legend(['real pos', 'estimated pos'], loc=(0.05, 0.86))
-    ax_err.legend(['error'], loc=(0.05,0.78))
-
-    mplu_realcircle(ax, 0.975, 1012.5, 0.03)
-    mplu_text(ax, 1.24, 1012, "tag reading")
+    return plot_scenario(scenario_by_name('constant_speed_odo_delay_with_tag'))
 
 # ---------------------------------------------------
 def tram_run_constant_speed_then_hard_stop_odo_delay_with_tag():
-    t_start_ms = 0
-    t_end_ms = 2500
-
-    t_array = []
-    real_pos = []
-    odo = []
-    avl_pos = []
-    error = []
-    t_ms = t_start_ms
-    current_real_pos = START_POS
-    current_avl_pos = START_POS
-    v_m_s = 19.4
-
-    current_odo = START_ODO
-
-    while t_ms <= t_end_ms:
-
-        t_array.append(t_ms / 1000)
-
-        previous_real_pos = current_real_pos
-        v_m_s = update_speed_constant_until2_then_stop(v_m_s, t_ms, POS_SAMPLING_PERIOD_MS)
-        current_real_pos = update_pos(current_real_pos, v_m_s, POS_SAMPLING_PERIOD_MS)
-        real_pos.append(current_real_pos)
-
-        current_avl_pos = tag_checking(previous_real_pos, current_real_pos, current_avl_pos, (1019,))
-        current_avl_pos += odometer_delta(real_pos, t_ms, 256)
-        avl_pos.append(current_avl_pos)
-
-        error.append(current_real_pos - current_avl_pos)
-
-        t_ms += POS_SAMPLING_PERIOD_MS
-
-    fig, ax_err = plt.subplots()
-
-    ax_err.set_xlabel('time (s)')
-
-    # instantiate a second axes that shares the same x-axis
-    ax_err.set_ylabel('Error (m)', color='blue')
-    ax_err.plot(t_array, error, color='lightblue')
-    ax_err.tick_params(axis='y', color='blue')
-    ax_err.set_ylim([-10, 45])
-    ax_err.fill_between(t_array, error, color='lightblue')
-
-    ax = ax_err.twinx()
-    ax.set_ylabel('Tram position (m)')
-    ax.plot(t_array, real_pos, color='tab:green')
-    ax.plot(t_array, avl_pos, color='firebrick')
-    ax.tick_params(axis='y')
-    ax.set_ylim([995, 1050])
-    ax.set_title(f"Tram position, with odometer delay (constant speed + hard bracking)")
-
-    ax.legend(['real pos', 'estimated pos'], loc=(0.05, 0.86))
-    ax_err.legend(['error'], loc=(0.05,0.78))
-
-    mplu_realcircle(ax, 0.975, 1012.5, 0.03)
-    mplu_text(ax, 1.24, 1012, "tag reading")
+    return plot_scenario(scenario_by_name('constant_speed_then_hard_stop_odo_delay_with_tag'))
 
 # ---------------------------------------------------
 def tram_run_constant_speed_then_soft_stop_odo_delay_with_tag():
-    t_start_ms = 0
-    t_end_ms = 5000
-
-    t_array = []
-    real_pos = []
-    odo = []
-    avl_pos = []
-    error = []
-    t_ms = t_start_ms
-    current_real_pos = START_POS
-    current_avl_pos = START_POS
-    v_m_s = 19.4
-
-    current_odo = START_ODO
-
-    while t_ms <= t_end_ms:
-
-        t_array.append(t_ms / 1000)
-
-        previous_real_pos = current_real_pos
-        v_m_s = update_speed_constant_until2_then_soft_bracking(v_m_s, t_ms, POS_SAMPLING_PERIOD_MS)
-        current_real_pos = update_pos(current_real_pos, v_m_s, POS_SAMPLING_PERIOD_MS)
-        real_pos.append(current_real_pos)
-
-        current_avl_pos = tag_checking(previous_real_pos, current_real_pos, current_avl_pos, (1019,))
-        current_avl_pos += odometer_delta(real_pos, t_ms, 256)
-        avl_pos.append(current_avl_pos)
+    return plot_scenario(scenario_by_name('constant_speed_then_soft_stop_odo_delay_with_tag'))
 
-        error.append(current_real_pos - current_avl_pos)
-
-        t_ms += POS_SAMPLING_PERIOD_MS
-
-    fig, ax_err = plt.subplots()
-
-    ax_err.set_xlabel('time (s)')
-
-    # instantiate a second axes that shares the same x-axis
-    ax_err.set_ylabel('Error (m)', color='blue')
-    ax_err.plot(t_array, error, color='lightblue')
-    ax_err.tick_params(axis='y', color='blue')
-    ax_err.set_ylim([-10, 60])
-    ax_err.fill_between(t_array, error, color='lightblue')
+# ---------------------------------------------------
+def compute_scenarios(scenarios):
+    """
+    Simulates the scenarios (through the result cache); returns
+    {scenario name: TramTrace}
+    """
+    return {scenario.name: simulate_scenario_cached(scenario) for scenario in scenarios}
 
-    ax = ax_err.twinx()
-    ax.set_ylabel('Tram position (m)')
-    ax.plot(t_array, real_pos, color='tab:green')
-    ax.plot(t_array, avl_pos, color='firebrick')
-    ax.tick_params(axis='y')
-    ax.set_ylim([995, 1065])
-    ax.set_title(f"Tram position, with odometer delay (constant speed + soft braking)")
+# ---------------------------------------------------
+def write_results(traces, fname):
+    """
+    Writes the traces in a .npz file, as <scenario name>/<field> arrays
+    """
+    arrays = {f"{name}/{field}": np.asarray(values)
+              for name, trace in traces.items() for field, values in trace._asdict().items()}
+    np.savez_compressed(fname, **arrays)
 
-    ax.legend(['real pos', 'estimated pos'], loc=(0.05, 0.86))
-    ax_err.legend(['error'], loc=(0.05,0.78))
+# ---------------------------------------------------
+def print_summary(traces):
+    print(f"{'scenario':50s} {'max |err|':>10s} {'mean |err|':>10s} {'final err':>10s}")
+    for name, trace in traces.items():
+        abs_error = np.abs(trace.error)
+        print(f"{name:50s} {abs_error.max():10.3f} {abs_error.mean():10.3f} {trace.error[-1]:10.3f}")
 
 # ---------------------------------------------------
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tram AVL position estimation scenarios')
+    parser.add_argument('--scenarios', nargs='+', default=[s.name for s in SCENARIOS],
+                        choices=[s.name for s in SCENARIOS])
+    parser.add_argument('--no-plot', action='store_true',
+                        help='only compute: no plotting module is imported')
+    parser.add_argument('--out', help='write the traces in this .npz file')
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    traces = compute_scenarios([scenario_by_name(name) for name in args.scenarios])
+    if args.out:
+        write_results(traces, args.out)
+    if args.no_plot:
+        print_summary(traces)
+        print(f"computed in {time.perf_counter() - t0:.3f} s")
+        return 0
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     sns.set_style('darkgrid')
-    tram_run_constant_speed_no_odo_delay_no_tag()
-    tram_run_constant_speed_no_odo_delay_with_tag()
-    tram_run_constant_speed_odo_delay_with_tag()
-    tram_run_constant_speed_then_hard_stop_odo_delay_with_tag()
-    tram_run_constant_speed_then_soft_stop_odo_delay_with_tag()
+    for name, trace in traces.items():
+        plot_scenario(scenario_by_name(name), trace)
     plt.show()
+    return 0
 
 
 
 if __name__ == '__main__':
-    main()
-
+    sys.exit(main())
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+#
+# Estimator variants run in parallel against one shared reference trace.
+#
+# The ground truth trajectory (real_pos) of a scenario is computed once
+# and placed in shared memory (multiprocessing.shared_memory): the worker
+# processes map it without copying or pickling the arrays, and run the
+# AVL estimator with different settings (odometer delay, odometer
+# sampling period, tag layout, tag reset policy). Every worker writes the
+# error trace of its variant in a shared result matrix, and returns only
+# the (small) error summary to the parent.
+#
+# Example:
+#   ./tramshared.py --odo-delay 0 128 256 --odo-period 64 128 256 \
+#                   --policy reset blend none --t-end 60000
+#
+
+import sys
+import time
+import argparse
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from trammodel import POS_SAMPLING_PERIOD_MS, ODO_SAMPLING_PERIOD_MS, START_POS, SCENARIOS
+from tramvec import time_vector_ms, speed_trace, position_trace, odometer_deltas, tag_resets, avl_trace
+from tramsweep import error_summary
+
+# reset_weight is the weight of the tag position in the 'blend' policy
+Variant = namedtuple('Variant', ['name', 'odo_delay_ms', 'odo_period_ms', 'tags',
+                                 'reset_policy', 'reset_weight'])
+Variant.__new__.__defaults__ = (ODO_SAMPLING_PERIOD_MS, (), 'reset', 0.5)
+
+# what the AVL estimate does when a tag is read
+RESET_POLICIES = ('reset', 'blend', 'none')
+
+# ---------------------------------------------------
+def _attach(name):
+    # since Python 3.13 only the creator process shall track the block
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    return SharedMemory(name=name)
+
+# ---------------------------------------------------
+class SharedArrays:
+    """
+    Named float64 arrays laid out in one shared memory block. The
+    creator owns the block (close() also unlinks it); the other
+    processes attach() to it through the picklable descriptor.
+    """
+    def __init__(self, shm, layout, owner):
+        self.shm = shm
+        self.layout = layout
+        self.owner = owner
+        self.arrays = {}
+        offset = 0
+        for key, shape in layout:
+            n = int(np.prod(shape))
+            self.arrays[key] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=offset)
+            offset += n * 8
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @classmethod
+    def create(cls, shapes):
+        """
+        Allocates the arrays: shapes is a list of (key, shape) pairs
+        """
+        layout = [(key, tuple(np.atleast_1d(shape).tolist())) for key, shape in shapes]
+        nbytes = sum(int(np.prod(shape)) * 8 for _, shape in layout)
+        return cls(SharedMemory(create=True, size=max(nbytes, 1)), layout, owner=True)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @classmethod
+    def attach(cls, descriptor):
+        name, layout = descriptor
+        return cls(_attach(name), layout, owner=False)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @property
+    def descriptor(self):
+        return self.shm.name, self.layout
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def close(self):
+        # views shall be released before the buffer is closed
+        self.arrays = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# ---------------------------------------------------
+def reference_trace(scenario, start_pos=START_POS):
+    """
+    Ground truth of a scenario: (t_ms, real_pos); it does not depend on
+    the estimator settings
+    """
+    t_ms = time_vector_ms(scenario.t_end_ms)
+    return t_ms, position_trace(speed_trace(scenario.update_speed, scenario.v0, t_ms), start_pos)
+
+# ---------------------------------------------------
+def avl_trace_policy(odo, reset_steps, reset_values, start_pos, policy='reset', weight=0.5):
+    """
+    AVL estimate with a tag reset policy: 'reset' moves the estimate to
+    the tag position (as trammodel does), 'blend' moves it to
+    weight * tag + (1 - weight) * estimate (weight=1 is 'reset'), 'none'
+    ignores the tags
+    """
+    if policy == 'reset':
+        return avl_trace(odo, reset_steps, reset_values, start_pos)
+    if policy == 'none':
+        return avl_trace(odo, reset_steps[:0], reset_values[:0], start_pos)
+    if policy != 'blend':
+        raise ValueError(f"unknown reset policy {policy!r}, expected one of {RESET_POLICIES}")
+    # plain[k]: estimate before step k without any reset; every reset
+    # shifts the rest of the trace by a constant: the shifts are computed
+    # per reset (as in trammodel, the odometer delta of the reset step
+    # is added after the reset), then applied with one cumulative sum
+    plain = np.add.accumulate(np.concatenate(([float(start_pos)], odo)))
+    shifts = np.zeros(len(odo))
+    offset = 0.0
+    for step, before, tag_pos in zip(reset_steps.tolist(), plain[reset_steps].tolist(),
+                                     reset_values.tolist()):
+        shift = weight * (tag_pos - (before + offset))
+        shifts[step] += shift
+        offset += shift
+    return plain[1:] + np.add.accumulate(shifts)
+
+# ---------------------------------------------------
+_shared = None
+
+def _init_worker(descriptor):
+    global _shared
+    _shared = SharedArrays.attach(descriptor)
+
+# ---------------------------------------------------
+def run_variant(index, variant, start_pos=START_POS, shared=None):
+    """
+    Runs one variant against the shared reference trace, writes its
+    error in row index of the shared 'error' matrix and returns its
+    summary
+    """
+    shared = shared if shared is not None else _shared
+    t_ms = shared['t_ms'].astype(np.int64)
+    real_pos = shared['real_pos']
+    odo = odometer_deltas(t_ms, real_pos, variant.odo_delay_ms, variant.odo_period_ms)
+    reset_steps, reset_values = tag_resets(real_pos, variant.tags, start_pos)
+    avl_pos = avl_trace_policy(odo, reset_steps, reset_values, start_pos,
+                               variant.reset_policy, variant.reset_weight)
+    error = shared['error'][index]
+    np.subtract(real_pos, avl_pos, out=error)
+    summary = {'variant': variant.name}
+    summary.update(error_summary(error, reset_steps if variant.reset_policy != 'none' else []))
+    return summary
+
+# ---------------------------------------------------
+def run_variants(scenario, variants, workers=None, start_pos=START_POS):
+    """
+    Computes the reference trace of the scenario once, then runs all the
+    variants against it in a process pool (workers=1 runs in this
+    process). Returns (summaries, error matrix shaped (len(variants),
+    n_samples)), in the same order as variants
+    """
+    t_ms, real_pos = reference_trace(scenario, start_pos)
+    shapes = [('t_ms', len(t_ms)), ('real_pos', len(t_ms)), ('error', (len(variants), len(t_ms)))]
+    with SharedArrays.create(shapes) as shared:
+        shared['t_ms'][:] = t_ms
+        shared['real_pos'][:] = real_pos
+        if workers == 1:
+            summaries = [run_variant(k, variant, start_pos, shared) for k, variant in enumerate(variants)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(shared.descriptor,)) as pool:
+                summaries = list(pool.map(run_variant, range(len(variants)), variants,
+                                          itertools.repeat(start_pos)))
+        errors = shared['error'].copy()
+    return summaries, errors
+
+# ---------------------------------------------------
+def variant_grid(odo_delays_ms=(0,), odo_periods_ms=(ODO_SAMPLING_PERIOD_MS,), tag_layouts=((),),
+                 policies=('reset',), reset_weight=0.5):
+    return [Variant(f"delay={delay}ms period={period}ms tags={','.join(str(t) for t in tags) or '-'} "
+                    f"policy={policy}", delay, period, tuple(tags), policy, reset_weight)
+            for delay, period, tags, policy
+            in itertools.product(odo_delays_ms, odo_periods_ms, tag_layouts, policies)]
+
+# ---------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Estimator variants against a shared reference trace')
+    parser.add_argument('--scenario', default=SCENARIOS[-1].name, choices=[s.name for s in SCENARIOS])
+    parser.add_argument('--t-end', type=int, help='run length (ms), default: the scenario one')
+    parser.add_argument('--odo-delay', type=int, nargs='+', default=[0, 128, 256])
+    parser.add_argument('--odo-period', type=int, nargs='+', default=[ODO_SAMPLING_PERIOD_MS])
+    parser.add_argument('--tags', action='append', default=None,
+                        help='comma separated tag positions, can be repeated (default: the scenario ones)')
+    parser.add_argument('--policy', nargs='+', default=['reset'], choices=RESET_POLICIES)
+    parser.add_argument('--reset-weight', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    scenario = next(s for s in SCENARIOS if s.name == args.scenario)
+    if args.t_end is not None:
+        scenario = scenario._replace(t_end_ms=args.t_end)
+    if args.tags is None:
+        tag_layouts = [tuple(scenario.tags)]
+    else:
+        tag_layouts = [tuple(float(t) for t in text.split(',') if t.strip()) for text in args.tags]
+    variants = variant_grid(args.odo_delay, args.odo_period, tag_layouts, args.policy, args.reset_weight)
+
+    t0 = time.perf_counter()
+    summaries, errors = run_variants(scenario, variants, args.workers)
+    print(f"{len(variants)} variants x {errors.shape[1]} samples in {time.perf_counter() - t0:.2f} s")
+    for summary in summaries:
+        print(f"{summary['variant']:60s} max {summary['err_max']:8.3f} m  "
+              f"mean {summary['err_mean']:8.3f} m  p95 {summary['err_p95']:8.3f} m")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#
+# Streaming mode for very long tram runs.
+#
+# The run is produced chunk by chunk by a generator: only a ring buffer
+# with the last positions needed by the (delayed) odometer is kept
+# between chunks, and the error statistics are updated online, so the
+# memory used does not depend on the length of the run.
+#
+
+import sys
+import math
+import time
+import tracemalloc
+
+import numpy as np
+
+from trammodel import POS_SAMPLING_PERIOD_MS, ODO_SAMPLING_PERIOD_MS, START_POS
+from trammodel import SCENARIOS, update_speed_constant
+from tramtags import TagLayout
+from tramvec import TramTrace, speed_trace, position_trace, avl_trace, simulate_scenario
+
+DEFAULT_CHUNK_SAMPLES = 65536
+
+# ---------------------------------------------------
+class RunningStats:
+    """
+    Online statistics of a stream of values, updated one chunk at a time
+    (Chan et al. parallel variance algorithm)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.max_abs = 0.0
+
+    def update(self, values):
+        n = len(values)
+        if n == 0:
+            return
+        chunk_mean = float(values.mean())
+        chunk_m2 = float(((values - chunk_mean) ** 2).sum())
+        total = self.count + n
+        delta = chunk_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.max_abs = max(self.max_abs, float(np.abs(values).max()))
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else math.nan
+
+    def as_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'std': self.std,
+                'min': self.min, 'max': self.max, 'max_abs': self.max_abs}
+
+# ---------------------------------------------------
+def ring_buffer_len(odo_delay_ms, odo_period_ms=ODO_SAMPLING_PERIOD_MS,
+                    pos_period_ms=POS_SAMPLING_PERIOD_MS):
+    """
+    Number of past positions the odometer can look back to:
+    odometer delay plus one odometer period, plus the current sample
+    """
+    return -(-(odo_delay_ms + odo_period_ms) // pos_period_ms) + 1
+
+# ---------------------------------------------------
+def stream_chunks(t_end_ms, v0, update_speed, tag_pos_list, odo_delay_ms,
+                  start_pos=START_POS, chunk_samples=DEFAULT_CHUNK_SAMPLES, stats=None):
+    """
+    Generator of TramTrace chunks of at most chunk_samples samples; the
+    concatenation of all the chunks is identical to tramvec.simulate().
+    t_end_ms=None streams forever. When a RunningStats object is given,
+    it is updated with the error of every chunk before it is yielded.
+    """
+    if odo_delay_ms < 0:
+        raise ValueError(f"odometer delay shall be >= 0 (got {odo_delay_ms})")
+    if not isinstance(tag_pos_list, TagLayout):
+        tag_pos_list = TagLayout(tag_pos_list)
+
+    # ring buffer with the last positions, history[-1] is the position at
+    # the end of step k0 - 1
+    history = np.empty(0, dtype=np.float64)
+    history_len = ring_buffer_len(odo_delay_ms)
+    v = v0
+    last_pos = float(start_pos)
+    last_avl = float(start_pos)
+    k0 = 0
+    while t_end_ms is None or k0 * POS_SAMPLING_PERIOD_MS <= t_end_ms:
+        k1 = k0 + chunk_samples
+        if t_end_ms is not None:
+            k1 = min(k1, t_end_ms // POS_SAMPLING_PERIOD_MS + 1)
+        t_ms = np.arange(k0, k1, dtype=np.int64) * POS_SAMPLING_PERIOD_MS
+
+        speed = speed_trace(update_speed, v, t_ms)
+        real_pos = position_trace(speed, last_pos)
+
+        # odometer deltas, looking back in the ring buffer + this chunk
+        window = np.concatenate((history, real_pos))
+        window_k0 = k0 - len(history)
+        odo = np.zeros(len(t_ms), dtype=np.float64)
+        t_new_odo_ms = t_ms - odo_delay_ms
+        t_prev_odo_ms = t_new_odo_ms - ODO_SAMPLING_PERIOD_MS
+        sampled = np.nonzero((t_ms % ODO_SAMPLING_PERIOD_MS == 0) & (t_prev_odo_ms >= 0))[0]
+        odo[sampled] = np.abs(window[t_new_odo_ms[sampled] // POS_SAMPLING_PERIOD_MS - window_k0] -
+                              window[t_prev_odo_ms[sampled] // POS_SAMPLING_PERIOD_MS - window_k0])
+
+        reset_steps, reset_values = tag_pos_list.bulk_resets(real_pos, last_pos)
+        avl_pos = avl_trace(odo, reset_steps, reset_values, last_avl)
+        error = real_pos - avl_pos
+
+        history = window[-history_len:].copy()
+        v = speed[-1]
+        last_pos = real_pos[-1]
+        last_avl = avl_pos[-1]
+        k0 = k1
+
+        if stats is not None:
+            stats.update(error)
+        yield TramTrace(t_ms / 1000, real_pos, odo, avl_pos, error)
+
+# ---------------------------------------------------
+def stream_samples(t_end_ms, v0, update_speed, tag_pos_list, odo_delay_ms,
+                   start_pos=START_POS, chunk_samples=DEFAULT_CHUNK_SAMPLES, stats=None):
+    """
+    Same as stream_chunks(), one (t, real_pos, avl_pos, error) tuple per sample
+    """
+    for chunk in stream_chunks(t_end_ms, v0, update_speed, tag_pos_list, odo_delay_ms,
+                               start_pos, chunk_samples, stats):
+        yield from zip(chunk.t.tolist(), chunk.real_pos.tolist(),
+                       chunk.avl_pos.tolist(), chunk.error.tolist())
+
+# ---------------------------------------------------
+def stream_scenario(scenario, chunk_samples=DEFAULT_CHUNK_SAMPLES, stats=None):
+    return stream_chunks(scenario.t_end_ms, scenario.v0, scenario.update_speed,
+                         scenario.tags, scenario.odo_delay_ms,
+                         chunk_samples=chunk_samples, stats=stats)
+
+# ---------------------------------------------------
+def main():
+    # 1. chunked streaming shall give the same traces of the vectorized engine
+    all_ok = True
+    for scenario in SCENARIOS:
+        reference = simulate_scenario(scenario)
+        chunks = list(stream_scenario(scenario, chunk_samples=97))
+        ok = all(np.array_equal(np.concatenate([getattr(c, field) for c in chunks]),
+                                getattr(reference, field))
+                 for field in TramTrace._fields)
+        all_ok = all_ok and ok
+        print(f"{scenario.name:52s} {'OK' if ok else 'MISMATCH'}")
+
+    # 2. an 8 hours shift with flat memory
+    stats = RunningStats()
+    tags = np.arange(1019, 1019 + 20 * 3600 * 8, 400.0)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for _ in stream_chunks(8 * 3600 * 1000, 19.4, update_speed_constant, tags, 256, stats=stats):
+        pass
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"8 hours run: {stats.count} samples in {elapsed:.2f} s, "
+          f"peak memory {peak / 2**20:.1f} MiB")
+    print(stats.as_dict())
+
+    return 0 if all_ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+#
+# Parameter sweep of the tram AVL estimator.
+#
+# Every combination of the parameter grids is simulated with the
+# vectorized engine (tramvec) in a pool of worker processes, and the
+# error summary of every run is collected in one table (CSV).
+#
+# Example:
+#   ./tramsweep.py --odo-delay 0 128 256 512 --speed 10 19.4 25 \
+#                  --tags 1019 --tags 1019,1050 --profile constant soft_stop \
+#                  --out sweep.csv
+#
+
+import os
+import sys
+import csv
+import argparse
+import itertools
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from trammodel import update_speed_constant, update_speed_constant_until2_then_stop
+from trammodel import update_speed_constant_until2_then_soft_bracking
+from trammodel import POS_SAMPLING_PERIOD_MS, Scenario
+from tramvec import simulate_scenario, tag_resets
+from tramcache import ResultCache
+
+SPEED_PROFILES = {
+    'constant': update_speed_constant,
+    'hard_stop': update_speed_constant_until2_then_stop,
+    'soft_stop': update_speed_constant_until2_then_soft_bracking,
+}
+
+SUMMARY_FIELDS = ['profile', 'v0', 'odo_delay_ms', 'tags', 't_end_ms',
+                  'err_max', 'err_mean', 'err_p95', 'n_resets', 'max_time_to_reset_s']
+
+# ---------------------------------------------------
+def sweep_grid(profiles=('constant',), speeds=(19.4,), odo_delays_ms=(0,),
+               tag_layouts=((1019,),), t_ends_ms=(2000,)):
+    """
+    Cartesian product of the parameter grids, as a list of configurations
+    (dictionaries) accepted by run_config()
+    """
+    return [{'profile': profile, 'v0': v0, 'odo_delay_ms': odo_delay_ms,
+             'tags': tuple(tags), 't_end_ms': t_end_ms}
+            for profile, v0, odo_delay_ms, tags, t_end_ms
+            in itertools.product(profiles, speeds, odo_delays_ms, tag_layouts, t_ends_ms)]
+
+# ---------------------------------------------------
+def error_summary(error, reset_steps, delta_t_ms=POS_SAMPLING_PERIOD_MS):
+    """
+    Summary of an error trace: max, mean and 95th percentile of the
+    absolute error, number of tag resets and the longest time without a
+    tag reset (from the start to the first one, between two of them or
+    from the last one to the end of the run)
+    """
+    abs_err = np.abs(error)
+    bounds = np.concatenate(([0], reset_steps, [len(error) - 1]))
+    max_time_to_reset_s = np.diff(bounds).max() * delta_t_ms / 1000
+    return {
+        'err_max': float(abs_err.max()),
+        'err_mean': float(abs_err.mean()),
+        'err_p95': float(np.percentile(abs_err, 95)),
+        'n_resets': len(reset_steps),
+        'max_time_to_reset_s': float(max_time_to_reset_s),
+    }
+
+# ---------------------------------------------------
+def run_config(config, cache_dir=None):
+    """
+    Simulates one configuration and returns its summary; with a
+    cache_dir the trace goes through the result cache
+    """
+    scenario = Scenario('sweep', config['t_end_ms'], config['v0'], SPEED_PROFILES[config['profile']],
+                        config['tags'], config['odo_delay_ms'])
+    if cache_dir is None:
+        trace = simulate_scenario(scenario)
+    else:
+        trace = ResultCache(cache_dir).simulate_scenario(scenario)
+    reset_steps, _ = tag_resets(trace.real_pos, config['tags'])
+    summary = dict(config)
+    summary.update(error_summary(trace.error, reset_steps))
+    return summary
+
+# ---------------------------------------------------
+def run_sweep(configs, workers=None, chunksize=None, cache_dir=None):
+    """
+    Runs all the configurations in a process pool (workers=None means one
+    process per core, workers=1 runs serially in this process) and
+    returns the list of summaries, in the same order as configs
+    """
+    run = partial(run_config, cache_dir=cache_dir)
+    if workers == 1:
+        return [run(config) for config in configs]
+    if chunksize is None:
+        chunksize = max(1, len(configs) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run, configs, chunksize=chunksize))
+
+# ---------------------------------------------------
+def write_table(summaries, fout):
+    writer = csv.DictWriter(fout, fieldnames=SUMMARY_FIELDS)
+    writer.writeheader()
+    for summary in summaries:
+        row = dict(summary)
+        row['tags'] = ' '.join(str(tag) for tag in summary['tags'])
+        writer.writerow(row)
+
+# ---------------------------------------------------
+def parse_tags(text):
+    return tuple(float(tag) for tag in text.split(',') if tag.strip())
+
+# ---------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parameter sweep of the tram AVL estimator')
+    parser.add_argument('--profile', nargs='+', default=['constant'], choices=sorted(SPEED_PROFILES),
+                        help='speed profiles')
+    parser.add_argument('--speed', nargs='+', type=float, default=[19.4],
+                        help='initial speeds (m/s)')
+    parser.add_argument('--odo-delay', nargs='+', type=int, default=[0],
+                        help='odometer delays (ms)')
+    parser.add_argument('--tags', action='append', type=parse_tags,
+                        help='comma separated tag positions (m), repeat for more layouts; '
+                             'an empty string means no tags')
+    parser.add_argument('--t-end', nargs='+', type=int, default=[2000],
+                        help='run durations (ms)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--cache', nargs='?', const='', metavar='DIR',
+                        help='reuse simulated traces from the result cache '
+                             '(default directory: $TRAMRUN_CACHE_DIR or ~/.cache/tramrun)')
+    parser.add_argument('--out', default='-', help='output CSV file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    configs = sweep_grid(args.profile, args.speed, args.odo_delay,
+                         args.tags or [(1019,)], args.t_end)
+    summaries = run_sweep(configs, args.workers, cache_dir=args.cache)
+
+    if args.out == '-':
+        write_table(summaries, sys.stdout)
+    else:
+        with open(args.out, 'w', newline='') as fout:
+            write_table(summaries, fout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#
+# Tag (balise) layout backed by a sorted array.
+#
+# Crossings between two positions are found with a binary search instead
+# of scanning the whole tag list, so the cost per step does not grow with
+# the number of tags on the line.
+#
+
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+# ---------------------------------------------------
+class TagLayout:
+    """
+    Sorted tag positions of a line.
+
+    A tag is crossed moving forward when prev < tag <= curr and, if the
+    layout is bidirectional, moving backward when curr <= tag < prev.
+    When several tags are crossed in the same step, check() returns the
+    one coming first in the original tag list, exactly as tag_checking()
+    does: for a list given in line order that is the first tag met.
+    """
+
+    def __init__(self, tag_pos_list, bidirectional=False):
+        tag_pos_list = tuple(tag_pos_list)
+        tags = np.asarray(tag_pos_list, dtype=np.float64)
+        order = np.argsort(tags, kind='stable')
+        self.positions = tags[order]
+        # index of every sorted tag in the original list
+        self.list_index = order
+        self.bidirectional = bidirectional
+        # plain Python copies for the scalar path (bisect is faster than
+        # np.searchsorted on single values)
+        self._positions = self.positions.tolist()
+        self._list_index = self.list_index.tolist()
+        self._values = [tag_pos_list[i] for i in self._list_index]
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __repr__(self):
+        return f"TagLayout({len(self)} tags, bidirectional={self.bidirectional})"
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _span(self, prev_pos, curr_pos):
+        """ range [lo, hi) of sorted tags crossed from prev_pos to curr_pos """
+        if curr_pos >= prev_pos:
+            return bisect_right(self._positions, prev_pos), bisect_right(self._positions, curr_pos)
+        if self.bidirectional:
+            return bisect_left(self._positions, curr_pos), bisect_left(self._positions, prev_pos)
+        return 0, 0
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def crossings(self, prev_pos, curr_pos):
+        """
+        Tags crossed moving from prev_pos to curr_pos, in travel order
+        """
+        lo, hi = self._span(prev_pos, curr_pos)
+        crossed = self._values[lo:hi]
+        if curr_pos < prev_pos:
+            crossed.reverse()
+        return crossed
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def check(self, prev_real_pos, curr_real_pos, curr_avl_pos):
+        """
+        Same contract as trammodel.tag_checking(): the position of the tag
+        read in this step, or curr_avl_pos when no tag is crossed
+        """
+        lo, hi = self._span(prev_real_pos, curr_real_pos)
+        if hi == lo:
+            return curr_avl_pos
+        if hi - lo == 1:
+            return self._values[lo]
+        first = min(range(lo, hi), key=self._list_index.__getitem__)
+        return self._values[first]
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _bulk_spans(self, real_pos, start_pos):
+        real_pos = np.asarray(real_pos, dtype=np.float64)
+        prev_pos = np.concatenate(([float(start_pos)], real_pos[:-1]))
+        forward = real_pos >= prev_pos
+        lo = np.searchsorted(self.positions, prev_pos, side='right')
+        hi = np.searchsorted(self.positions, real_pos, side='right')
+        if self.bidirectional:
+            back = ~forward
+            lo[back] = np.searchsorted(self.positions, real_pos[back], side='left')
+            hi[back] = np.searchsorted(self.positions, prev_pos[back], side='left')
+        else:
+            hi[~forward] = lo[~forward]
+        return lo, hi, forward
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def bulk_resets(self, real_pos, start_pos):
+        """
+        Tag readings over a whole position trace (real_pos[k] is the
+        position at the end of step k, start_pos the one before step 0).
+        Returns (steps, values): the steps where a tag is read and the
+        position the estimate is reset to, as check() would do per step
+        """
+        lo, hi, _ = self._bulk_spans(real_pos, start_pos)
+        steps = np.nonzero(hi > lo)[0]
+        first = lo[steps]
+        # more tags in the same step: keep the first in the original list
+        for i in np.nonzero(hi[steps] - lo[steps] > 1)[0].tolist():
+            span = slice(lo[steps[i]], hi[steps[i]])
+            first[i] = span.start + np.argmin(self.list_index[span])
+        return steps, self.positions[first]
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def bulk_crossings(self, real_pos, start_pos):
+        """
+        Every tag crossing over a whole position trace, as (steps, tags)
+        arrays with one entry per crossed tag, in travel order
+        """
+        lo, hi, forward = self._bulk_spans(real_pos, start_pos)
+        counts = hi - lo
+        steps = np.repeat(np.arange(len(counts)), counts)
+        # position of every entry inside its own step
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        sorted_index = np.where(forward[steps],
+                                lo[steps] + offset,
+                                hi[steps] - 1 - offset)
+        return steps, self.positions[sorted_index]
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+#
+# Per stage profiling of the tram simulations.
+#
+# A StageTimer records cumulative time and number of calls of every
+# stage of a simulation (update_speed, update_pos, tag_checking,
+# odometer_delta, list appends in the step loop; the array stages in the
+# vectorized engine), plus samples per second and peak memory, and dumps
+# them as a JSON report.
+#
+# Profiling is off unless a timer is passed to the simulation or the
+# TRAMRUN_PROFILE environment variable is set (to 1, or to the path of
+# the report); when off the simulations run their plain code. With
+# TRAMRUN_PROFILE, every process writes its own report, named after the
+# given path and the process id (profile.jsonl -> profile.<pid>.jsonl),
+# in JSON Lines: one line per run, appended when the run ends.
+#
+# Example:
+#   TRAMRUN_PROFILE=profile.jsonl ./tramsweep.py
+#
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+DEFAULT_REPORT = 'tramrun_profile.jsonl'
+
+# ---------------------------------------------------
+def peak_rss_bytes():
+    """
+    peak resident memory of this process since it started (not of a
+    single run), None when unknown
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# ---------------------------------------------------
+class StageTimer:
+    """
+    Cumulative time (ns) and call count of the stages of a run
+    """
+
+    def __init__(self, name='run'):
+        self.name = name
+        self.time_ns = defaultdict(int)
+        self.calls = defaultdict(int)
+        self.n_samples = 0
+        self._t0 = None
+        self.elapsed_ns = 0
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def wrap(self, stage, func):
+        """ func, timed as stage at every call """
+        time_ns = self.time_ns
+        calls = self.calls
+        clock = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            t0 = clock()
+            result = func(*args, **kwargs)
+            time_ns[stage] += clock() - t0
+            calls[stage] += 1
+            return result
+        return timed
+
+    @contextmanager
+    def stage(self, stage):
+        """ times the body of a with statement as stage """
+        t0 = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.time_ns[stage] += time.perf_counter_ns() - t0
+            self.calls[stage] += 1
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def start(self):
+        self._t0 = time.perf_counter_ns()
+
+    def stop(self, n_samples):
+        self.elapsed_ns += time.perf_counter_ns() - self._t0
+        self.n_samples += n_samples
+
+    def report(self):
+        elapsed_s = self.elapsed_ns / 1e9
+        staged_ns = sum(self.time_ns.values())
+        return {
+            'name': self.name,
+            'elapsed_s': elapsed_s,
+            'n_samples': self.n_samples,
+            'samples_per_s': self.n_samples / elapsed_s if elapsed_s else None,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'stages': {stage: {'time_s': self.time_ns[stage] / 1e9,
+                               'calls': self.calls[stage],
+                               'share': self.time_ns[stage] / self.elapsed_ns
+                                        if self.elapsed_ns else None}
+                       for stage in sorted(self.time_ns, key=self.time_ns.get, reverse=True)},
+            # loop control, timer overhead and everything outside the stages
+            'other_s': (self.elapsed_ns - staged_ns) / 1e9,
+        }
+
+    def dump(self, fname):
+        _write_json(self.report(), fname)
+
+# ---------------------------------------------------
+def _write_json(data, fname):
+    # written aside and renamed: a reader never sees a partial file
+    with open(fname + '.tmp', 'w') as fout:
+        json.dump(data, fout, indent=1)
+    os.replace(fname + '.tmp', fname)
+
+# ---------------------------------------------------
+def process_report_path(fname):
+    """ report file of this process: the process id before the extension """
+    stem, ext = os.path.splitext(fname)
+    return f"{stem}.{os.getpid()}{ext or '.jsonl'}"
+
+def add_report(timer, fname):
+    """
+    appends the report of a run, as one JSON line, to the report file of
+    this process (see process_report_path()); returns its path
+    """
+    path = process_report_path(fname)
+    with open(path, 'a') as fout:
+        fout.write(json.dumps(timer.report()) + '\n')
+    return path
+
+def read_reports(path):
+    """ the reports of the runs stored in a report file """
+    with open(path) as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+# ---------------------------------------------------
+def timer_from_env(name):
+    """
+    (timer, report path) when TRAMRUN_PROFILE is set, (None, None) otherwise
+    """
+    value = os.environ.get('TRAMRUN_PROFILE', '')
+    if value in ('', '0'):
+        return None, None
+    return StageTimer(name), DEFAULT_REPORT if value == '1' else value
+
+# ---------------------------------------------------
+def main():
+    from trammodel import SCENARIOS, simulate_loop
+    from tramvec import simulate
+
+    scenario = SCENARIOS[-1]._replace(t_end_ms=60 * 1000)
+    for name, run in (('loop', simulate_loop), ('vec', simulate)):
+        timer = StageTimer(f"{name}: {scenario.name}")
+        run(scenario.t_end_ms, scenario.v0, scenario.update_speed, scenario.tags,
+            scenario.odo_delay_ms, profile=timer)
+        print(json.dumps(timer.report(), indent=1))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+#
+# Columnar, array backed storage of tram traces.
+#
+# A TraceStore replaces the parallel Python lists (t_array, real_pos, odo,
+# avl_pos, error) with one preallocated NumPy column each, in float32 or
+# float64. It can live in memory or be spilled to a directory of .npy
+# files mapped in memory, which can be reopened later with zero copy.
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+import numpy as np
+
+from trammodel import SCENARIOS, update_speed_constant
+from tramvec import TramTrace, simulate_scenario
+from tramstream import stream_chunks
+
+COLUMNS = TramTrace._fields
+META_FILE = 'trace.json'
+
+# ---------------------------------------------------
+class TraceStore:
+    """
+    Preallocated column store of a tram trace.
+
+    Columns are exposed as array views of the filled part only
+    (store.error, store['error'], store.as_trace()). The time column is
+    always float64: float32 cannot resolve 4 ms steps in runs longer
+    than a few hours.
+    """
+
+    def __init__(self, capacity, dtype=np.float64, path=None):
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError(f"unsupported dtype {dtype}, use float32 or float64")
+        self.dtype = dtype
+        self.capacity = capacity
+        self.path = path
+        self.length = 0
+        self._writable = True
+        self._columns = {}
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        for name in COLUMNS:
+            col_dtype = np.float64 if name == 't' else dtype
+            if path is None:
+                self._columns[name] = np.empty(capacity, dtype=col_dtype)
+            else:
+                self._columns[name] = np.lib.format.open_memmap(
+                    os.path.join(path, name + '.npy'), mode='w+', dtype=col_dtype, shape=(capacity,))
+        self._write_meta()
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    @classmethod
+    def open(cls, path, mode='r'):
+        """
+        Reopens a store saved in path; the columns are memory mapped
+        (mode 'r' read only, 'r+' to append further samples)
+        """
+        with open(os.path.join(path, META_FILE)) as fmeta:
+            meta = json.load(fmeta)
+        store = cls.__new__(cls)
+        store.dtype = np.dtype(meta['dtype'])
+        store.capacity = meta['capacity']
+        store.length = meta['length']
+        store.path = path
+        # the meta data is written back only when appending is allowed
+        store._writable = mode == 'r+'
+        store._columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+                          for name in COLUMNS}
+        return store
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    @classmethod
+    def from_trace(cls, trace, dtype=np.float64, path=None):
+        store = cls(len(trace.t), dtype, path)
+        store.append(trace)
+        return store
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _write_meta(self):
+        if self.path is None or not self._writable:
+            return
+        with open(os.path.join(self.path, META_FILE), 'w') as fmeta:
+            json.dump({'dtype': self.dtype.name, 'capacity': self.capacity,
+                       'length': self.length, 'columns': list(COLUMNS)}, fmeta)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _grow(self, min_capacity):
+        if self.path is not None:
+            raise ValueError(f"memory mapped store is full (capacity {self.capacity}), "
+                             "create it with a larger capacity")
+        capacity = max(min_capacity, 2 * self.capacity)
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.length] = column[:self.length]
+            self._columns[name] = grown
+        self.capacity = capacity
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def append(self, trace):
+        """
+        Appends a TramTrace (or any object with the same array fields),
+        e.g. one of the chunks yielded by tramstream.stream_chunks()
+        """
+        n = len(trace.t)
+        if self.length + n > self.capacity:
+            self._grow(self.length + n)
+        for name in COLUMNS:
+            self._columns[name][self.length:self.length + n] = getattr(trace, name)
+        self.length += n
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def flush(self):
+        """ writes the memory mapped columns and the length to disk """
+        for column in self._columns.values():
+            if isinstance(column, np.memmap):
+                column.flush()
+        self._write_meta()
+
+    def close(self):
+        self.flush()
+        self._columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - -
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        return self._columns[name][:self.length]
+
+    def __getattr__(self, name):
+        if name in COLUMNS:
+            return self[name]
+        raise AttributeError(name)
+
+    def as_trace(self):
+        """ TramTrace of views on the columns, no data is copied """
+        return TramTrace(*(self[name] for name in COLUMNS))
+
+    @property
+    def nbytes(self):
+        return sum(self[name].nbytes for name in COLUMNS)
+
+# ---------------------------------------------------
+def record_stream(chunks, capacity, dtype=np.float64, path=None):
+    """
+    Stores the chunks of a streamed run in a new TraceStore
+    """
+    store = TraceStore(capacity, dtype, path)
+    for chunk in chunks:
+        store.append(chunk)
+    store.flush()
+    return store
+
+# ---------------------------------------------------
+def main(argv):
+    # the demo store goes to a temporary directory unless a path is given
+    path = argv[1] if len(argv) > 1 else tempfile.mkdtemp(prefix='tramtrace_')
+
+    # 1. round trip of the plotted scenarios
+    for scenario in SCENARIOS:
+        trace = simulate_scenario(scenario)
+        store = TraceStore.from_trace(trace)
+        assert all(np.array_equal(a, b) for a, b in zip(store.as_trace(), trace)), scenario.name
+
+    # 2. two hours run streamed to disk in float32, then reopened
+    t_end_ms = 2 * 3600 * 1000
+    t0 = time.perf_counter()
+    chunks = stream_chunks(t_end_ms, 19.4, update_speed_constant, (1019,), 256)
+    with record_stream(chunks, t_end_ms // 4 + 1, np.float32, path) as store:
+        print(f"{len(store)} samples written in {path} in {time.perf_counter() - t0:.2f} s "
+              f"({store.nbytes / 2**20:.1f} MiB)")
+    store = TraceStore.open(path)
+    print(f"reopened: {len(store)} samples, max error {np.abs(store.error).max():.3f} m")
+    store.close()
+    if len(argv) <= 1:
+        shutil.rmtree(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
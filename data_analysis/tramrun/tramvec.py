@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+#
+# Vectorized (NumPy) engine for the tramrun simulations.
+#
+# Computes a whole run as arrays instead of stepping a Python loop every
+# POS_SAMPLING_PERIOD_MS. The results are bit-identical to
+# trammodel.simulate_loop(): positions and AVL estimates are accumulated
+# with np.add.accumulate, which adds strictly left to right exactly as the
+# loop does.
+#
+
+import sys
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+
+import numpy as np
+
+from trammodel import POS_SAMPLING_PERIOD_MS, ODO_SAMPLING_PERIOD_MS, START_POS
+from trammodel import update_speed_constant, update_speed_constant_until2_then_stop
+from trammodel import update_speed_constant_until2_then_soft_bracking
+from tramtags import TagLayout
+from tramtiming import timer_from_env, add_report
+from trammodel import SCENARIOS, Scenario, simulate_scenario_loop
+
+TramTrace = namedtuple('TramTrace', ['t', 'real_pos', 'odo', 'avl_pos', 'error'])
+
+# ---------------------------------------------------
+def time_vector_ms(t_end_ms, period_ms=POS_SAMPLING_PERIOD_MS):
+    """
+    Sampling instants (ms) of a run starting at 0 and ending at t_end_ms
+    (included, as in the `while t_ms <= t_end_ms` loop)
+    """
+    return np.arange(0, t_end_ms + 1, period_ms, dtype=np.int64)
+
+# ---------------------------------------------------
+def speed_trace_constant(t_ms, v0):
+    return np.full(len(t_ms), v0, dtype=np.float64)
+
+# ---------------------------------------------------
+def speed_trace_until2_then_stop(t_ms, v0):
+    return np.where(t_ms < 2000, v0, 0.0)
+
+# ---------------------------------------------------
+def speed_trace_until2_then_soft_bracking(t_ms, v0):
+    speed = np.full(len(t_ms), v0, dtype=np.float64)
+    braking = np.nonzero(t_ms >= 2000)[0]
+    if len(braking) == 0:
+        return speed
+    k0 = braking[0]
+    # v, v - 0.05, v - 0.05 - 0.05, ... subtracted one step at a time
+    ramp = np.subtract.accumulate(np.concatenate(([float(v0)], np.full(len(t_ms) - k0, 0.05))))
+    # the speed is decreased only while the previous one is >= 1, then it is 0 forever
+    still_braking = np.logical_and.accumulate(ramp[:-1] >= 1)
+    speed[k0:] = np.where(still_braking, ramp[1:], 0.0)
+    return speed
+
+# ---------------------------------------------------
+def speed_trace_from_callback(update_speed, v0, t_ms, delta_t_ms=POS_SAMPLING_PERIOD_MS):
+    """
+    Fallback for speed callbacks without a vectorized twin: the callback
+    is still called once per step, but everything else stays vectorized
+    """
+    speed = np.empty(len(t_ms), dtype=np.float64)
+    v = v0
+    for k, t in enumerate(t_ms.tolist()):
+        v = update_speed(v, t, delta_t_ms)
+        speed[k] = v
+    return speed
+
+# vectorized twins of the trammodel.update_speed_* callbacks: v0 is the
+# speed before the first sample of t_ms, so a run can also be computed in
+# consecutive pieces passing the last speed of the previous one
+SPEED_TRACES = {
+    update_speed_constant: speed_trace_constant,
+    update_speed_constant_until2_then_stop: speed_trace_until2_then_stop,
+    update_speed_constant_until2_then_soft_bracking: speed_trace_until2_then_soft_bracking,
+}
+
+# ---------------------------------------------------
+def has_speed_twin(update_speed, delta_t_ms=POS_SAMPLING_PERIOD_MS):
+    """ True when speed_trace() does not fall back to the per step callback """
+    # the twins are written for the default sampling period
+    return update_speed in SPEED_TRACES and delta_t_ms == POS_SAMPLING_PERIOD_MS
+
+def speed_trace(update_speed, v0, t_ms, delta_t_ms=POS_SAMPLING_PERIOD_MS):
+    if has_speed_twin(update_speed, delta_t_ms):
+        return SPEED_TRACES[update_speed](t_ms, v0)
+    return speed_trace_from_callback(update_speed, v0, t_ms, delta_t_ms)
+
+# ---------------------------------------------------
+def position_trace(speed, start_pos=START_POS, delta_t_ms=POS_SAMPLING_PERIOD_MS):
+    """
+    Position at the end of every step, i.e. the real_pos list of the loop
+    """
+    steps = speed * delta_t_ms / 1000
+    return np.add.accumulate(np.concatenate(([float(start_pos)], steps)))[1:]
+
+# ---------------------------------------------------
+def odometer_deltas(t_ms, real_pos, odo_delay_ms,
+                    odo_period_ms=ODO_SAMPLING_PERIOD_MS, pos_period_ms=POS_SAMPLING_PERIOD_MS):
+    """
+    Odometer increment applied at every step (0 outside odometer samples),
+    the same value returned by trammodel.odometer_delta()
+    """
+    if odo_delay_ms < 0:
+        raise ValueError(f"odometer delay shall be >= 0 (got {odo_delay_ms})")
+    deltas = np.zeros(len(t_ms), dtype=np.float64)
+    t_new_odo_ms = t_ms - odo_delay_ms
+    t_prev_odo_ms = t_new_odo_ms - odo_period_ms
+    sampled = np.nonzero((t_ms % odo_period_ms == 0) & (t_prev_odo_ms >= 0))[0]
+    deltas[sampled] = np.abs(real_pos[t_new_odo_ms[sampled] // pos_period_ms] -
+                             real_pos[t_prev_odo_ms[sampled] // pos_period_ms])
+    return deltas
+
+# ---------------------------------------------------
+def tag_resets(real_pos, tag_pos_list, start_pos=START_POS):
+    """
+    Returns (steps, values): the steps where a tag is read and the tag
+    position the AVL estimate is reset to. As in tag_checking(), when more
+    tags are crossed in one step the first one in tag_pos_list wins.
+    tag_pos_list can be a plain sequence or a TagLayout
+    """
+    if not isinstance(tag_pos_list, TagLayout):
+        tag_pos_list = TagLayout(tag_pos_list)
+    return tag_pos_list.bulk_resets(real_pos, start_pos)
+
+# ---------------------------------------------------
+def avl_trace(odo, reset_steps, reset_values, start_pos=START_POS):
+    """
+    AVL estimate: odometer deltas accumulated from the start position,
+    restarting from the tag position at every tag reading
+    """
+    avl_pos = np.empty(len(odo), dtype=np.float64)
+    starts = np.concatenate(([0], reset_steps)).astype(np.int64)
+    bases = np.concatenate(([float(start_pos)], reset_values))
+    ends = np.concatenate((starts[1:], [len(odo)]))
+    for start, end, base in zip(starts.tolist(), ends.tolist(), bases.tolist()):
+        if end > start:
+            avl_pos[start:end] = np.add.accumulate(np.concatenate(([base], odo[start:end])))[1:]
+    return avl_pos
+
+# ---------------------------------------------------
+def _no_stage(name):
+    return nullcontext()
+
+# ---------------------------------------------------
+def simulate(t_end_ms, v0, update_speed, tag_pos_list, odo_delay_ms, start_pos=START_POS,
+             speed=None, pos_period_ms=POS_SAMPLING_PERIOD_MS, profile=None):
+    """
+    Vectorized equivalent of trammodel.simulate_loop(). A precomputed
+    speed trace (one value per step) can be passed instead of the
+    update_speed callback. With a tramtiming.StageTimer as profile (or
+    TRAMRUN_PROFILE set) every stage is timed.
+    """
+    report = None
+    if profile is None:
+        profile, report = timer_from_env('tramvec.simulate')
+    stage = _no_stage
+    if profile is not None:
+        stage = profile.stage
+        profile.start()
+
+    t_ms = time_vector_ms(t_end_ms, pos_period_ms)
+    with stage('speed'):
+        if speed is None:
+            speed = speed_trace(update_speed, v0, t_ms, pos_period_ms)
+    with stage('position'):
+        real_pos = position_trace(speed, start_pos, pos_period_ms)
+    with stage('odometer'):
+        odo = odometer_deltas(t_ms, real_pos, odo_delay_ms, pos_period_ms=pos_period_ms)
+    with stage('tags'):
+        reset_steps, reset_values = tag_resets(real_pos, tag_pos_list, start_pos)
+    with stage('avl'):
+        avl_pos = avl_trace(odo, reset_steps, reset_values, start_pos)
+    trace = TramTrace(t_ms / 1000, real_pos, odo, avl_pos, real_pos - avl_pos)
+
+    if profile is not None:
+        profile.stop(len(t_ms))
+        if report is not None:
+            add_report(profile, report)
+    return trace
+
+# ---------------------------------------------------
+def simulate_scenario(scenario):
+    return simulate(scenario.t_end_ms, scenario.v0, scenario.update_speed,
+                    scenario.tags, scenario.odo_delay_ms)
+
+# ---------------------------------------------------
+def main():
+    # 1. the vectorized engine shall reproduce the loop exactly
+    all_ok = True
+    for scenario in SCENARIOS:
+        t_array, real_pos, avl_pos, error = simulate_scenario_loop(scenario)
+        trace = simulate_scenario(scenario)
+        ok = (np.array_equal(trace.t, t_array) and
+              np.array_equal(trace.real_pos, real_pos) and
+              np.array_equal(trace.avl_pos, avl_pos) and
+              np.array_equal(trace.error, error))
+        all_ok = all_ok and ok
+        print(f"{scenario.name:52s} {'OK' if ok else 'MISMATCH'}")
+
+    # 2. timing of a one hour run
+    one_hour = Scenario('one_hour', 3600 * 1000, 19.4, update_speed_constant, (1019,), 256)
+    t0 = time.perf_counter()
+    trace = simulate_scenario(one_hour)
+    elapsed = time.perf_counter() - t0
+    print(f"one hour run: {len(trace.t)} samples in {elapsed * 1000:.1f} ms")
+
+    return 0 if all_ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())